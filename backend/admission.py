@@ -0,0 +1,209 @@
+"""预约接口的准入控制
+
+新一天的排班开放时，大量患者会在同一秒内抢少数几个医生的同一个时间段。
+这些请求最终都要争同一个 SQLite 写锁，排在后面的请求即使名额早已约满，也要等锁、
+失败后再返回，白白占用 worker。这里在 /user/book 前面按 (医生, 日期, 时间段) 排队：
+  - 每个时间段同时最多 BOOKING_KEY_CONCURRENCY 个请求进入数据库，其余按到达顺序（FIFO）排队
+  - 每个时间段的队列长度有上限，排满或等待超时时返回 429 和 Retry-After
+  - 根据最近一次预约/取消得到的剩余名额，排队的请求已经足够占满名额时，
+    新请求不再排队，直接返回 429（前面的请求失败时名额可能空出来，稍后重试）；
+    没有请求在处理、名额已满时直接按“名额已满”返回，不访问数据库
+    估计偏乐观：处理中的请求不计入，宁可多放行几个请求由数据库拒绝，也不让名额空着
+剩余名额只在本进程内记录，超过 BOOKING_CAPACITY_TTL_MS 后不再使用，多进程部署时每个 worker 分别排队。
+
+配置项可以写在 app.config 中，未设置时从同名环境变量读取：
+    BOOKING_ADMISSION           设为 0 时不启用，默认启用
+    BOOKING_KEY_CONCURRENCY     每个时间段同时进入数据库的请求数，默认 1
+    BOOKING_QUEUE_LENGTH        每个时间段最多排队的请求数，默认 64
+    BOOKING_QUEUE_TIMEOUT_MS    排队等待的最长时间（毫秒），默认 3000
+    BOOKING_CAPACITY_TTL_MS     记录的剩余名额的有效期（毫秒），默认 2000
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+MAX_IDLE_SLOTS = 10000  # 超过后清理空闲且剩余名额已过期的时间段
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入；full 为 True 表示名额已满（按原来的 400 返回），否则返回 429 并带上 retry_after"""
+
+    def __init__(self, message, retry_after=None, full=False):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.full = full
+
+
+class _Waiter:
+    __slots__ = ('thread_id', 'event', 'admitted', 'reason')
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.event = threading.Event()
+        self.admitted = None  # None 表示还在排队，True 准入，False 被拒绝
+        self.reason = None  # 被拒绝的原因
+
+
+class _Slot:
+    """一个时间段的排队状态"""
+    __slots__ = ('holders', 'waiters', 'remaining', 'checked_at')
+
+    def __init__(self):
+        # 已准入、还在访问数据库的请求所在的线程；预约提交后 observe 就把它移出，提前放行下一个请求
+        self.holders = set()
+        self.waiters = deque()
+        self.remaining = None  # 最近一次得知的剩余名额，None 表示未知
+        self.checked_at = 0.0
+
+
+class BookingAdmission:
+    """按时间段排队的准入控制"""
+
+    def __init__(self):
+        self.enabled = True
+        self.concurrency = 1
+        self.queue_length = 64
+        self.queue_timeout = 3.0
+        self.capacity_ttl = 2.0
+        self.service_time = 0.005  # 每个请求占用的平均秒数（指数移动平均），用于估算 Retry-After
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {'exhausted': 0, 'full': 0, 'queue_full': 0, 'timeout': 0}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _known_remaining(self, slot, now):
+        if slot.remaining is None or now - slot.checked_at >= self.capacity_ttl:
+            return None
+        return slot.remaining
+
+    def _retry_after(self, ahead):
+        """排在前面的 ahead 个请求处理完的预计秒数，至少 1 秒"""
+        return max(1, math.ceil(self.service_time * ahead / self.concurrency))
+
+    def _reject(self, reason, slot, slot_period):
+        self.rejected[reason] += 1
+        if reason == 'full':
+            return AdmissionRejected(f'No available slots in the {slot_period}', full=True)
+        if reason == 'exhausted':
+            message = 'Remaining slots are being booked by other patients, retry later'
+        else:
+            message = 'Too many booking requests for this slot, retry later'
+        return AdmissionRejected(message, retry_after=self._retry_after(len(slot.holders) + len(slot.waiters)))
+
+    def acquire(self, key):
+        """准入一个预约请求，必要时按到达顺序排队等待；未准入时抛出 AdmissionRejected"""
+        if not self.enabled:
+            return
+        period = 'morning' if key[2] == '上午' else 'afternoon'
+        thread_id = threading.get_ident()
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                if len(self._slots) >= MAX_IDLE_SLOTS:
+                    self._prune(time.monotonic())
+                slot = self._slots[key] = _Slot()
+            remaining = self._known_remaining(slot, time.monotonic())
+            if remaining is not None and remaining <= len(slot.waiters):
+                # 排队的请求已经足够占满剩余名额
+                raise self._reject('full' if not slot.holders and not slot.waiters else 'exhausted', slot, period)
+            if len(slot.holders) < self.concurrency and not slot.waiters:
+                slot.holders.add(thread_id)
+                self.admitted += 1
+                return
+            if len(slot.waiters) >= self.queue_length:
+                raise self._reject('queue_full', slot, period)
+            waiter = _Waiter(thread_id)
+            slot.waiters.append(waiter)
+            self.queued += 1
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.admitted is None:
+                # 超时：仍在队列中，自己移出
+                slot.waiters.remove(waiter)
+                raise self._reject('timeout', slot, period)
+            if not waiter.admitted:
+                raise self._reject(waiter.reason, slot, period)
+            self.admitted += 1
+
+    def release(self, key, elapsed=None):
+        """预约请求处理完毕，按顺序放行排队的请求；elapsed 为占用的秒数"""
+        if not self.enabled:
+            return
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return
+            slot.holders.discard(threading.get_ident())
+            if elapsed is not None:
+                self.service_time += (elapsed - self.service_time) * 0.1
+            self._dispatch(key, slot, time.monotonic())
+
+    def observe(self, doctor_id, date, period, booked, limit):
+        """记录预约、取消或预约失败后得知的名额；名额空出来时放行排队的请求"""
+        if not self.enabled:
+            return
+        key = (doctor_id, date, period)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return
+            # 在已准入请求的线程中调用时（预约已提交），这个请求不再占用并发数
+            slot.holders.discard(threading.get_ident())
+            slot.remaining = limit - booked
+            slot.checked_at = time.monotonic()
+            self._dispatch(key, slot, slot.checked_at)
+
+    def _dispatch(self, key, slot, now):
+        """按顺序放行排队的请求；剩余名额已经不够排队的请求时，从队尾拒绝多出来的请求"""
+        remaining = self._known_remaining(slot, now)
+        if remaining is not None:
+            while slot.waiters and len(slot.waiters) > remaining:
+                waiter = slot.waiters.pop()
+                waiter.admitted = False
+                waiter.reason = 'full' if remaining <= 0 and not slot.holders else 'exhausted'
+                waiter.event.set()
+        while slot.waiters and len(slot.holders) < self.concurrency:
+            waiter = slot.waiters.popleft()
+            slot.holders.add(waiter.thread_id)
+            waiter.admitted = True
+            waiter.event.set()
+        if not slot.holders and not slot.waiters and remaining is None:
+            del self._slots[key]
+
+    def _prune(self, now):
+        """清理空闲且剩余名额已过期的时间段"""
+        for key in [key for key, slot in self._slots.items()
+                    if not slot.holders and not slot.waiters and self._known_remaining(slot, now) is None]:
+            del self._slots[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': dict(self.rejected),
+                'slots': len(self._slots),
+                'waiting': sum(len(slot.waiters) for slot in self._slots.values()),
+                'service_time_ms': round(self.service_time * 1000, 3),
+            }
+
+
+booking_admission = BookingAdmission()
+
+
+def init_admission(app):
+    """读取准入控制的配置"""
+    config = app.config
+    booking_admission.enabled = config.get('BOOKING_ADMISSION', os.environ.get('BOOKING_ADMISSION', '1')) not in (False, '0')
+    booking_admission.concurrency = int(config.get('BOOKING_KEY_CONCURRENCY', os.environ.get('BOOKING_KEY_CONCURRENCY', 1)))
+    booking_admission.queue_length = int(config.get('BOOKING_QUEUE_LENGTH', os.environ.get('BOOKING_QUEUE_LENGTH', 64)))
+    booking_admission.queue_timeout = float(config.get(
+        'BOOKING_QUEUE_TIMEOUT_MS', os.environ.get('BOOKING_QUEUE_TIMEOUT_MS', 3000))) / 1000
+    booking_admission.capacity_ttl = float(config.get(
+        'BOOKING_CAPACITY_TTL_MS', os.environ.get('BOOKING_CAPACITY_TTL_MS', 2000))) / 1000
@@ -0,0 +1,80 @@
+"""医生可预约情况的进程内快照缓存
+
+快照是所有患者共享的医生/名额数据，按日期窗口缓存，并带一个单调递增的版本号：
+  - 预约、取消只改变一个时间段的计数，直接在快照上原地修改并推进版本号
+  - 排班、医生信息的修改使所有快照失效，下次读取时重建
+缓存只在本进程内有效，多进程部署时其他进程的写入要等 ttl 过期后才能看到。
+"""
+import threading
+import time
+
+
+class AvailabilityCache:
+    """按日期窗口缓存可预约情况快照"""
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl  # 快照最长存活秒数，None 表示只依赖写入时失效
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.patches = 0
+        self.invalidations = 0
+        self._snapshots = {}  # (开始日期, 结束日期) -> [版本号, 创建时间, 快照]
+        self._lock = threading.Lock()
+
+    def get(self, start, end, build):
+        """返回窗口 [start, end] 的快照，缓存失效时调用 build(start, end) 重建"""
+        key = (start, end)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._snapshots.get(key)
+            if entry is not None and entry[0] == self.version and (self.ttl is None or now - entry[1] < self.ttl):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            version = self.version
+        snapshot = build(start, end)
+        with self._lock:
+            self.rebuilds += 1
+            # 重建期间有写入时不缓存，避免把旧数据当作新版本保存
+            if self.version == version:
+                # 顺便清掉已经过去的窗口
+                for old in [k for k in self._snapshots if k[0] < start]:
+                    del self._snapshots[old]
+                self._snapshots[key] = [version, now, snapshot]
+        return snapshot
+
+    def patch_slot(self, doctor_id, date, period, delta):
+        """预约或取消后原地修改快照中对应时间段的已预约人数"""
+        with self._lock:
+            self.version += 1
+            self.patches += 1
+            for key, entry in list(self._snapshots.items()):
+                if entry[0] != self.version - 1:
+                    del self._snapshots[key]
+                    continue
+                row = entry[2]['index'].get((doctor_id, date))
+                if row is not None:
+                    row[2 if period == '上午' else 4] += delta
+                entry[0] = self.version
+
+    def invalidate(self):
+        """排班或医生信息变化后使所有快照失效"""
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._snapshots.clear()
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'rebuilds': self.rebuilds,
+                'patches': self.patches,
+                'invalidations': self.invalidations,
+                'snapshots': len(self._snapshots)
+            }
@@ -1,35 +1,91 @@
 from pprint import pprint
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, request, jsonify, Response, send_file
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS  # 导入CORS
+import os
 from database import *
+from migrations import upgrade
+from engine_profile import init_engine
+from sqlalchemy.exc import IntegrityError
+from admission import AdmissionRejected, booking_admission, init_admission
+from group_commit import group_writer, init_group_commit
+from time_slots import check_limit, default_slot_minutes, parse_slot_time, slot_time, validate_slot_minutes
+from bulk_import import import_file
+from metrics import init_metrics, request_metrics
+from profiler import MAX_PROFILE_SECONDS, MODES as PROFILE_MODES, init_profiler, request_profiler
+from serializers import (APPOINTMENT_FIELDS, AVAILABILITY_FIELDS, DOCTOR_APPOINTMENT_FIELDS, DOCTOR_FIELDS,
+                         USER_FIELDS, WAITLIST_FIELDS, InvalidFields, json_response, requested_fields, select_fields,
+                         stream_json_array)
+from reconcile import reconcile_booked_counters, reconcile_stats
+from schedule_horizon import horizon_days, start_materializer
+import click
+import time
 from functools import wraps
 
-app = Flask(__name__)
-CORS(app)  # 启用CORS
+# 所有接口注册在蓝图上，由 create_app 创建应用时挂载；cli_group=None 让命令直接挂在 flask 下
+api = Blueprint('api', __name__, cli_group=None)
+jwt = JWTManager()
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = "secret_key"  # 更改为实际的密钥
 
-jwt = JWTManager(app)
-db.init_app(app)
-
-@app.before_first_request
-def create_tables():
+def init_db(seed=False):
+    """
+    建表、执行迁移并创建默认管理员，seed 为 True 时再写入 init_tables 的示例数据
+    可以重复执行，已存在的数据不会被修改；需在应用上下文中调用
+    """
     db.create_all()
+    # create_all 不会修改已有的表，旧库需要执行迁移
+    upgrade(db.engine)
     # 检查管理员用户是否已经存在
     if not Admin.query.first():
         create_admin('admin', 'adminpassword')
         print("Database initialized and admin user created.")
     else:
         print("Admin user already exists.")
+    if seed:
+        init_tables()
+    materialize_schedules()
 
-    # 检查初始医生是否已经存在
-    init_tables()
+@api.cli.command('init-db')
+@click.option('--seed/--no-seed', default=False, help='同时写入示例医生、用户和排班')
+def init_db_command(seed):
+    """
+    初始化数据库，部署或升级后执行一次，之后启动的 worker 不再做任何初始化
+    用法：flask --app backend init-db [--seed]
+    """
+    init_db(seed)
+
+@api.cli.command('materialize-schedules')
+def materialize_schedules_command():
+    """
+    按每周模板补齐预约窗口内的排班，并归档过期排班；可重复执行，建议每天由 cron 执行一次
+    用法：flask --app backend materialize-schedules
+    """
+    t0 = time.perf_counter()
+    result = materialize_schedules()
+    click.echo(f"inserted {result['inserted']} schedules, archived {result['archived']} in {time.perf_counter() - t0:.2f}s")
+
+@api.cli.command('reconcile-counters')
+@click.option('--full', is_flag=True, help='检查整个预约窗口，而不只是有预约变化的日期')
+def reconcile_counters_command(full):
+    """
+    校对排班的已预约人数并修正偏差；可重复执行，建议由 cron 每隔几分钟执行一次
+    用法：flask --app backend reconcile-counters [--full]
+    """
+    result = reconcile_booked_counters(full)
+    click.echo(f"checked {result['rows_checked']} schedules on {result['dates_checked']} days, "
+               f"repaired {result['rows_repaired']}/{result['rows_mismatched']} (drift {result['total_drift']}, "
+               f"max {result['max_drift']}, over limit {result['over_limit']}) in {result['seconds']:.2f}s")
+
+@api.cli.command('seed')
+def seed_command():
+    """
+    写入示例医生、用户和排班（会先执行 init-db）
+    用法：flask --app backend seed
+    """
+    init_db(seed=True)
 
 # 用户登录路由
-@app.route('/login/user', methods=['POST'])
+@api.route('/login/user', methods=['POST'])
 def login_user():
     """
     用户登录
@@ -45,13 +101,13 @@ def login_user():
     """
     data = request.get_json()
     user = get_user_by_identity(data['username'])
-    if user and check_password_hash(user.password_hash, data['password']):
+    if user and check_account_password(user, data['password']):
         access_token = create_access_token(identity={'id': user.id, 'role': 'user'})
         return jsonify(access_token=access_token), 200
     return jsonify({"msg": "Invalid credentials"}), 401
 
 # 医生登录路由
-@app.route('/login/doctor', methods=['POST'])
+@api.route('/login/doctor', methods=['POST'])
 def login_doctor():
     """
     医生登录
@@ -67,13 +123,13 @@ def login_doctor():
     """
     data = request.get_json()
     doctor = get_doctor_by_id(data['username'])
-    if doctor and check_password_hash(doctor.password_hash, data['password']):
+    if doctor and check_account_password(doctor, data['password']):
         access_token = create_access_token(identity={'id': doctor.id, 'role': 'doctor'})
         return jsonify(access_token=access_token), 200
     return jsonify({"msg": "Invalid credentials"}), 401
 
 # 管理员登录路由
-@app.route('/login/admin', methods=['POST'])
+@api.route('/login/admin', methods=['POST'])
 def login_admin():
     """
     管理员登录
@@ -89,7 +145,7 @@ def login_admin():
     """
     data = request.get_json()
     admin = get_admin_by_username(data['username'])
-    if admin and check_password_hash(admin.password_hash, data['password']):
+    if admin and check_account_password(admin, data['password']):
         access_token = create_access_token(identity={'id': admin.id, 'role': 'admin'})
         return jsonify(access_token=access_token), 200
     return jsonify({"msg": "Invalid credentials"}), 401
@@ -108,7 +164,38 @@ def role_required(role):
     return wrapper
 
 
-@app.route('/register', methods=['POST'])
+# 预约列表每页最多返回的条数
+MAX_PAGE_LIMIT = 1000
+
+def parse_page_args():
+    """
+    解析预约列表的分页和日期范围参数：
+        after_id: 上一页最后一条预约ID  # int, optional
+        limit: 每页条数，不超过 MAX_PAGE_LIMIT  # int, optional，不传则返回全部
+        from / to: 预约日期范围 (YYYY-MM-DD)  # string, optional
+    参数非法时抛出 ValueError
+    """
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 0 < limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_LIMIT}')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    date_from = datetime.strptime(date_from, "%Y-%m-%d").date() if date_from else None
+    date_to = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else None
+    return after_id, limit, date_from, date_to
+
+def page_response(result, rows, limit):
+    """返回列表响应，满页时通过 X-Next-After-Id 头给出下一页的 after_id"""
+    response = json_response(result)
+    if limit is not None and len(rows) == limit:
+        response.headers['X-Next-After-Id'] = str(rows[-1][0])
+    return response
+
+# 流式响应每批从数据库读取的行数
+STREAM_BATCH_SIZE = 1000
+
+@api.route('/register', methods=['POST'])
 def register_user():
     """
     用户注册
@@ -140,11 +227,20 @@ def register_user():
     )
     return jsonify({'id': user.id, 'name': user.name}), 201
 
-@app.route('/user/doctors_available', methods=['GET'])
+@api.route('/user/doctors_available', methods=['GET'])
 @jwt_required()
 def available_doctors():
     """
     查询所有可预约医生信息
+    查询参数：days  # int, optional，从今天起查询的天数，默认 3，不超过预约窗口天数
+             fields  # string, optional，逗号分隔的医生字段，只返回这些字段（如 id,name,available_times）
+             以下筛选条件均可选，传了任意一个时在数据库中筛选，只返回有符合条件排班的医生：
+             department  # string，科室
+             title  # string，职称
+             name  # string，姓名前缀
+             date  # string，只查这一天，"MM月DD日" 或 "YYYY-MM-DD"，可以超出 days 但不能超出预约窗口
+             period  # string，上午/下午，只返回这个时间段
+             only_available  # true/1，只返回还有名额的时间段
     返回数据格式：
     [
         {
@@ -177,57 +273,135 @@ def available_doctors():
     """
     identity = get_jwt_identity()
     user_id = identity['id']
-    doctors = get_all_doctors()
-    result = []
-    
-    for doctor in doctors:
-        schedules = get_doctor_schedule(doctor.id)
-        available_times = []
-        
-        for schedule in schedules:
-            # 检查用户是否在当前时间段已经预约了这个医生
-            morning_appointment = Appointment.query.filter_by(
-                user_id=user_id, doctor_id=doctor.id, appointment_date=datetime.strptime(schedule['date'], "%m月%d日").date().replace(year=datetime.today().year), appointment_period='上午'
-            ).first()
-            
-            afternoon_appointment = Appointment.query.filter_by(
-                user_id=user_id, doctor_id=doctor.id, appointment_date=datetime.strptime(schedule['date'], "%m月%d日").date().replace(year=datetime.today().year), appointment_period='下午'
-            ).first()
-            
-            available_times.append({
-                'date': schedule['date'],
-                'slots': [
-                    {
-                        'period': '上午',
-                        'booked': schedule['morning_booked'],
-                        'limit': schedule['morning_limit'],
-                        'available': schedule['morning_limit'] - schedule['morning_booked'] > 0,
-                        'user_booked': morning_appointment is not None
-                    },
-                    {
-                        'period': '下午',
-                        'booked': schedule['afternoon_booked'],
-                        'limit': schedule['afternoon_limit'],
-                        'available': schedule['afternoon_limit'] - schedule['afternoon_booked'] > 0,
-                        'user_booked': afternoon_appointment is not None
-                    }
+    days = request.args.get('days', 3, type=int)
+    days = max(1, min(days, horizon_days()))
+    try:
+        fields = requested_fields(AVAILABILITY_FIELDS)
+        filters = parse_availability_filters()
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    if filters:
+        doctors = search_doctors_availability(user_id, days, **filters)
+    else:
+        doctors = get_doctors_availability(user_id, days)
+    return json_response(select_fields(doctors, fields))
+
+def parse_availability_filters():
+    """解析 /user/doctors_available 的筛选参数，返回 search_doctors_availability 的关键字参数，参数非法时抛出 ValueError"""
+    filters = {}
+    for arg, key in (('department', 'department'), ('title', 'title'), ('name', 'name_prefix')):
+        value = request.args.get(arg, '').strip()
+        if value:
+            filters[key] = value
+    date = request.args.get('date')
+    if date:
+        try:
+            filters['date'] = datetime.strptime(date, "%Y-%m-%d").date()
+        except ValueError:
+            filters['date'] = parse_date_label(date)
+    period = request.args.get('period')
+    if period:
+        if period not in ('上午', '下午'):
+            raise ValueError('period must be 上午 or 下午')
+        filters['period'] = period
+    if request.args.get('only_available', '').lower() in ('1', 'true'):
+        filters['only_available'] = True
+    return filters
+
+@api.route('/user/time_slots', methods=['GET'])
+@jwt_required()
+def day_time_slots():
+    """
+    查询医生某一天各小时段的占用情况
+    查询参数：doctor_id  # int
+             date  # string，"MM月DD日"
+    返回数据格式：
+    {
+        "date": "日期",  # string
+        "slot_minutes": "小时段长度（分钟）",  # int
+        "periods": [
+            {
+                "period": "时间段",  # string
+                "booked": "已预约人数",  # int
+                "limit": "预约上限",  # int
+                "free": "还可以预约的人数",  # int
+                "first_free": "第一个空闲小时段的开始时间 HH:MM，没有时为 null",  # string
+                "slots": [
+                    {"time": "开始时间 HH:MM", "available": "是否可预约"},  # string, bool
+                    ...
                 ]
-            })
-        
-        result.append({
-            'id': doctor.id,
-            'name': doctor.name,
-            'gender': doctor.gender,
-            'title': doctor.title,
-            'department': doctor.department,
-            'office': doctor.office_number,
-            'phone': doctor.phone,
-            'available_times': available_times
-        })
-    
-    return jsonify(result)
+            },
+            ...
+        ]
+    }
+    """
+    try:
+        doctor_id = int(request.args['doctor_id'])
+        date = parse_date_label(request.args['date'])
+    except (KeyError, ValueError):
+        return jsonify({'msg': 'Invalid doctor_id or date'}), 400
+    slots = get_day_slots(doctor_id, date)
+    if slots is None:
+        return jsonify({'msg': 'Schedule not found for the given date'}), 404
+    return jsonify(slots), 200
+
+MAX_NEXT_AVAILABLE = 50
+
+@api.route('/user/next_available', methods=['GET'])
+@jwt_required()
+def next_available():
+    """
+    查询科室所有医生中最早的空闲时间段（不限医生时不必下载 /user/doctors_available 自己查找）
+    查询参数：department  # string，科室
+             after  # string, optional，"MM月DD日" 或 "YYYY-MM-DD"，可以带 " HH:MM"，只返回不早于这个时间的小时段，默认从今天开始
+             limit  # int, optional，返回的时间段数，默认 10，不超过 MAX_NEXT_AVAILABLE
+    每个医生的每个时间段（上午/下午）最多返回一条，时间为其中第一个空闲小时段的开始时间；用户已预约的时间段不返回。
+    返回数据格式：
+    [
+        {
+            "doctor_id": "医生工号",  # int
+            "doctor_name": "医生姓名",  # string
+            "title": "医生职称",  # string
+            "office": "办公室门牌号",  # string
+            "date": "日期",  # string
+            "period": "时间段",  # string
+            "time": "第一个空闲小时段的开始时间 HH:MM",  # string
+            "free": "还可以预约的人数"  # int
+        },
+        ...
+    ]
+    按 (日期, 时间, 医生工号) 排序
+    """
+    identity = get_jwt_identity()
+    department = request.args.get('department', '').strip()
+    if not department:
+        return jsonify({'msg': 'department is required'}), 400
+    limit = request.args.get('limit', 10, type=int)
+    if not 0 < limit <= MAX_NEXT_AVAILABLE:
+        return jsonify({'msg': f'limit must be between 1 and {MAX_NEXT_AVAILABLE}'}), 400
+    after = request.args.get('after', '').strip()
+    try:
+        after = parse_after(after) if after else None
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    return jsonify(get_next_available(identity['id'], department, after, limit)), 200
 
-@app.route('/user/book', methods=['POST'])
+def parse_after(value):
+    """把 "MM月DD日[ HH:MM]" 或 "YYYY-MM-DD[ HH:MM]" 转换为 (日期, 距零点的分钟数)，格式非法时抛出 ValueError"""
+    label, _, clock = value.partition(' ')
+    try:
+        date = datetime.strptime(label, "%Y-%m-%d").date()
+    except ValueError:
+        date = parse_date_label(label)
+    if not clock:
+        return date, 0
+    try:
+        moment = datetime.strptime(clock.strip(), "%H:%M")
+    except ValueError:
+        raise ValueError(f'Invalid after {value!r}, expected a date optionally followed by HH:MM')
+    return date, moment.hour * 60 + moment.minute
+
+@api.route('/user/book', methods=['POST'])
 @jwt_required()
 def book_appointment():
     """
@@ -236,45 +410,77 @@ def book_appointment():
     {
         "doctor_id": "医生工号",  # int
         "appointment_date": "预约日期 (YYYY-MM-DD)",  # string
-        "appointment_period": "预约时间段（上午/下午）"  # string
+        "appointment_period": "预约时间段（上午/下午）",  # string
+        "appointment_time": "小时段开始时间 HH:MM"  # string, optional，不传时分配这个时间段第一个空闲的小时段
     }
     返回数据格式：
     {
         "appointment_id": "预约ID",  # int
+        "appointment_time": "分到的小时段开始时间 HH:MM",  # string
         "message": "确认信息"  # string
     }
+    同一时间段的请求过多时返回 429，响应头 Retry-After 为建议的重试秒数；指定的小时段已被预约时返回 409
     """
     identity = get_jwt_identity()
     user_id = identity['id']
     data = request.get_json()
-    appointment_date = datetime.strptime(data['appointment_date'], "%m月%d日").date().replace(year=datetime.today().year)
-    # 检查医生是否有剩余预约名额
-    schedule = DoctorSchedule.query.filter_by(doctor_id=data['doctor_id'], date=appointment_date).first()
-    if not schedule:
-        return jsonify({"msg": "Schedule not found for the given date"}), 404
-    
-    if data['appointment_period'] == '上午':
-        if schedule.morning_booked >= schedule.morning_limit:
-            return jsonify({"msg": "No available slots in the morning"}), 400
-    elif data['appointment_period'] == '下午':
-        if schedule.afternoon_booked >= schedule.afternoon_limit:
-            return jsonify({"msg": "No available slots in the afternoon"}), 400
-    else:
+    doctor_id = int(data['doctor_id'])
+    appointment_date = parse_date_label(data['appointment_date'])
+    if data['appointment_period'] not in ('上午', '下午'):
         return jsonify({"msg": "Invalid appointment period"}), 400
-    
-    # 进行预约
-    appointment = book_doctor(
-        user_id=user_id,
-        doctor_id=data['doctor_id'],
-        appointment_date=appointment_date,
-        appointment_period=data['appointment_period']
-    )
+    slot_offset = None
+    if data.get('appointment_time'):
+        try:
+            slot_offset = parse_slot_time(data['appointment_period'], data['appointment_time'])
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 400
+
+    # 同一时间段的请求按到达顺序排队进入数据库，前面的请求已经足够占满名额时直接拒绝
+    key = (doctor_id, appointment_date, data['appointment_period'])
+    try:
+        booking_admission.acquire(key)
+    except AdmissionRejected as e:
+        if e.full:
+            return jsonify({"msg": e.message}), 400
+        return jsonify({"msg": e.message}), 429, {'Retry-After': str(e.retry_after)}
+    started = time.perf_counter()
+    try:
+        # 进行预约（名额检查和计数在同一条 UPDATE 中原子完成）
+        appointment = book_doctor(
+            user_id=user_id,
+            doctor_id=doctor_id,
+            appointment_date=appointment_date,
+            appointment_period=data['appointment_period'],
+            slot_offset=slot_offset
+        )
+        if appointment is None:
+            # 预约失败时才区分是排班不存在、名额已满还是指定的小时段不可用
+            schedule = DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=appointment_date).first()
+            if not schedule:
+                return jsonify({"msg": "Schedule not found for the given date"}), 404
+            booked, limit = ((schedule.morning_booked, schedule.morning_limit) if data['appointment_period'] == '上午'
+                             else (schedule.afternoon_booked, schedule.afternoon_limit))
+            if slot_offset is not None and booked < limit:
+                return jsonify({"msg": f"The {data['appointment_time']} slot is not available"}), 409
+            # 放行排队的请求之前先记下名额已满，队列中的请求随即被拒绝
+            if data['appointment_period'] == '上午':
+                booking_admission.observe(*key, schedule.morning_booked, schedule.morning_limit)
+                return jsonify({"msg": "No available slots in the morning"}), 400
+            booking_admission.observe(*key, schedule.afternoon_booked, schedule.afternoon_limit)
+            return jsonify({"msg": "No available slots in the afternoon"}), 400
+    except IntegrityError:
+        # 违反唯一约束：该用户已预约过这个时间段
+        return jsonify({"msg": "Appointment already exists"}), 409
+    finally:
+        booking_admission.release(key, time.perf_counter() - started)
+    appointment_time = slot_time(data['appointment_period'], appointment.slot_offset)
     return jsonify({
         'appointment_id': appointment.id,
-        'message': f'Appointment confirmed for {appointment_date.strftime("%m月%d日")} {data["appointment_period"]}'
+        'appointment_time': appointment_time,
+        'message': f'Appointment confirmed for {appointment_date.strftime("%m月%d日")} {data["appointment_period"]} {appointment_time}'
     }), 201
 
-@app.route('/user/cancel', methods=['POST'])
+@api.route('/user/cancel', methods=['POST'])
 @jwt_required()
 def cancel_booking():
     """
@@ -303,7 +509,7 @@ def cancel_booking():
     appointment = Appointment.query.filter_by(
         user_id=user_id,
         doctor_id=doctor_id,
-        appointment_date=datetime.strptime(appointment_date, "%m月%d日").date().replace(year=datetime.today().year),
+        appointment_date=parse_date_label(appointment_date),
         appointment_period=appointment_period
     ).first()
     
@@ -313,7 +519,154 @@ def cancel_booking():
     else:
         return jsonify({'success': False, 'msg': 'Appointment not found'}), 404
 
-@app.route('/user/profile', methods=['GET'])
+@api.route('/user/waitlist', methods=['POST'])
+@jwt_required()
+def join_appointment_waitlist():
+    """
+    用户加入已约满时间段的候补队列，有人取消预约时队首自动转为预约（出现在用户的预约列表中）
+    前端需要发送的数据格式：
+    {
+        "doctor_id": "医生工号",  # int
+        "appointment_date": "预约日期",  # string
+        "appointment_period": "预约时间段（上午/下午）"  # string
+    }
+    返回数据格式（时间段还有名额时为 409，应直接预约）：
+    {
+        "entry_id": "候补记录ID",  # int
+        "position": "在队列中的位置，从 1 开始",  # int
+        "message": "确认信息"  # string
+    }
+    """
+    identity = get_jwt_identity()
+    user_id = identity['id']
+    data = request.get_json() or {}
+    try:
+        doctor_id = int(data['doctor_id'])
+        appointment_date = parse_date_label(data['appointment_date'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"msg": "Invalid doctor_id or appointment_date"}), 400
+    appointment_period = data.get('appointment_period')
+    if appointment_period not in ('上午', '下午'):
+        return jsonify({"msg": "Invalid appointment period"}), 400
+
+    # 名额检查、重复检查和写入在同一条 INSERT 中完成
+    entry_id = join_waitlist(user_id, doctor_id, appointment_date, appointment_period)
+    if entry_id is None:
+        # 写入失败时才区分原因
+        if WaitlistEntry.query.filter_by(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date,
+                                         appointment_period=appointment_period).first():
+            return jsonify({"msg": "Already on the waitlist"}), 409
+        if Appointment.query.filter_by(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date,
+                                       appointment_period=appointment_period).first():
+            return jsonify({"msg": "Appointment already exists"}), 409
+        if not DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=appointment_date).first():
+            return jsonify({"msg": "Schedule not found for the given date"}), 404
+        return jsonify({"msg": "Slots are still available, book directly"}), 409
+    return jsonify({
+        'entry_id': entry_id,
+        'position': get_waitlist_position(entry_id),
+        'message': f'Joined the waitlist for {appointment_date.strftime("%m月%d日")} {appointment_period}'
+    }), 201
+
+@api.route('/user/waitlist', methods=['GET'])
+@jwt_required()
+def get_appointment_waitlist():
+    """
+    用户查看自己的候补记录和在队列中的位置，支持 ?fields= 只返回部分字段
+    返回数据格式：
+    [
+        {
+            "id": "候补记录ID",  # int
+            "doctor_id": "医生工号",  # int
+            "doctor_name": "医生姓名",  # string
+            "appointment_date": "日期 (YYYY-MM-DD)",  # string
+            "appointment_period": "时间段（上午/下午）",  # string
+            "created_at": "加入时间",  # string
+            "position": "在队列中的位置，从 1 开始"  # int
+        },
+        ...
+    ]
+    """
+    identity = get_jwt_identity()
+    try:
+        to_dict = WAITLIST_FIELDS.for_request()
+    except InvalidFields as e:
+        return jsonify({'msg': str(e)}), 400
+    return json_response([to_dict(row) for row in get_user_waitlist(identity['id'])])
+
+@api.route('/user/waitlist/<int:entry_id>', methods=['DELETE'])
+@jwt_required()
+def leave_appointment_waitlist(entry_id):
+    """
+    用户退出候补队列
+    返回数据格式：
+    {
+        "success": "是否成功"  # bool
+    }
+    """
+    identity = get_jwt_identity()
+    success = leave_waitlist(identity['id'], entry_id)
+    return jsonify({'success': success}), 200 if success else 404
+
+# 批量预约/取消一次最多包含的操作数
+MAX_BATCH_OPERATIONS = 20
+
+@api.route('/user/appointments/batch', methods=['POST'])
+@jwt_required()
+def batch_appointments():
+    """
+    用户批量预约/取消（例如为家人预约、改约），所有操作在一个事务中按顺序执行，全部成功才生效
+    改约可以写成先 cancel 原时间段再 book 新时间段，只提交一次
+    前端需要发送的数据格式：
+    {
+        "operations": [
+            {
+                "action": "book 或 cancel",  # string
+                "doctor_id": "医生工号",  # int
+                "appointment_date": "预约日期",  # string
+                "appointment_period": "预约时间段（上午/下午）"  # string
+            },
+            ...  # 最多 MAX_BATCH_OPERATIONS 项
+        ]
+    }
+    返回数据格式（全部成功为 200，有操作失败时为 409 且所有操作都未生效）：
+    {
+        "success": "是否已生效",  # bool
+        "results": [
+            {
+                "index": "操作序号",  # int
+                "action": "book 或 cancel",  # string
+                "status": "applied / failed / skipped（本身可以执行，但因其他操作失败未执行）",  # string
+                "appointment_id": "预约ID（applied 时）",  # int
+                "error": "失败原因（failed 时）"  # string
+            },
+            ...
+        ]
+    }
+    """
+    identity = get_jwt_identity()
+    user_id = identity['id']
+    operations = (request.get_json() or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"msg": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"msg": f"At most {MAX_BATCH_OPERATIONS} operations per request"}), 400
+    parsed = []
+    for index, operation in enumerate(operations):
+        try:
+            if operation['action'] not in ('book', 'cancel'):
+                raise ValueError('Invalid action')
+            if operation['appointment_period'] not in ('上午', '下午'):
+                raise ValueError('Invalid appointment period')
+            parsed.append((operation['action'], int(operation['doctor_id']), parse_date_label(operation['appointment_date']),
+                           operation['appointment_period']))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"msg": f"Invalid operation {index}: {e}"}), 400
+
+    success, results = apply_appointment_batch(user_id, parsed)
+    return jsonify({'success': success, 'results': results}), 200 if success else 409
+
+@api.route('/user/profile', methods=['GET'])
 @role_required('user')
 def get_user_profile():
     """
@@ -342,7 +695,7 @@ def get_user_profile():
         'emergency_contact': user.emergency_contact,
     }), 200
 
-@app.route('/user/<string:user_id>', methods=['PUT'])
+@api.route('/user/<string:user_id>', methods=['PUT'])
 @role_required('user')
 def update_user_info(user_id):
     """
@@ -373,12 +726,12 @@ def update_user_info(user_id):
     user.phone_number = data.get('phone_number', user.phone_number)
     user.emergency_contact = data.get('emergency_contact', user.emergency_contact)
     if 'password' in data:
-        user.password_hash = generate_password_hash(data['password'])
+        user.password_hash = hash_password(data['password'])
     db.session.commit()
     
     return jsonify({'id': user.id, 'name': user.name}), 200
 
-@app.route('/doctor/profile', methods=['GET'])
+@api.route('/doctor/profile', methods=['GET'])
 @role_required('doctor')
 def get_doctor_profile():
     """
@@ -411,22 +764,24 @@ def get_doctor_profile():
         'flag': doctor.flag
     }), 200
 
-@app.route('/doctor/schedule', methods=['POST'])
+@api.route('/doctor/schedule', methods=['POST'])
 @role_required('doctor')
 def set_schedule():
     """
-    医生设置未来三天的空闲时间和每日最大接待病人数量
+    医生设置预约窗口内某几天的空闲时间和每日最大接待病人数量（覆盖每周模板生成的上限）
     前端需要发送的数据格式：
     {
         "schedules": [
             {
                 "date": "日期 (YYYY-MM-DD)",  # string
                 "morning_limit": "上午预约人数上限",  # int
-                "afternoon_limit": "下午预约人数上限"  # int
+                "afternoon_limit": "下午预约人数上限",  # int
+                "slot_minutes": "小时段长度（分钟）"  # int, optional，只能在这一天还没有预约时修改
             },
             ...
         ]
     }
+    上限不能超过小时段个数（半天的分钟数 / slot_minutes）
     返回数据格式：
     {
         "success": "是否成功"  # bool
@@ -438,8 +793,23 @@ def set_schedule():
     schedules = data['schedules']
     
     for schedule_data in schedules:
-        date = datetime.strptime(schedule_data['date'], "%m月%d日").date().replace(year=datetime.today().year)
+        date = parse_date_label(schedule_data['date'])
         schedule = DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=date).first()
+        minutes = schedule_data.get('slot_minutes')
+        if minutes:
+            try:
+                validate_slot_minutes(minutes)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+            if schedule and minutes != schedule.slot_minutes and (schedule.morning_slots or schedule.afternoon_slots):
+                return jsonify({'success': False, 'message': f'Slot length for {schedule_data["date"]} cannot change after appointments are booked'}), 400
+        else:
+            minutes = schedule.slot_minutes if schedule else default_slot_minutes()
+        try:
+            for key in ('morning_limit', 'afternoon_limit'):
+                check_limit(schedule_data[key], minutes, f'{key} for {schedule_data["date"]}')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         if schedule:
             if schedule_data['morning_limit'] < schedule.morning_booked:
@@ -454,11 +824,11 @@ def set_schedule():
     
     return jsonify({'success': True, 'message': 'Schedule set successfully'}), 200
 
-@app.route('/doctor/schedule', methods=['GET'])
+@api.route('/doctor/schedule', methods=['GET'])
 @role_required('doctor')
 def get_schedule():
     """
-    医生获取未来三天的预约情况
+    医生获取预约窗口内每天的预约情况
     返回数据格式：
     [
         {
@@ -466,7 +836,8 @@ def get_schedule():
             "morning_booked": "上午已预约人数",  # int
             "morning_limit": "上午预约人数上限",  # int
             "afternoon_booked": "下午已预约人数",  # int
-            "afternoon_limit": "下午预约人数上限"  # int
+            "afternoon_limit": "下午预约人数上限",  # int
+            "slot_minutes": "小时段长度（分钟）"  # int
         },
         ...
     ]
@@ -476,11 +847,71 @@ def get_schedule():
     schedules = get_doctor_schedule(doctor_id)
     return jsonify(schedules), 200
 
-@app.route('/doctor/appointments', methods=['GET'])
+@api.route('/doctor/schedule_template', methods=['GET'])
+@role_required('doctor')
+def get_template():
+    """
+    医生获取每周排班模板，未设置时为默认上限
+    返回数据格式：
+    {
+        "horizon_days": "预约窗口天数",  # int
+        "template": [
+            {
+                "weekday": "星期几，0 表示星期一",  # int
+                "morning_limit": "上午预约人数上限",  # int
+                "afternoon_limit": "下午预约人数上限"  # int
+            },
+            ...  # 共 7 项
+        ]
+    }
+    """
+    identity = get_jwt_identity()
+    return jsonify({'horizon_days': horizon_days(), 'template': get_schedule_template(identity['id'])}), 200
+
+@api.route('/doctor/schedule_template', methods=['POST'])
+@role_required('doctor')
+def set_template():
+    """
+    医生设置每周排班模板，并按新模板更新预约窗口内已生成的排班
+    已预约人数超过新上限的时间段，上限保持为已预约人数
+    前端需要发送的数据格式：
+    {
+        "template": [
+            {
+                "weekday": "星期几，0 表示星期一",  # int
+                "morning_limit": "上午预约人数上限，0 表示不出诊",  # int
+                "afternoon_limit": "下午预约人数上限，0 表示不出诊"  # int
+            },
+            ...  # 星期一到星期日共 7 项
+        ]
+    }
+    返回数据格式：
+    {
+        "success": "是否成功"  # bool
+    }
+    """
+    identity = get_jwt_identity()
+    template = (request.get_json() or {}).get('template')
+    if not isinstance(template, list) or sorted(item.get('weekday') for item in template if isinstance(item, dict)) != list(range(7)):
+        return jsonify({'success': False, 'message': 'Template must contain weekdays 0-6 exactly once'}), 400
+    for item in template:
+        for key in ('morning_limit', 'afternoon_limit'):
+            if not isinstance(item.get(key), int) or item[key] < 0:
+                return jsonify({'success': False, 'message': f'Invalid {key} for weekday {item["weekday"]}'}), 400
+            try:
+                check_limit(item[key], default_slot_minutes(), f'{key} for weekday {item["weekday"]}')
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+    set_schedule_template(identity['id'], template)
+    return jsonify({'success': True}), 200
+
+@api.route('/doctor/appointments', methods=['GET'])
 @role_required('doctor')
 def doctor_appointments():
     """
     医生查询所有预约情况
+    查询参数（均可选）：after_id、limit、from、to，见 parse_page_args；fields，逗号分隔的字段名，只返回这些字段
+    满页时响应头 X-Next-After-Id 为下一页的 after_id
     返回数据格式：
     [
         {
@@ -489,28 +920,23 @@ def doctor_appointments():
             "user_name": "用户姓名",  # string
             "user_gender": "用户性别",  # string
             "appointment_date": "预约日期",  # string
-            "appointment_period": "预约时间段"  # string
+            "appointment_period": "预约时间段",  # string
+            "appointment_time": "小时段开始时间 HH:MM，迁移前未分到小时段的预约为 null"  # string
         },
         ...
     ]
     """
     identity = get_jwt_identity()
     doctor_id = identity['id']
-    appointments = Appointment.query.filter_by(doctor_id=doctor_id).all()
-    result = []
-    for appointment in appointments:
-        user = User.query.get(appointment.user_id)
-        result.append({
-            'id': appointment.id,
-            'user_id': appointment.user_id,
-            'user_name': user.name if user else None,
-            'user_gender': user.gender if user else None,
-            'appointment_date': appointment.appointment_date.strftime("%Y-%m-%d"),
-            'appointment_period': appointment.appointment_period
-        })
-    return jsonify(result)
+    try:
+        after_id, limit, date_from, date_to = parse_page_args()
+        to_dict = DOCTOR_APPOINTMENT_FIELDS.for_request()
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    rows = get_doctor_appointments_page(doctor_id, after_id, limit, date_from, date_to)
+    return page_response([to_dict(row) for row in rows], rows, limit)
 
-@app.route('/doctor/<int:doctor_id>', methods=['PUT'])
+@api.route('/doctor/<int:doctor_id>', methods=['PUT'])
 @role_required('doctor')
 def update_doctor_info(doctor_id):
     """
@@ -542,13 +968,14 @@ def update_doctor_info(doctor_id):
     doctor.name = data.get('name', doctor.name)
     doctor.gender = data.get('gender', doctor.gender)
     doctor.title = data.get('title', doctor.title)
-    doctor.department = data.get('department', doctor.department)
+    set_doctor_department(doctor, data.get('department', doctor.department))
     doctor.office_number = data.get('office', doctor.office_number)
     doctor.phone = data.get('phone', doctor.phone)
     db.session.commit()
+    availability_cache.invalidate()
     return jsonify({'id': doctor.id, 'name': doctor.name}), 200
 
-@app.route('/doctor/notifications', methods=['GET'])
+@api.route('/doctor/notifications', methods=['GET'])
 @role_required('doctor')
 def get_notifications():
     """
@@ -569,7 +996,7 @@ def get_notifications():
     result = [{'id': n.id, 'message': n.message} for n in notifications]
     return jsonify(result)
 
-@app.route('/doctor/notifications/read', methods=['POST'])
+@api.route('/doctor/notifications/read', methods=['POST'])
 @role_required('doctor')
 def mark_notifications_as_read():
     """
@@ -595,7 +1022,59 @@ def mark_notifications_as_read():
     db.session.commit()
     return jsonify({"success": True}), 200
 
-@app.route('/admin/create_doctor', methods=['POST'])
+def event_stream_response(channel):
+    """
+    返回频道的 SSE 响应，断线重连时从 Last-Event-ID 请求头（或 last_event_id 查询参数）之后继续
+    浏览器的 EventSource 不能设置请求头，令牌可以放在 ?jwt= 查询参数中
+    """
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return Response(event_broker.stream(channel, last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/events/availability', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def availability_events():
+    """
+    订阅名额变化（Server-Sent Events），代替反复请求 /user/doctors_available
+    预约、取消预约、医生修改排班时推送：
+        event: slot
+        data: {
+            "doctor_id": "医生工号",  # int
+            "date": "日期",  # string，与 /user/doctors_available 中的 date 相同
+            "period": "时间段",  # string
+            "booked": "已预约人数",  # int
+            "limit": "预约上限",  # int
+            "available": "是否可预约"  # bool
+        }
+    排班模板修改、排班生成、医生删除，或者断线太久漏掉了事件时推送 event: refresh，前端应重新请求完整列表
+    """
+    return event_stream_response(AVAILABILITY_CHANNEL)
+
+@api.route('/events/doctor/appointments', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def doctor_appointment_events():
+    """
+    医生订阅自己的新预约和取消（Server-Sent Events），代替轮询 /doctor/notifications
+    推送 event: appointment（新预约）或 event: cancel（取消预约）：
+        data: {
+            "id": "预约ID",  # int
+            "user_id": "用户身份证号",  # string
+            "user_name": "用户姓名",  # string
+            "user_gender": "用户性别",  # string
+            "appointment_date": "预约日期",  # string
+            "appointment_period": "预约时间段"  # string
+        }
+    """
+    identity = get_jwt_identity()
+    if identity['role'] != 'doctor':
+        return jsonify({"msg": "Permission denied"}), 403
+    return event_stream_response(doctor_channel(identity['id']))
+
+@api.route('/admin/create_doctor', methods=['POST'])
 @role_required('admin')
 def add_doctor():
     """
@@ -632,7 +1111,7 @@ def add_doctor():
     )
     return jsonify({'id': doctor.id, 'name': doctor.name}), 201
 
-@app.route('/admin/doctor/<int:doctor_id>', methods=['DELETE'])
+@api.route('/admin/doctor/<int:doctor_id>', methods=['DELETE'])
 @role_required('admin')
 def delete_doctor_route(doctor_id):
     """
@@ -645,11 +1124,13 @@ def delete_doctor_route(doctor_id):
     success = delete_doctor(doctor_id)
     return jsonify({'success': success}), 200 if success else 404
 
-@app.route('/admin/users', methods=['GET'])
+@api.route('/admin/users', methods=['GET'])
 @role_required('admin')
 def get_users():
     """
     管理员获取所有用户信息
+    （分批读取数据库并流式返回，内存占用与数据量无关）
+    查询参数：fields  # string, optional，逗号分隔的字段名，只返回这些字段
     返回数据格式：
     [
         {
@@ -663,20 +1144,14 @@ def get_users():
         ...
     ]
     """
-    users = get_all_users()
-    result = [
-        {
-            'idNumber': user.id,
-            'name': user.name or "",  # 确保返回字符串
-            'gender': user.gender or "",  # 确保返回字符串
-            'address': user.address or "",  # 确保返回字符串
-            'phone': user.phone_number or "",  # 确保返回字符串
-            'emergencyContact': user.emergency_contact or ""  # 确保返回字符串
-        } for user in users
-    ]
-    return jsonify(result)
+    try:
+        to_dict = USER_FIELDS.for_request()
+    except InvalidFields as e:
+        return jsonify({'msg': str(e)}), 400
+    rows = iter_in_batches(get_users_page, STREAM_BATCH_SIZE)
+    return stream_json_array(rows, to_dict)
 
-@app.route('/admin/users/<string:user_id>', methods=['DELETE'])
+@api.route('/admin/users/<string:user_id>', methods=['DELETE'])
 @role_required('admin')
 def delete_user_route(user_id):
     """
@@ -689,16 +1164,19 @@ def delete_user_route(user_id):
     success = delete_user(user_id)
     return jsonify({'success': success}), 200 if success else 404
 
-@app.route('/admin/doctors', methods=['GET'])
+@api.route('/admin/doctors', methods=['GET'])
 @role_required('admin')
 def get_doctors():
     """
     管理员获取所有医生信息
+    （分批读取数据库并流式返回，内存占用与数据量无关）
+    查询参数：fields  # string, optional，逗号分隔的字段名，只返回这些字段
     返回数据格式：
     [
         {
             "id": "医生工号",  # int
-            "avatar": "医生头像（二进制数据）",  # bytes (base64 encoded in JSON)，或者空字符串
+            "avatar": "医生头像地址",  # string，GET /doctors/<id>/avatar，或者空字符串
+            "avatar_hash": "头像内容哈希",  # string，或者空字符串
             "name": "医生姓名",  # string
             "department": "医生科室",  # string
             "office_number": "办公室门牌号",  # string
@@ -708,27 +1186,20 @@ def get_doctors():
         ...
     ]
     """
-    doctors = get_all_doctors()
-    result = [
-        {
-            'employeeId': doctor.id,
-            'name': doctor.name or "",  # 确保返回字符串
-            'gender': doctor.gender or "",  # 确保返回字符串
-            'title': doctor.title or "", # 确保返回字符串
-            'department': doctor.department or "",  # 确保返回字符串
-            'office': doctor.office_number or "",  # 确保返回字符串
-            'phone': doctor.phone or ""  ,# 确保返回字符串
-            'avatar': doctor.avatar if doctor.avatar else "",  # 返回二进制数据，前端需要处理显示，为空则返回空字符串
-            'flag': doctor.flag  # 返回布尔值
-        } for doctor in doctors
-    ]
-    return jsonify(result)
+    try:
+        to_dict = DOCTOR_FIELDS.for_request()
+    except InvalidFields as e:
+        return jsonify({'msg': str(e)}), 400
+    rows = iter_in_batches(get_doctors_page, STREAM_BATCH_SIZE)
+    return stream_json_array(rows, to_dict, avatar_prefix=request.host_url + 'doctors')
 
-@app.route('/admin/appointments', methods=['GET'])
+@api.route('/admin/appointments', methods=['GET'])
 @role_required('admin')
 def get_appointments():
     """
     管理员获取所有预约信息
+    查询参数（均可选）：after_id、limit、from、to，见 parse_page_args；fields，逗号分隔的字段名，只返回这些字段
+    满页时响应头 X-Next-After-Id 为下一页的 after_id，不传 limit 时流式返回全部预约
     返回数据格式：
     [
         {
@@ -740,20 +1211,23 @@ def get_appointments():
         ...
     ]
     """
-    appointments = get_all_appointments()
-    result = []
-    for appointment in appointments:
-        user = User.query.get(appointment.user_id)
-        doctor = Doctor.query.get(appointment.doctor_id)
-        result.append({
-            'appointment_id': appointment.id,
-            'user_name': user.name if user else "",  # 确保返回字符串
-            'doctor_name': doctor.name if doctor else "",  # 确保返回字符串
-            'appointment_time': appointment.appointment_date.strftime("%Y-%m-%d") + " " + appointment.appointment_period
-        })
-    return jsonify(result)
+    try:
+        after_id, limit, date_from, date_to = parse_page_args()
+        to_dict = APPOINTMENT_FIELDS.for_request()
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+
+    if limit is None:
+        # 未指定 limit 时分批流式返回全部预约
+        rows = iter_in_batches(
+            lambda after, batch: get_appointments_page(after if after is not None else after_id, batch, date_from, date_to),
+            STREAM_BATCH_SIZE
+        )
+        return stream_json_array(rows, to_dict)
+    rows = get_appointments_page(after_id, limit, date_from, date_to)
+    return page_response([to_dict(row) for row in rows], rows, limit)
 
-@app.route('/admin/appointments/<int:appointment_id>', methods=['DELETE'])
+@api.route('/admin/appointments/<int:appointment_id>', methods=['DELETE'])
 @role_required('admin')
 def delete_appointment_route(appointment_id):
     """
@@ -766,7 +1240,7 @@ def delete_appointment_route(appointment_id):
     success = delete_appointment(appointment_id)
     return jsonify({'success': success}), 200 if success else 404
 
-@app.route('/admin/doctor/<int:doctor_id>', methods=['PUT'])
+@api.route('/admin/doctor/<int:doctor_id>', methods=['PUT'])
 @role_required('admin')
 def update_doctor_info_by_admin_route(doctor_id):
     """
@@ -804,5 +1278,294 @@ def update_doctor_info_by_admin_route(doctor_id):
         return jsonify({'id': doctor.id, 'name': doctor.name}), 200
     return jsonify({'error': 'Doctor not found'}), 404
 
+@api.route('/doctors/<int:doctor_id>/avatar', methods=['GET'])
+def get_doctor_avatar(doctor_id):
+    """
+    获取医生头像图片（无需登录，便于 <img> 直接引用）
+    支持 If-None-Match / If-Modified-Since 条件请求，未变化时返回 304 且不读取头像数据；
+    带 ?v=头像哈希前缀 的地址内容不会变化，允许长期缓存
+    """
+    meta = get_doctor_avatar_meta(doctor_id)
+    if not meta or not meta.avatar_hash:
+        return jsonify({'error': 'Avatar not found'}), 404
+    avatar_hash, mimetype, updated_at = meta
+    not_modified = request.if_none_match.contains(avatar_hash) if request.if_none_match else (
+        request.if_modified_since is not None and updated_at <= request.if_modified_since.replace(tzinfo=None)
+    )
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(get_doctor_avatar_data(doctor_id), mimetype=mimetype)
+    response.set_etag(avatar_hash)
+    response.last_modified = updated_at
+    if request.args.get('v') == avatar_hash[:16]:
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@api.route('/doctors/<int:doctor_id>/avatar', methods=['POST'])
+@jwt_required()
+def upload_doctor_avatar(doctor_id):
+    """
+    上传医生头像（管理员或医生本人），服务器保存缩略图
+    前端以 multipart/form-data 的 avatar 字段或直接以请求体发送图片
+    返回数据格式：
+    {
+        "avatar": "医生头像地址",  # string
+        "avatar_hash": "头像内容哈希"  # string
+    }
+    """
+    identity = get_jwt_identity()
+    if identity['role'] != 'admin' and not (identity['role'] == 'doctor' and identity['id'] == doctor_id):
+        return jsonify({"msg": "Permission denied"}), 403
+    upload = request.files.get('avatar')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({'error': 'No avatar provided'}), 400
+    try:
+        doctor = set_doctor_avatar(doctor_id, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not doctor:
+        return jsonify({'error': 'Doctor not found'}), 404
+    return jsonify({
+        'avatar': f'{request.host_url}doctors/{doctor.id}/avatar?v={doctor.avatar_hash[:16]}',
+        'avatar_hash': doctor.avatar_hash
+    }), 200
+
+@api.route('/admin/cache_stats', methods=['GET'])
+@role_required('admin')
+def get_cache_stats():
+    """
+    管理员查看可预约情况快照缓存的命中统计
+    返回数据格式：
+    {
+        "version": "当前版本号",  # int
+        "hits": "命中次数",  # int
+        "misses": "未命中次数",  # int
+        "rebuilds": "重建次数",  # int
+        "patches": "原地修改次数",  # int
+        "invalidations": "失效次数",  # int
+        "snapshots": "当前缓存的快照数"  # int
+    }
+    """
+    return jsonify(availability_cache.stats()), 200
+
+@api.route('/admin/admission_stats', methods=['GET'])
+@role_required('admin')
+def get_admission_stats():
+    """
+    管理员查看预约准入控制的统计（仅本进程）
+    返回数据格式：
+    {
+        "enabled": "是否启用",  # bool
+        "admitted": "准入的请求数",  # int
+        "queued": "排过队的请求数",  # int
+        "rejected": {"exhausted": 0, "full": 0, "queue_full": 0, "timeout": 0},  # 各原因拒绝的请求数
+        "slots": "当前跟踪的时间段数",  # int
+        "waiting": "正在排队的请求数",  # int
+        "service_time_ms": "每个请求占用的平均毫秒数"  # float
+    }
+    """
+    return jsonify(booking_admission.stats()), 200
+
+@api.route('/admin/group_commit_stats', methods=['GET'])
+@role_required('admin')
+def get_group_commit_stats():
+    """
+    管理员查看预约写入组提交的统计（仅本进程）
+    返回数据格式：
+    {
+        "enabled": "是否启用",  # bool
+        "batches": "提交的批次数",  # int
+        "operations": "提交的写操作数",  # int
+        "failed_batches": "整批失败的批次数",  # int
+        "average_batch": "平均每批的操作数",  # float
+        "queued": "正在排队的写操作数"  # int
+    }
+    """
+    return jsonify(group_writer.stats()), 200
+
+@api.route('/admin/metrics', methods=['GET'])
+@role_required('admin')
+def get_metrics():
+    """
+    管理员（或 Prometheus，使用 bearer token 抓取）获取按接口统计的请求指标，需要 REQUEST_METRICS=1
+    返回 Prometheus 文本格式：
+        hospital_requests_total{endpoint, method, status}                  # counter
+        hospital_request_duration_seconds{endpoint, method}                # histogram，处理耗时
+        hospital_request_sql_duration_seconds{endpoint, method}            # histogram，SQL 总耗时
+        hospital_request_sql_statements{endpoint, method}                  # histogram，SQL 语句数
+        hospital_slow_queries_total                                        # counter
+    """
+    if not request_metrics.enabled:
+        return jsonify({"msg": "Request metrics are disabled, set REQUEST_METRICS=1"}), 404
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/admin/profiler', methods=['GET'])
+@role_required('admin')
+def get_profiler():
+    """
+    管理员查看剖析设置和已保存的剖析文件
+    返回数据格式：
+    {
+        "settings": {
+            "active": "是否正在剖析",  # bool
+            "rate": "被剖析请求的比例",  # float
+            "endpoint": "只剖析的接口名（如 api.available_doctors），null 表示所有接口",  # string
+            "mode": "sample 或 trace",  # string
+            "until": "自动关闭的时间",  # string
+            "captured": "本进程已写出的剖析文件数"  # int
+        },
+        "captures": [
+            {
+                "name": "文件名",  # string
+                "size": "字节数",  # int
+                "created_at": "创建时间"  # string
+            },
+            ...
+        ]
+    }
+    """
+    return jsonify({'settings': request_profiler.settings(), 'captures': request_profiler.list_captures()}), 200
+
+@api.route('/admin/profiler', methods=['POST'])
+@role_required('admin')
+def set_profiler():
+    """
+    管理员开启或关闭剖析（只对处理这个请求的进程生效）
+    前端需要发送的数据格式：
+    {
+        "rate": "被剖析请求的比例，0 表示关闭",  # float, 0 ~ 1，指定 endpoint 时默认 1
+        "endpoint": "只剖析这个接口",  # string, optional
+        "mode": "sample 或 trace",  # string, optional，默认 sample
+        "seconds": "多少秒后自动关闭"  # int, optional，默认 600，最大 3600
+    }
+    返回数据格式同 GET /admin/profiler 中的 settings
+    """
+    data = request.get_json(silent=True) or {}
+    endpoint = data.get('endpoint')
+    rate = data.get('rate', 1 if endpoint else None)
+    mode = data.get('mode', 'sample')
+    seconds = data.get('seconds', 600)
+    if not isinstance(rate, (int, float)) or isinstance(rate, bool) or not 0 <= rate <= 1:
+        return jsonify({"msg": "rate must be a number between 0 and 1"}), 400
+    if endpoint is not None and endpoint not in current_app.view_functions:
+        return jsonify({"msg": "Unknown endpoint"}), 400
+    if mode not in PROFILE_MODES:
+        return jsonify({"msg": f"mode must be one of {', '.join(PROFILE_MODES)}"}), 400
+    if not isinstance(seconds, int) or isinstance(seconds, bool) or not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return jsonify({"msg": f"seconds must be an integer between 1 and {MAX_PROFILE_SECONDS}"}), 400
+    return jsonify(request_profiler.configure(rate, endpoint, mode, seconds)), 200
+
+@api.route('/admin/profiler/captures/<string:name>', methods=['GET'])
+@role_required('admin')
+def download_profile(name):
+    """
+    管理员下载一个剖析文件（collapsed-stack 文本，可用 flamegraph.pl 或 speedscope 打开）
+    """
+    path = request_profiler.capture_path(name)
+    if path is None:
+        return jsonify({"msg": "Capture not found"}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
+@api.route('/admin/reconcile', methods=['GET'])
+@role_required('admin')
+def get_reconcile_stats():
+    """
+    管理员查看排班已预约人数校对的统计
+    返回数据格式：
+    {
+        "runs": "校对次数",  # int
+        "rows_repaired": "累计修正的排班行数",  # int
+        "total_drift": "累计修正的人数偏差",  # int
+        "last": "最近一次校对的结果，格式同 POST /admin/reconcile，未运行过时为 null"  # dict
+    }
+    """
+    return jsonify(reconcile_stats()), 200
+
+@api.route('/admin/reconcile', methods=['POST'])
+@role_required('admin')
+def run_reconcile():
+    """
+    管理员立即执行一次校对
+    查询参数：full=1 时检查整个预约窗口，否则只检查上次校对后有预约变化的日期
+    返回数据格式：
+    {
+        "full": "是否检查了整个预约窗口",  # bool
+        "dates_checked": "检查的日期数",  # int
+        "rows_checked": "检查的排班行数",  # int
+        "rows_mismatched": "计数或小时段位图不一致的排班行数",  # int
+        "rows_repaired": "修正的排班行数",  # int
+        "bitmaps_repaired": "其中修正了小时段位图的行数",  # int
+        "total_drift": "修正的人数偏差总和",  # int
+        "max_drift": "单行最大偏差",  # int
+        "over_limit": "修正后已预约人数超过上限的时间段数",  # int
+        "high_water": "已处理到的预约变更序号",  # int
+        "seconds": "耗时（秒）",  # float
+        "finished_at": "完成时间"  # string
+    }
+    """
+    return jsonify(reconcile_booked_counters(full=request.args.get('full') in ('1', 'true'))), 200
+
+@api.cli.command('import-data')
+@click.option('--doctors', type=click.Path(exists=True, dir_okay=False), help='医生 CSV/JSONL 文件')
+@click.option('--users', type=click.Path(exists=True, dir_okay=False), help='患者 CSV/JSONL 文件')
+@click.option('--schedules', type=click.Path(exists=True, dir_okay=False), help='排班 CSV/JSONL 文件')
+@click.option('--batch-size', default=5000, show_default=True, help='每个事务写入的行数')
+def import_data(doctors, users, schedules, batch_size):
+    """
+    批量导入医生、患者和排班，中断后重新执行同一条命令会从上次提交的位置继续
+    用法：flask --app backend import-data --doctors doctors.csv --users users.jsonl --schedules schedules.csv
+    """
+    db.create_all()
+    upgrade(db.engine)
+    # 先导入医生，排班依赖医生记录
+    for kind, path in (('doctors', doctors), ('users', users), ('schedules', schedules)):
+        if path:
+            rows, written, seconds = import_file(kind, path, batch_size, log=click.echo)
+            click.echo(f'{kind}: read {rows} rows, wrote {written}, skipped {rows - written} '
+                       f'in {seconds:.1f}s ({rows / max(seconds, 1e-9):.0f} rows/sec)')
+        if kind == 'doctors' and path:
+            # 为新医生生成预约窗口内的默认排班，之后导入的排班文件会覆盖这些上限
+            click.echo(f"doctors: materialized {materialize_schedules(archive=False)['inserted']} schedules")
+
+
+def create_app(config=None):
+    """
+    应用工厂：只读取配置并注册接口，不访问数据库，worker 启动后可以直接处理请求
+    数据库需提前用 flask --app backend init-db 初始化
+    用法：gunicorn 'backend:create_app()'
+    模块中没有全局的应用对象，导入本模块不会创建应用；flask --app backend 会自动调用 create_app
+    """
+    app = Flask(__name__)
+    CORS(app, expose_headers=['X-Next-After-Id'])  # 启用CORS，并允许前端读取分页头
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///hospital.db')  # 可通过环境变量指向其他数据库
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = "secret_key"  # 更改为实际的密钥
+    if config:
+        app.config.update(config)
+
+    jwt.init_app(app)
+    init_engine(app, db)  # 按 SQLITE_PROFILE 等配置设置 PRAGMA 和连接池
+    init_metrics(app, db)  # REQUEST_METRICS=1 时统计每个接口的耗时和 SQL 语句数
+    init_profiler(app)  # 管理员通过 /admin/profiler 开启后剖析部分请求
+    init_admission(app)  # /user/book 按时间段排队，BOOKING_ADMISSION=0 时关闭
+    init_group_commit(app, db)  # GROUP_COMMIT=1 时预约、取消和修改排班由写线程合并提交
+    app.register_blueprint(api)
+    if app.config.get('SCHEDULE_MATERIALIZER', os.environ.get('SCHEDULE_MATERIALIZER')) in (True, '1'):
+        # 每天补齐排班；未启用时需要由 cron 执行 flask materialize-schedules
+        app.extensions['schedule_materializer'] = start_materializer(app, materialize_schedules)
+    return app
+
+
 if __name__ == '__main__':
+    # 本地开发时直接运行，启动前初始化数据库并写入示例数据
+    app = create_app()
+    with app.app_context():
+        init_db(seed=True)
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1 @@
+"""后端性能基准测试脚本，在 backend 目录下以 `python -m benchmarks.<脚本名>` 运行"""
@@ -0,0 +1,122 @@
+"""基准测试公用的辅助函数"""
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from database import db, Doctor, DoctorSchedule, User
+from engine_profile import init_engine
+from time_slots import MAX_SLOTS, PERIOD_MINUTES, default_slot_minutes, slot_count
+
+
+def scratch_db_path():
+    """返回一个尚不存在的临时数据库文件路径"""
+    fd, db_path = tempfile.mkstemp(suffix='.db', prefix='hospital-bench-')
+    os.close(fd)
+    os.remove(db_path)
+    return db_path
+
+
+def remove_db(db_path):
+    """删除临时数据库文件及 WAL 模式留下的 -wal、-shm 文件"""
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def make_app(db_path=None, profile=None):
+    """创建一个使用临时 SQLite 文件的 Flask 应用，不会碰到 instance/hospital.db
+
+    profile 为 SQLITE_PROFILE，不传时按环境变量或默认值。
+    """
+    if db_path is None:
+        db_path = scratch_db_path()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(db_path)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if profile is not None:
+        app.config['SQLITE_PROFILE'] = profile
+    init_engine(app, db)
+    with app.app_context():
+        db.create_all()
+    return app, db_path
+
+
+def load_backend(db_path=None):
+    """用 backend.create_app 创建连接到临时数据库的应用，并像 flask seed 一样初始化数据库，返回 (app, db_path)"""
+    if db_path is None:
+        db_path = scratch_db_path()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(db_path)
+    import backend
+    app = backend.create_app()
+    with app.app_context():
+        backend.init_db(seed=True)
+    return app, db_path
+
+
+def login(client, role, username, password):
+    """登录并返回带 JWT 的请求头"""
+    response = client.post(f'/login/{role}', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return {'Authorization': 'Bearer ' + response.get_json()['access_token']}
+
+
+# 基准数据统一使用同一个廉价的哈希，避免造数据的时间淹没测量结果
+_PASSWORD_HASH = generate_password_hash('password123', method='pbkdf2:sha256:1')
+
+
+def slot_minutes_for(limit):
+    """放得下 limit 个预约的最粗的小时段粒度，默认粒度放得下时用默认粒度；都放不下时用最细的粒度"""
+    if slot_count(default_slot_minutes()) >= limit:
+        return default_slot_minutes()
+    candidates = [m for m in range(PERIOD_MINUTES, 0, -1) if PERIOD_MINUTES % m == 0 and slot_count(m) <= MAX_SLOTS]
+    return next((m for m in candidates if slot_count(m) >= limit), candidates[-1])
+
+
+def seed(doctors, users, days=3, limit=10, first_doctor_id=1, departments=10):
+    """批量写入医生、用户和从今天开始 days 天的排班（需在应用上下文中调用），医生依次分到 departments 个科室"""
+    today = datetime.today().date()
+    doctor_ids = range(first_doctor_id, first_doctor_id + doctors)
+    db.session.execute(db.insert(Doctor), [
+        {'id': i, 'name': f'医生{i}', 'gender': '男', 'title': '主治医师', 'department': f'科室{i % departments}',
+         'office_number': str(100 + i), 'phone': str(13000000000 + i), 'password_hash': _PASSWORD_HASH, 'flag': False}
+        for i in doctor_ids
+    ])
+    if users:
+        db.session.execute(db.insert(User), [
+            {'id': f'{i:018d}', 'name': f'用户{i}', 'gender': '女', 'phone_number': str(15000000000 + i),
+             'address': '', 'emergency_contact': '', 'password_hash': _PASSWORD_HASH}
+            for i in range(1, users + 1)
+        ])
+    if days:
+        db.session.execute(db.insert(DoctorSchedule), [
+            {'doctor_id': i, 'date': today + timedelta(days=d), 'morning_booked': 0, 'morning_limit': limit,
+             'afternoon_booked': 0, 'afternoon_limit': limit, 'slot_minutes': slot_minutes_for(limit),
+             'department': f'科室{i % departments}'}
+            for i in doctor_ids for d in range(days)
+        ])
+    db.session.commit()
+
+
+@contextmanager
+def count_queries(engine):
+    """统计代码块内执行的 SQL 语句数，yield 一个只有一个元素的列表"""
+    counter = [0]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def user_id(i):
+    """seed 生成的第 i 个用户的身份证号"""
+    return f'{i:018d}'
@@ -0,0 +1,79 @@
+"""预约列表键集分页的延迟随预约表规模的变化
+
+预约表分别增长到 1 万、10 万、100 万条时，测量 /admin/appointments 和
+/doctor/appointments 的首页、深翻页（after_id 接近末尾）和日期范围页的延迟。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_appointment_pages --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from database import db, Appointment
+from benchmarks._common import load_backend, login, remove_db, seed, user_id
+
+
+def grow(target, doctors, users, rng):
+    """把预约表补足到 target 条，日期分布在前后一年内"""
+    current = Appointment.query.count()
+    today = datetime.today().date()
+    batch = 50000
+    while current < target:
+        n = min(batch, target - current)
+        # 随机生成的预约可能撞上唯一约束，忽略后循环补足
+        db.session.execute(db.insert(Appointment).prefix_with('OR IGNORE'), [
+            {'user_id': user_id(rng.randint(1, users)), 'doctor_id': rng.randint(1, doctors),
+             'appointment_date': today + timedelta(days=rng.randint(-365, 365)),
+             'appointment_period': rng.choice(('上午', '下午'))}
+            for _ in range(n)
+        ])
+        db.session.commit()
+        current = Appointment.query.count()
+
+
+def timed(client, url, headers, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    app, db_path = load_backend()
+    client = app.test_client()
+    admin = login(client, 'admin', 'admin', 'adminpassword')
+    doctor = login(client, 'doctor', 1, 'password123')
+    with app.app_context():
+        seed(doctors=195, users=2000, days=0, first_doctor_id=6)
+
+    today = datetime.today().date()
+    window = f'from={today}&to={today + timedelta(days=6)}'
+    for size in sorted(args.sizes):
+        with app.app_context():
+            grow(size, 200, 2000, rng)
+            deep = size - args.limit * 2
+        results = {
+            'admin first': timed(client, f'/admin/appointments?limit={args.limit}', admin, args.repeat),
+            'admin deep': timed(client, f'/admin/appointments?limit={args.limit}&after_id={deep}', admin, args.repeat),
+            'admin week': timed(client, f'/admin/appointments?limit={args.limit}&{window}', admin, args.repeat),
+            'doctor first': timed(client, f'/doctor/appointments?limit={args.limit}', doctor, args.repeat),
+            'doctor deep': timed(client, f'/doctor/appointments?limit={args.limit}&after_id={deep}', doctor, args.repeat),
+            'doctor week': timed(client, f'/doctor/appointments?limit={args.limit}&{window}', doctor, args.repeat),
+        }
+        print(f'appointments={size:<8} ' + '  '.join(f'{k}={v:.2f}ms' for k, v in results.items()))
+
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
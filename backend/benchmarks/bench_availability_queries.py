@@ -0,0 +1,60 @@
+"""GET /user/doctors_available 的查询次数回归检查
+
+分别在 10、100、1000 名医生时请求接口，统计每次请求执行的 SQL 语句数和耗时。
+冷请求需要重建快照缓存，热请求命中快照，两者的查询次数都应与医生数量无关，
+否则以非零状态退出。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_availability_queries
+"""
+import argparse
+import time
+
+from database import db, Doctor, availability_cache
+from benchmarks._common import count_queries, load_backend, login, remove_db, seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, db_path = load_backend()
+    client = app.test_client()
+    # load_backend 已写入 init_tables 的初始数据
+    headers = login(client, 'user', '123456789012345678', 'password123')
+
+    counts = {}
+    for size in sorted(args.sizes):
+        with app.app_context():
+            existing = Doctor.query.count()
+            if size > existing:
+                seed(doctors=size - existing, users=0, first_doctor_id=db.session.query(db.func.max(Doctor.id)).scalar() + 1)
+            engine = db.engine
+        # 直接写库绕过了 database.py 的写入函数，需要手动使快照失效
+        availability_cache.invalidate()
+        with count_queries(engine) as cold:
+            t0 = time.perf_counter()
+            response = client.get('/user/doctors_available', headers=headers)
+            cold_latency = time.perf_counter() - t0
+        assert response.status_code == 200 and len(response.get_json()) == size
+        with count_queries(engine) as warm:
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                client.get('/user/doctors_available', headers=headers)
+            warm_latency = (time.perf_counter() - t0) / args.repeat
+        counts[size] = (cold[0], warm[0] // args.repeat)
+        print(f'doctors={size:<6} cold: queries={cold[0]:<3} latency={cold_latency * 1000:.1f}ms  '
+              f'warm: queries={warm[0] // args.repeat:<3} latency={warm_latency * 1000:.1f}ms')
+
+    print(f'cache: {availability_cache.stats()}')
+    remove_db(db_path)
+    if len(set(counts.values())) != 1:
+        print(f'查询次数随医生数量增长：{counts}')
+        raise SystemExit(1)
+    print('查询次数与医生数量无关')
+
+
+if __name__ == '__main__':
+    main()
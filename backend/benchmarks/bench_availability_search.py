@@ -0,0 +1,139 @@
+"""GET /user/doctors_available 服务端筛选的耗时与返回数据量
+
+在 5000 名医生（100 个科室、14 天排班，三分之一的上午已约满）上对比：
+  - 全量：不带筛选条件请求默认的 3 天（命中快照缓存 / 缓存失效后重建），再像原来的前端一样在本地筛选
+  - 筛选：同样的条件通过查询参数下推到 SQL
+每种场景报告 p50 / p95 延迟、响应字节数、执行的 SQL 语句数和读取的排班行数。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_availability_search --doctors 5000 --requests 50
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+import database
+from database import db, Doctor, availability_cache, refresh_planner_stats
+from benchmarks._common import load_backend, login, remove_db, seed
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def client_filter(doctors, department=None, date=None, period=None, only_available=False, name=None):
+    """原来前端的本地筛选"""
+    result = []
+    for doctor in doctors:
+        if department and doctor['department'] != department or name and not doctor['name'].startswith(name):
+            continue
+        days = []
+        for day in doctor['available_times']:
+            if date and day['date'] != date:
+                continue
+            slots = [slot for slot in day['slots']
+                     if (not period or slot['period'] == period) and (not only_available or slot['available'])]
+            if slots:
+                days.append(dict(day, slots=slots))
+        if days:
+            result.append(dict(doctor, available_times=days))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    app, db_path = load_backend()
+    client = app.test_client()
+    headers = login(client, 'user', '123456789012345678', 'password123')
+    with app.app_context():
+        first = db.session.query(db.func.max(Doctor.id)).scalar() + 1
+        seed(doctors=args.doctors, users=0, days=args.days, first_doctor_id=first)
+        db.session.execute(db.text(
+            "UPDATE doctor SET department = '科室' || (id % 100), "
+            "title = CASE id % 4 WHEN 0 THEN '主任医师' ELSE '主治医师' END WHERE id >= :first"), {'first': first})
+        db.session.execute(db.text('UPDATE doctor_schedule SET morning_booked = morning_limit WHERE id % 3 = 0'))
+        db.session.commit()
+        refresh_planner_stats()
+        engine = db.engine
+    availability_cache.invalidate()
+
+    tomorrow = datetime.today().date() + timedelta(days=1)
+    label = tomorrow.strftime('%m月%d日')
+    scenarios = [
+        ('科室7 明天上午有号', {'department': '科室7', 'date': label, 'period': '上午', 'only_available': True}),
+        ('姓名前缀 医生12', {'name': '医生12'}),
+        ('明天所有有号的医生', {'date': label, 'only_available': True}),
+    ]
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *a: statements.append(a[2]))
+
+    def measure(path, cold=False):
+        latencies, sizes, counts = [], [], []
+        for _ in range(args.requests):
+            if cold:
+                availability_cache.invalidate()
+            statements.clear()
+            t0 = time.perf_counter()
+            response = client.get(path, headers=headers)
+            body = response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            assert response.status_code == 200, body[:200]
+            sizes.append(len(body))
+            counts.append(len(statements))
+        return latencies, sizes[-1], counts[-1], body
+
+    print(f'doctors={args.doctors + 5} days={args.days} requests={args.requests}')
+    print(f'{"scenario":<22}{"mode":<16}{"p50 ms":>9}{"p95 ms":>9}{"bytes":>11}{"sql":>5}{"doctors":>9}')
+    full = {}
+    for cold in (False, True):
+        latencies, size, count, body = measure('/user/doctors_available', cold)
+        full[cold] = (latencies, size, count, json.loads(body))
+
+    for name, params in scenarios:
+        for cold in (False, True):
+            latencies, size, count, doctors = full[cold]
+            filter_args = {'department': params.get('department'), 'date': params.get('date'), 'period': params.get('period'),
+                           'only_available': params.get('only_available', False), 'name': params.get('name')}
+            t0 = time.perf_counter()
+            filtered = client_filter(doctors, **filter_args)
+            filter_seconds = time.perf_counter() - t0
+            # 全量请求的耗时 + 前端解析与筛选的耗时（解析按 json.loads 估算）
+            t0 = time.perf_counter()
+            json.loads(json.dumps(doctors))
+            parse_seconds = (time.perf_counter() - t0) / 2
+            total = [latency + filter_seconds + parse_seconds for latency in latencies]
+            mode = 'full (cold)' if cold else 'full (cached)'
+            print(f'{name:<22}{mode:<16}{percentile(total, 0.5) * 1000:>9.1f}{percentile(total, 0.95) * 1000:>9.1f}'
+                  f'{size:>11}{count:>5}{len(filtered):>9}')
+
+        query = '&'.join(f'{key}={"true" if value is True else value}' for key, value in params.items())
+        latencies, size, count, body = measure(f'/user/doctors_available?{query}')
+        result = json.loads(body)
+        assert sorted(d['id'] for d in result) == sorted(d['id'] for d in filtered), name
+        print(f'{"":<22}{"filtered":<16}{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}'
+              f'{size:>11}{count:>5}{len(result):>9}')
+
+    with app.app_context():
+        # 返回的排班行数：筛选查询在 SQL 中就过滤掉了不需要的行
+        for name, params in scenarios:
+            date = tomorrow if 'date' in params else None
+            rows = database.search_doctors_availability(
+                '123456789012345678', 3, department=params.get('department'), name_prefix=params.get('name'),
+                date=date, period=params.get('period'), only_available=params.get('only_available', False))
+            print(f'{name}: {sum(len(d["available_times"]) for d in rows)} schedule rows returned by SQL '
+                  f'(full listing reads {3 * (args.doctors + 5)})')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""预约/取消并发压测
+
+多个线程同时抢少量医生的名额，统计每秒预约数，并在结束后校验：
+  - 每个排班的 booked <= limit
+  - 每个排班的 booked 等于实际预约记录数
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_booking --threads 16 --attempts 400
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from database import db, Appointment, DoctorSchedule, book_doctor, cancel_appointment
+from benchmarks._common import make_app, remove_db, seed, user_id
+
+
+# 每个线程轮流使用的患者数，重复预约同一时间段会被唯一约束拒绝
+USERS_PER_THREAD = 50
+
+
+def check_invariants():
+    """校验计数器与预约记录一致且没有超额预约，返回发现的问题列表"""
+    counts = {}
+    for doctor_id, date, period, n in db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period, func.count()
+    ).group_by(Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period):
+        counts[(doctor_id, date, period)] = n
+    problems = []
+    for s in DoctorSchedule.query.all():
+        for period, booked, limit in (('上午', s.morning_booked, s.morning_limit), ('下午', s.afternoon_booked, s.afternoon_limit)):
+            actual = counts.get((s.doctor_id, s.date, period), 0)
+            if booked > limit:
+                problems.append(f'超额预约 doctor={s.doctor_id} {s.date} {period}: {booked}/{limit}')
+            if booked != actual:
+                problems.append(f'计数不一致 doctor={s.doctor_id} {s.date} {period}: booked={booked} 实际={actual}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=400, help='每个线程尝试预约的次数')
+    parser.add_argument('--doctors', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=20, help='每个时间段的名额')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app, db_path = make_app()
+    with app.app_context():
+        seed(doctors=args.doctors, users=args.threads * USERS_PER_THREAD, days=3, limit=args.limit)
+    today = datetime.today().date()
+    slots = [(d, today + timedelta(days=i), p) for d in range(1, args.doctors + 1) for i in range(3) for p in ('上午', '下午')]
+
+    stats = {'booked': 0, 'full': 0, 'duplicate': 0, 'locked': 0, 'cancelled': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads + 1)
+
+    def worker(n):
+        rng = random.Random(args.seed * 1000 + n)
+        mine = []
+        local = dict.fromkeys(stats, 0)
+        with app.app_context():
+            start.wait()
+            for _ in range(args.attempts):
+                doctor_id, date, period = rng.choice(slots)
+                patient = user_id(n * USERS_PER_THREAD + rng.randint(1, USERS_PER_THREAD))
+                try:
+                    appointment = book_doctor(patient, doctor_id, date, period)
+                except IntegrityError:
+                    local['duplicate'] += 1
+                    continue
+                except OperationalError:
+                    local['locked'] += 1
+                    continue
+                if appointment is None:
+                    local['full'] += 1
+                    continue
+                local['booked'] += 1
+                mine.append(appointment.id)
+                # 每预约三次取消一次，模拟改约
+                if rng.random() < 0.33:
+                    try:
+                        if cancel_appointment(mine.pop(rng.randrange(len(mine)))):
+                            local['cancelled'] += 1
+                    except OperationalError:
+                        local['locked'] += 1
+            db.session.remove()
+        with lock:
+            for k, v in local.items():
+                stats[k] += v
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with app.app_context():
+        problems = check_invariants()
+        total = Appointment.query.count()
+        capacity = db.session.query(func.sum(DoctorSchedule.morning_limit + DoctorSchedule.afternoon_limit)).scalar()
+
+    attempts = args.threads * args.attempts
+    print(f'threads={args.threads} attempts={attempts} elapsed={elapsed:.2f}s')
+    print(f'booked={stats["booked"]} cancelled={stats["cancelled"]} full={stats["full"]} '
+          f'duplicate={stats["duplicate"]} locked={stats["locked"]}')
+    print(f'bookings/sec={stats["booked"] / elapsed:.1f} operations/sec={(attempts + stats["cancelled"]) / elapsed:.1f}')
+    print(f'remaining appointments={total} capacity={capacity}')
+    remove_db(db_path)
+    if problems:
+        print('不变量校验失败：')
+        for p in problems:
+            print('  ' + p)
+        raise SystemExit(1)
+    print('不变量校验通过：所有排班 booked <= limit 且 booked 与预约记录数一致')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""放号瞬间的预约洪峰：有无准入控制（admission.py）的对比
+
+少数几个热门时间段（默认 4 个，每个 10 个名额）同时放号，--patients 个患者在同一时刻各发一次 /user/book，
+请求由 --workers 个线程（相当于服务器的 worker 线程数）处理。分别在关闭和开启准入控制时运行，报告：
+  - 各状态码的数量（201 成功、400 名额已满、429 稍后重试、500 等待写锁超时）
+  - sold：名额全部约完所用的时间；drain：所有请求都收到响应所用的时间
+  - goodput：在 --slo-ms 之内收到响应的请求数 / drain
+  - 所有请求从发出到收到响应的 p50 / p95 / p99 / 最大延迟（包括等待 worker 的时间）
+测试客户端和应用在同一个进程中，单核机器上被拒绝的请求与预约请求争用同一个 GIL，
+开启准入控制时 sold 往往更长（拒绝提前发生，与预约交错执行），但 drain 和尾延迟明显缩短。
+每轮结束后校验没有超额预约、计数与预约记录一致。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_booking_surge --patients 600 --workers 32 --rounds 3
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from admission import booking_admission
+from database import db, Appointment, DoctorSchedule, availability_cache
+from benchmarks._common import load_backend, remove_db, seed, user_id
+from benchmarks.bench_booking import check_invariants
+
+FIRST_DOCTOR_ID = 1000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def reset(app, limit):
+    """清空上一轮的预约，名额恢复为 limit"""
+    with app.app_context():
+        Appointment.query.filter(Appointment.doctor_id >= FIRST_DOCTOR_ID).delete()
+        DoctorSchedule.query.filter(DoctorSchedule.doctor_id >= FIRST_DOCTOR_ID).update(
+            {'morning_booked': 0, 'morning_limit': limit, 'afternoon_booked': 0, 'afternoon_limit': limit,
+             'morning_slots': 0, 'afternoon_slots': 0})
+        db.session.commit()
+    availability_cache.invalidate()
+
+
+def surge(app, headers, slots, workers):
+    """所有患者同时预约，返回 (每个请求的 (状态码, 延迟), 最后一个成功预约完成的时刻)"""
+    local = threading.local()
+    results = [None] * len(headers)
+    last_success = [0.0]
+
+    def book(i, t0):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        doctor_id, date, period = slots[i % len(slots)]
+        response = client.post('/user/book', headers=headers[i], json={
+            'doctor_id': doctor_id, 'appointment_date': date.strftime('%m月%d日'), 'appointment_period': period})
+        finished = time.perf_counter()
+        results[i] = (response.status_code, finished - t0)
+        if response.status_code == 201:
+            last_success[0] = max(last_success[0], finished - t0)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # 先让所有 worker 线程启动，再同时提交全部请求
+        list(pool.map(lambda _: time.sleep(0.01), range(workers)))
+        t0 = time.perf_counter()
+        for i in range(len(headers)):
+            pool.submit(book, i, t0)
+    return results, last_success[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=600)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--slots', type=int, default=4, help='热门时间段的个数')
+    parser.add_argument('--limit', type=int, default=10, help='每个时间段的名额')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--key-concurrency', type=int, default=1, help='BOOKING_KEY_CONCURRENCY')
+    parser.add_argument('--slo-ms', type=float, default=1000, help='计入 goodput 的最大延迟')
+    args = parser.parse_args()
+
+    app, db_path = load_backend()
+    with app.app_context():
+        seed(doctors=args.slots, users=args.patients, days=2, limit=args.limit, first_doctor_id=FIRST_DOCTOR_ID)
+        headers = [{'Authorization': 'Bearer ' + create_access_token(identity={'id': user_id(i + 1), 'role': 'user'})}
+                   for i in range(args.patients)]
+    tomorrow = datetime.today().date() + timedelta(days=1)
+    slots = [(FIRST_DOCTOR_ID + i, tomorrow, '上午') for i in range(args.slots)]
+    capacity = args.slots * args.limit
+
+    print(f'patients={args.patients} workers={args.workers} slots={args.slots} limit={args.limit} '
+          f'capacity={capacity} rounds={args.rounds}')
+    print(f'{"admission":<10}{"201":>6}{"400":>6}{"429":>6}{"500":>6}{"sold ms":>9}{"drain ms":>10}{"goodput/s":>11}'
+          f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+    for _ in range(args.rounds):
+        # 交替运行，减少机器负载波动的影响
+        for enabled in (False, True):
+            reset(app, args.limit)
+            # 每轮从空的排队状态开始
+            booking_admission.__init__()
+            booking_admission.enabled = enabled
+            booking_admission.concurrency = args.key_concurrency
+            results, sold_in = surge(app, headers, slots, args.workers)
+            with app.app_context():
+                problems = check_invariants()
+            if problems:
+                raise SystemExit('\n'.join(problems))
+            statuses = Counter(status for status, _ in results)
+            latencies = [latency for _, latency in results]
+            drain = max(latencies)
+            goodput = sum(1 for status, latency in results if status != 500 and latency * 1000 <= args.slo_ms) / drain
+            print(f'{"on" if enabled else "off":<10}{statuses[201]:>6}{statuses[400]:>6}{statuses[429]:>6}{statuses[500]:>6}'
+                  f'{sold_in * 1000:>9.0f}{drain * 1000:>10.0f}{goodput:>11.0f}'
+                  f'{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}'
+                  f'{percentile(latencies, 0.99) * 1000:>9.1f}{drain * 1000:>9.1f}')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""默认连接配置与调优配置（WAL 等）在读写混合负载下的吞吐量对比
+
+读线程反复构建可预约情况（两条范围查询），写线程反复预约和取消，
+分别统计读写吞吐量、p95 延迟和 "database is locked" 错误数。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_engine_profile --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import database
+from database import db
+from benchmarks._common import make_app, remove_db, seed, user_id
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def run(profile, args):
+    app, db_path = make_app(profile=profile)
+    with app.app_context():
+        seed(doctors=args.doctors, users=args.writers * 100, days=3, limit=1000)
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+    today = datetime.today().date()
+    stop = time.perf_counter() + args.seconds
+    results = {'read': [], 'write': [], 'locked': 0}
+    lock = threading.Lock()
+
+    def reader(n):
+        latencies = []
+        with app.app_context():
+            while time.perf_counter() < stop:
+                t0 = time.perf_counter()
+                try:
+                    database._build_availability_snapshot(today, today + timedelta(days=2))
+                    db.session.query(database.Appointment.id).filter_by(user_id=user_id(n + 1)).all()
+                    db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    with lock:
+                        results['locked'] += 1
+                    continue
+                latencies.append(time.perf_counter() - t0)
+        with lock:
+            results['read'].extend(latencies)
+
+    def writer(n):
+        rng = random.Random(n)
+        latencies = []
+        with app.app_context():
+            while time.perf_counter() < stop:
+                patient = user_id(n * 100 + rng.randint(1, 100))
+                doctor_id, date, period = rng.randint(1, args.doctors), today + timedelta(days=rng.randint(0, 2)), rng.choice(('上午', '下午'))
+                t0 = time.perf_counter()
+                try:
+                    appointment = database.book_doctor(patient, doctor_id, date, period)
+                    if appointment is not None:
+                        database.cancel_appointment(appointment.id)
+                except IntegrityError:
+                    continue
+                except OperationalError:
+                    with lock:
+                        results['locked'] += 1
+                    continue
+                latencies.append(time.perf_counter() - t0)
+        with lock:
+            results['write'].extend(latencies)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    remove_db(db_path)
+    print(f'profile={profile:<8} journal={journal_mode:<8} '
+          f'reads/sec={len(results["read"]) / elapsed:.1f} read_p95={percentile(results["read"], 0.95) * 1000:.1f}ms '
+          f'book+cancel/sec={len(results["write"]) / elapsed:.1f} write_p95={percentile(results["write"], 0.95) * 1000:.1f}ms '
+          f'locked={results["locked"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'tuned'])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    for profile in args.profiles:
+        run(profile, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""SSE 订阅基准：一个服务进程承载几千个空闲的 /events/availability 连接
+
+服务在子进程中用 werkzeug 多线程服务器运行（每个连接一个线程），本进程用原始 socket 建立订阅，
+然后测量：
+  - 建立全部连接的耗时
+  - 空闲期间服务进程的 CPU 占用、RSS 和线程数
+  - 一次预约后事件到达全部订阅者的延迟（p50 / 最大值）
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_events --subscribers 2000 --idle 10 --rounds 5
+"""
+import argparse
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+
+def serve(db_path, port):
+    """子进程：初始化数据库并启动多线程服务器"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from benchmarks._common import load_backend
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app, _ = load_backend(db_path)
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietHandler)
+    server.socket.listen(4096)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def proc_stats(pid):
+    """读取进程的 CPU 秒数、RSS（MB）和线程数"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return cpu, int(status['VmRSS'].split()[0]) / 1024, int(status['Threads'])
+
+
+def post(url, body, token=None):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    if token:
+        request.add_header('Authorization', 'Bearer ' + token)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def subscribe(port, token):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(f'GET /events/availability?jwt={token} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+    data = b''
+    while b'subscribed' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise RuntimeError('subscription closed: ' + data.decode(errors='replace'))
+        data += chunk
+    sock.setblocking(False)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--idle', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--serve', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve[0], int(args.serve[1]))
+
+    from benchmarks._common import remove_db, scratch_db_path
+    db_path = scratch_db_path()
+    server = subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_events', '--serve', db_path, str(args.port)],
+                              stdout=subprocess.PIPE, text=True)
+    sockets = []
+    try:
+        while server.stdout.readline().strip() != 'ready':
+            pass
+        base = f'http://127.0.0.1:{args.port}'
+        token = post(base + '/login/user', {'username': '123456789012345678', 'password': 'password123'})['access_token']
+        cpu0, rss0, threads0 = proc_stats(server.pid)
+
+        t0 = time.perf_counter()
+        for _ in range(args.subscribers):
+            sockets.append(subscribe(args.port, token))
+        connect_seconds = time.perf_counter() - t0
+
+        cpu1, _, _ = proc_stats(server.pid)
+        time.sleep(args.idle)
+        cpu2, rss, threads = proc_stats(server.pid)
+        print(f'subscribers={args.subscribers}  connect={connect_seconds:.2f}s  '
+              f'rss={rss0:.0f}MB -> {rss:.0f}MB ({(rss - rss0) * 1024 / args.subscribers:.1f}KB/subscriber)  '
+              f'threads={threads0} -> {threads}  idle_cpu={(cpu2 - cpu1) / args.idle * 100:.1f}%')
+
+        selector = selectors.DefaultSelector()
+        for sock in sockets:
+            selector.register(sock, selectors.EVENT_READ)
+        day = (datetime.today().date() + timedelta(days=1)).strftime('%m月%d日')
+        for i in range(args.rounds):
+            path = '/user/book' if i % 2 == 0 else '/user/cancel'
+            pending = set(sockets)
+            latencies = []
+            t0 = time.perf_counter()
+            post(base + path, {'doctor_id': 1, 'appointment_date': day, 'appointment_period': '下午'}, token)
+            while pending:
+                for key, _ in selector.select(timeout=10):
+                    if key.fileobj in pending and b'event: slot' in key.fileobj.recv(65536):
+                        pending.discard(key.fileobj)
+                        latencies.append(time.perf_counter() - t0)
+            latencies.sort()
+            print(f'{path:<13} fan-out to {len(latencies)}: p50={latencies[len(latencies) // 2] * 1000:.1f}ms '
+                  f'max={latencies[-1] * 1000:.1f}ms')
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.terminate()
+        server.wait()
+        remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
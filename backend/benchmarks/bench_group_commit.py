@@ -0,0 +1,124 @@
+"""组提交（group_commit.py）的预约吞吐：每秒预约数随并发客户端数的变化
+
+--clients 中的每个并发数下，每个客户端线程用自己的患者依次预约 --bookings 个时间段
+（各客户端从不同的位置开始轮流预约，每个时间段最多 --limit 个预约），分别在三种模式下运行：
+  - off：每个预约各自提交（原来的行为）
+  - on/0ms：写线程只合并已经在排队的操作
+  - on/Nms：写线程等待 --window-ms 毫秒收集一批
+报告每秒预约数、提交次数和平均每次提交的预约数，以及等待写锁超时的次数。
+提交的代价取决于同步级别，可以用 --synchronous FULL 观察每次提交都要 fsync 时的差别。
+每次运行后校验没有超额预约、计数与预约记录一致。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_group_commit --clients 1 4 16 64 --bookings 100
+    python -m benchmarks.bench_group_commit --synchronous FULL
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from database import db, Appointment, DoctorSchedule, availability_cache, book_doctor
+from group_commit import group_writer
+from benchmarks._common import make_app, remove_db, seed, user_id
+from benchmarks.bench_booking import check_invariants
+
+
+def reset():
+    """清空上一次运行的预约"""
+    Appointment.query.delete()
+    DoctorSchedule.query.update({'morning_booked': 0, 'afternoon_booked': 0, 'morning_slots': 0, 'afternoon_slots': 0})
+    db.session.commit()
+    availability_cache.invalidate()
+
+
+def run(app, clients, slots, bookings):
+    """clients 个线程同时预约，返回 (成功数, 等锁超时数, 秒数)"""
+    start = threading.Barrier(clients + 1)
+    results = [None] * clients
+
+    def client(n):
+        booked = locked = 0
+        with app.app_context():
+            start.wait()
+            for k in range(bookings):
+                doctor_id, date, period = slots[(n * bookings + k) % len(slots)]
+                try:
+                    if book_doctor(user_id(n + 1), doctor_id, date, period) is not None:
+                        booked += 1
+                except OperationalError:
+                    locked += 1
+        results[n] = (booked, locked)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return sum(r[0] for r in results), sum(r[1] for r in results), time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--bookings', type=int, default=100, help='每个客户端的预约次数')
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=16, help='每个时间段的名额')
+    parser.add_argument('--window-ms', type=float, default=2)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--synchronous', help='SQLITE_SYNCHRONOUS，如 NORMAL（tuned 默认）或 FULL')
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    if args.synchronous:
+        os.environ['SQLITE_SYNCHRONOUS'] = args.synchronous
+    # 名额足够所有客户端的预约，测的是提交的开销而不是名额竞争；每个客户端预约的时间段互不重复
+    days = max(-(-max(args.clients) * args.bookings // (args.doctors * 2 * args.limit)),
+               -(-args.bookings // (args.doctors * 2)))
+    app, db_path = make_app()
+    with app.app_context():
+        seed(doctors=args.doctors, users=max(args.clients), days=days, limit=args.limit)
+        engine = db.engine
+    today = datetime.today().date()
+    slots = [(d, today + timedelta(days=i), p) for i in range(days) for d in range(1, args.doctors + 1) for p in ('上午', '下午')]
+
+    commits = [0]
+    event.listen(engine, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+
+    modes = [('off', None), ('on/0ms', 0), (f'on/{args.window_ms:g}ms', args.window_ms)]
+    print(f'bookings/client={args.bookings} doctors={args.doctors} synchronous={args.synchronous or "NORMAL"} '
+          f'max_batch={args.max_batch} rounds={args.rounds}（取最好的一轮）')
+    print(f'{"clients":>8}{"mode":>10}{"bookings":>10}{"locked":>8}{"seconds":>9}{"bookings/s":>12}{"commits":>9}{"per commit":>12}')
+    for clients in args.clients:
+        for mode, window in modes:
+            best = None
+            for _ in range(args.rounds):
+                with app.app_context():
+                    reset()
+                if window is not None:
+                    group_writer.window = window / 1000
+                    group_writer.max_batch = args.max_batch
+                    group_writer.start(app, db)
+                commits[0] = 0
+                booked, locked, seconds = run(app, clients, slots, args.bookings)
+                group_writer.stop()
+                with app.app_context():
+                    problems = check_invariants()
+                if problems:
+                    raise SystemExit('\n'.join(problems))
+                if best is None or booked / seconds > best[0] / best[2]:
+                    best = (booked, locked, seconds, commits[0])
+            booked, locked, seconds, count = best
+            print(f'{clients:>8}{mode:>10}{booked:>10}{locked:>8}{seconds:>9.2f}{booked / seconds:>12.0f}'
+                  f'{count:>9}{booked / max(count, 1):>12.1f}')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
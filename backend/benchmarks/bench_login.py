@@ -0,0 +1,83 @@
+"""登录吞吐量：请求线程内直接校验 vs 进程池校验
+
+多个客户端线程同时调用 /login/user，另有一个线程持续请求轻量接口
+/user/profile，观察密码校验是否阻塞其他请求。workers=0 表示在请求线程内直接计算。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_login --workers 0 1 2 4 --clients 16 --seconds 5
+"""
+import argparse
+import os
+import threading
+import time
+
+import passwords
+from benchmarks._common import load_backend, login, remove_db
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def run(app, headers, clients, seconds):
+    """运行一轮压测，返回 (登录次数/秒, 登录 p95 毫秒, 轻量请求 p95 毫秒)"""
+    stop = time.perf_counter() + seconds
+    login_latencies = []
+    profile_latencies = []
+    lock = threading.Lock()
+
+    def login_worker():
+        client = app.test_client()
+        local = []
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            response = client.post('/login/user', json={'username': '123456789012345678', 'password': 'password123'})
+            assert response.status_code == 200
+            local.append(time.perf_counter() - t0)
+        with lock:
+            login_latencies.extend(local)
+
+    def profile_worker():
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            client.get('/user/profile', headers=headers)
+            profile_latencies.append(time.perf_counter() - t0)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(clients)] + [threading.Thread(target=profile_worker)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return len(login_latencies) / elapsed, percentile(login_latencies, 0.95) * 1000, percentile(profile_latencies, 0.95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--method', default=None, help='哈希算法和成本，默认使用 PASSWORD_HASH_METHOD')
+    args = parser.parse_args()
+
+    if args.method:
+        passwords.configure(method=args.method)
+    passwords.configure(workers=0)
+    app, db_path = load_backend()
+    headers = login(app.test_client(), 'user', '123456789012345678', 'password123')
+    for workers in args.workers:
+        passwords.configure(workers=workers)
+        run(app, headers, 1, 0.5)  # 预热进程池
+        rate, login_p95, profile_p95 = run(app, headers, args.clients, args.seconds)
+        mode = 'inline' if workers == 0 else f'pool({workers})'
+        print(f'{mode:<9} clients={args.clients} logins/sec={rate:.1f} login_p95={login_p95:.0f}ms profile_p95={profile_p95:.1f}ms')
+    passwords.configure(workers=0)
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
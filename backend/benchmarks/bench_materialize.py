@@ -0,0 +1,59 @@
+"""排班生成基准：在几千名医生、60 天预约窗口下 materialize_schedules 的耗时
+
+每个规模使用一个新的临时数据库，一半医生设置了每周模板，依次测量：
+  - 首次生成整个预约窗口
+  - 同一天重复执行（没有需要补齐的排班）
+  - 第二天执行（每个医生补齐一天，归档一天）
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_materialize --sizes 1000 5000 --horizon 60
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import schedule_horizon
+from database import db, DoctorSchedule, DoctorScheduleArchive, DoctorScheduleTemplate, materialize_schedules
+from benchmarks._common import make_app, remove_db, seed
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--horizon', type=int, default=60)
+    args = parser.parse_args()
+    schedule_horizon.configure(horizon_days=args.horizon, retention_days=0)
+    today = datetime.today().date()
+
+    for size in args.sizes:
+        app, db_path = make_app()
+        with app.app_context():
+            seed(doctors=size, users=0, days=0)
+            db.session.execute(db.insert(DoctorScheduleTemplate), [
+                {'doctor_id': doctor_id, 'weekday': weekday, 'morning_limit': 0 if weekday >= 5 else 20,
+                 'afternoon_limit': 0 if weekday >= 5 else 15}
+                for doctor_id in range(1, size + 1, 2) for weekday in range(7)
+            ])
+            db.session.commit()
+
+            first, first_seconds = timed(materialize_schedules, today)
+            again, again_seconds = timed(materialize_schedules, today)
+            next_day, next_seconds = timed(materialize_schedules, today + timedelta(days=1))
+            assert first['inserted'] == size * args.horizon, first
+            assert again['inserted'] == 0, again
+            assert next_day == {'inserted': size, 'archived': size}, next_day
+            assert DoctorSchedule.query.count() == size * args.horizon
+            assert DoctorScheduleArchive.query.count() == size
+        print(f'doctors={size:<6} horizon={args.horizon}  first={first_seconds:.2f}s ({first["inserted"]} rows)  '
+              f'same_day={again_seconds:.2f}s  next_day={next_seconds:.2f}s (+{size} / archived {size})')
+        remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
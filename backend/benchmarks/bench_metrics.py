@@ -0,0 +1,90 @@
+"""请求统计（REQUEST_METRICS）的开销
+
+同一个临时数据库上创建两个应用：一个不启用统计（默认），一个启用统计，
+用测试客户端交替发出同一组只读请求，比较每个请求的平均耗时；
+另外直接在两个引擎上执行 SELECT 1，测量每条语句上事件监听的开销。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_metrics --requests 2000 --rounds 5
+"""
+import argparse
+import time
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import text
+
+from database import db
+from benchmarks._common import load_backend, remove_db
+
+USER_ID = '123456789012345678'  # init_tables 写入的用户
+DOCTOR_ID = 1
+
+PATHS = [
+    ('/user/doctors_available', 'user'),
+    ('/user/profile', 'user'),
+    ('/doctor/schedule', 'doctor'),
+    ('/doctor/appointments', 'doctor'),
+]
+
+
+def per_request(app, headers, count):
+    """发出 count 个请求，返回每个请求的平均秒数"""
+    client = app.test_client()
+    t0 = time.perf_counter()
+    for i in range(count):
+        path, role = PATHS[i % len(PATHS)]
+        response = client.get(path, headers=headers[role])
+        assert response.status_code == 200, (path, response.get_data(as_text=True))
+    return (time.perf_counter() - t0) / count
+
+
+def per_statement(app, count):
+    """执行 count 条 SELECT 1，返回每条语句的平均秒数"""
+    with app.app_context():
+        with db.engine.connect() as conn:
+            statement = text('SELECT 1')
+            t0 = time.perf_counter()
+            for _ in range(count):
+                conn.execute(statement)
+            return (time.perf_counter() - t0) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--statements', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    off, db_path = load_backend()
+    import backend
+    on = backend.create_app({'REQUEST_METRICS': True, 'SLOW_QUERY_MS': 1000})
+    apps = {'off': off, 'on': on}
+    with off.app_context():
+        headers = {
+            'user': {'Authorization': 'Bearer ' + create_access_token(identity={'id': USER_ID, 'role': 'user'})},
+            'doctor': {'Authorization': 'Bearer ' + create_access_token(identity={'id': DOCTOR_ID, 'role': 'doctor'})},
+        }
+
+    response = on.test_client().get(PATHS[0][0], headers=headers['user'])
+    print('Server-Timing:', ', '.join(response.headers.getlist('Server-Timing')))
+
+    requests = {name: [] for name in apps}
+    statements = {name: [] for name in apps}
+    for _ in range(args.rounds):
+        # 交替测量，减少机器负载波动的影响
+        for name, app in apps.items():
+            requests[name].append(per_request(app, headers, args.requests))
+            statements[name].append(per_statement(app, args.statements))
+
+    best = {name: (min(requests[name]), min(statements[name])) for name in apps}
+    for name in apps:
+        print(f'metrics {name:<3}  request={best[name][0] * 1e6:8.1f}us  statement={best[name][1] * 1e6:6.2f}us')
+    print(f'overhead when enabled: {(best["on"][0] - best["off"][0]) * 1e6:+.1f}us/request '
+          f'({(best["on"][0] / best["off"][0] - 1) * 100:+.1f}%), '
+          f'{(best["on"][1] - best["off"][1]) * 1e6:+.2f}us/statement')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
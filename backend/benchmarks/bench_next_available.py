@@ -0,0 +1,168 @@
+"""按科室查找最早的空闲时间段：部分索引与逐行扫描的对比
+
+--departments 个科室、每个科室 --doctors 名医生、--days 天的排班，每个小时段按 --occupancy 的比例随机占用，
+再把所有科室前 K 天（--full-days 中的每个值）的排班全部约满，模拟越来越难约的情况。对每个 K：
+  - index：get_next_available，按科室和日期读取只包含还有名额的排班的部分索引，凑够 --limit 个就停止
+  - scan：没有这个索引时的做法，读出科室在预约窗口内的所有排班，逐行找出空闲时间段后排序取前 --limit 个
+报告两种方法读取的行数和延迟，并校验结果一致；再报告 /user/next_available 的 p50/p95 延迟。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_next_available --departments 50 --doctors 100 --days 60
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import schedule_horizon
+from database import db, Appointment, Doctor, DoctorSchedule, get_next_available, parse_date_label
+from time_slots import PERIOD_STARTS, default_slot_minutes, first_free, free_count, slot_count, slot_time
+from benchmarks._common import load_backend, login, remove_db, seed
+
+USER_ID = '123456789012345678'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fill(occupancy, rng):
+    """随机占用每个排班的小时段，写入位图和已预约人数"""
+    count = slot_count(default_slot_minutes())
+    rows = []
+    for schedule_id, in db.session.query(DoctorSchedule.id):
+        row = {'id': schedule_id}
+        for prefix in ('morning', 'afternoon'):
+            mask = sum(1 << i for i in range(count) if rng.random() < occupancy)
+            row[f'{prefix}_slots'] = mask
+            row[f'{prefix}_booked'] = mask.bit_count()
+        rows.append(row)
+    db.session.execute(db.text(
+        'UPDATE doctor_schedule SET morning_booked = :morning_booked, morning_slots = :morning_slots, '
+        'afternoon_booked = :afternoon_booked, afternoon_slots = :afternoon_slots WHERE id = :id'
+    ), rows)
+    db.session.commit()
+
+
+def book_up(before):
+    """把 before 之前的排班全部约满"""
+    full = (1 << slot_count(default_slot_minutes())) - 1
+    db.session.execute(db.text(
+        'UPDATE doctor_schedule SET morning_booked = morning_limit, afternoon_booked = afternoon_limit, '
+        'morning_slots = :full, afternoon_slots = :full WHERE date < :before'
+    ), {'full': full, 'before': before})
+    db.session.commit()
+
+
+def with_scan(department, limit):
+    """读出科室在预约窗口内的所有排班逐行查找，返回 (结果, 读取行数)，结果格式同 get_next_available"""
+    today = datetime.today().date()
+    end = today + timedelta(days=schedule_horizon.horizon_days() - 1)
+    rows = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.date, DoctorSchedule.slot_minutes,
+        DoctorSchedule.morning_booked, DoctorSchedule.morning_limit, DoctorSchedule.morning_slots,
+        DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit, DoctorSchedule.afternoon_slots
+    ).join(Doctor, Doctor.id == DoctorSchedule.doctor_id).filter(
+        Doctor.department == department, DoctorSchedule.date.between(today, end)
+    ).all()
+    found = []
+    for doctor_id, date, minutes, *periods in rows:
+        count = slot_count(minutes)
+        for period, (booked, period_limit, mask) in (('上午', periods[0:3]), ('下午', periods[3:6])):
+            index = first_free(mask, count) if booked < period_limit else None
+            if index is not None:
+                found.append((date, PERIOD_STARTS[period] + index * minutes, doctor_id, period, index * minutes,
+                              min(period_limit - booked, free_count(mask, count))))
+    found.sort()
+    return [(date.strftime("%m月%d日"), doctor_id, period, slot_time(period, offset), free)
+            for date, _, doctor_id, period, offset, free in found[:limit]], len(rows)
+
+
+def index_rows(department, result):
+    """index 方法读取的行数：部分索引中从今天到结果中最后一天的行（读完最后一天才停止）"""
+    if not result:
+        return 0
+    last = parse_date_label(result[-1]['date'])
+    return db.session.query(DoctorSchedule.id).filter(
+        DoctorSchedule.department == department, DoctorSchedule.date.between(datetime.today().date(), last),
+        db.or_(DoctorSchedule.morning_booked < DoctorSchedule.morning_limit,
+               DoctorSchedule.afternoon_booked < DoctorSchedule.afternoon_limit)
+    ).count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--departments', type=int, default=50)
+    parser.add_argument('--doctors', type=int, default=100, help='每个科室的医生数')
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--occupancy', type=float, default=0.5, help='每个小时段被占用的概率')
+    parser.add_argument('--full-days', type=int, nargs='+', default=[0, 7, 30], help='前几天全部约满')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=300, help='/user/next_available 的请求数')
+    args = parser.parse_args()
+
+    app, db_path = load_backend()
+    schedule_horizon.configure(horizon_days=args.days)
+    client = app.test_client()
+    headers = login(client, 'user', USER_ID, 'password123')
+    doctors = args.departments * args.doctors
+    with app.app_context():
+        # 去掉示例数据的排班和预约，只保留生成的数据
+        Appointment.query.delete()
+        DoctorSchedule.query.delete()
+        first = db.session.query(db.func.max(Doctor.id)).scalar() + 1
+        t0 = time.perf_counter()
+        seed(doctors=doctors, users=0, days=args.days, limit=slot_count(default_slot_minutes()),
+             first_doctor_id=first, departments=args.departments)
+        fill(args.occupancy, random.Random(0))
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        schedules = DoctorSchedule.query.count()
+        print(f'departments={args.departments} doctors/department={args.doctors} days={args.days} '
+              f'schedules={schedules} occupancy={args.occupancy} limit={args.limit} '
+              f'(generated in {time.perf_counter() - t0:.1f}s)')
+
+    today = datetime.today().date()
+    departments = [f'科室{i}' for i in range(args.departments)]
+    rng = random.Random(1)
+    print(f'{"full days":>9}{"method":>8}{"rows read":>11}{"p50 ms":>9}{"p95 ms":>9}')
+    for full_days in args.full_days:
+        with app.app_context():
+            book_up(today + timedelta(days=full_days))
+        for method in ('index', 'scan'):
+            latencies, rows = [], []
+            for _ in range(args.rounds):
+                department = rng.choice(departments)
+                with app.app_context():
+                    t0 = time.perf_counter()
+                    if method == 'index':
+                        result = get_next_available(USER_ID, department, limit=args.limit)
+                    else:
+                        result, count = with_scan(department, args.limit)
+                    latencies.append(time.perf_counter() - t0)
+                    if method == 'index':
+                        count = index_rows(department, result)
+                        expected, _ = with_scan(department, args.limit)
+                        if [(r['date'], r['doctor_id'], r['period'], r['time'], r['free']) for r in result] != expected:
+                            raise SystemExit(f'index 和 scan 的结果不一致：{department}')
+                    rows.append(count)
+                    db.session.commit()
+            print(f'{full_days:>9}{method:>8}{sum(rows) // len(rows):>11}'
+                  f'{percentile(latencies, 0.5) * 1000:>9.2f}{percentile(latencies, 0.95) * 1000:>9.2f}')
+
+        latencies = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            response = client.get(f'/user/next_available?department={rng.choice(departments)}&limit={args.limit}',
+                                  headers=headers)
+            latencies.append(time.perf_counter() - t0)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        print(f'{full_days:>9}{"http":>8}{"":>11}{percentile(latencies, 0.5) * 1000:>9.2f}'
+              f'{percentile(latencies, 0.95) * 1000:>9.2f}')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""列表接口序列化的开销：每 1 万行的耗时
+
+不访问数据库，直接用构造好的查询结果行测量“行 -> dict -> JSON 字节”这一步：
+  - legacy：原来的写法，逐字段构建 dict，strftime 格式化日期；
+    流式接口逐行 json.dumps，分页接口和 doctors_available 整体 jsonify
+  - compiled+json：serializers 中编译好的字段表，标准库 json 整批编码
+  - compiled+orjson：同上，用 orjson 编码（当前默认，未安装 orjson 时不测）
+另外测量 ?fields= 只取两个字段时的耗时。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_serialization --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import time
+from datetime import date, timedelta
+
+from flask import Flask, jsonify
+
+import serializers
+from serializers import (APPOINTMENT_FIELDS, DOCTOR_APPOINTMENT_FIELDS, DOCTOR_FIELDS, USER_FIELDS,
+                         STREAM_CHUNK_ROWS)
+
+AVATAR_PREFIX = 'http://localhost:5000/doctors'
+
+
+def make_rows(n):
+    today = date.today()
+    return {
+        'users': [(f'{i:018d}', f'用户{i}', '女', '' if i % 3 else None, str(15000000000 + i), None)
+                  for i in range(n)],
+        'doctors': [(i, f'医生{i}', '男', '主治医师', f'科室{i % 10}', str(100 + i), str(13000000000 + i),
+                     'ab' * 32 if i % 2 else None, bool(i % 5)) for i in range(n)],
+        'appointments': [(i, f'用户{i}', f'医生{i % 50}', today + timedelta(days=i % 14), '上午' if i % 2 else '下午')
+                         for i in range(n)],
+        'doctor_appointments': [(i, f'{i:018d}', f'用户{i}', '女', today + timedelta(days=i % 14),
+                                 '上午' if i % 2 else '下午') for i in range(n)],
+    }
+
+
+# 原来 backend.py 中的转换函数
+LEGACY = {
+    'users': lambda user: {
+        'idNumber': user[0], 'name': user[1] or "", 'gender': user[2] or "", 'address': user[3] or "",
+        'phone': user[4] or "", 'emergencyContact': user[5] or ""
+    },
+    'doctors': lambda doctor: {
+        'employeeId': doctor[0], 'name': doctor[1] or "", 'gender': doctor[2] or "", 'title': doctor[3] or "",
+        'department': doctor[4] or "", 'office': doctor[5] or "", 'phone': doctor[6] or "",
+        'avatar': f'{AVATAR_PREFIX}/{doctor[0]}/avatar?v={doctor[7][:16]}' if doctor[7] else "",
+        'avatar_hash': doctor[7] or "", 'flag': doctor[8]
+    },
+    'appointments': lambda row: {
+        'appointment_id': row[0], 'user_name': row[1] or "", 'doctor_name': row[2] or "",
+        'appointment_time': row[3].strftime("%Y-%m-%d") + " " + row[4]
+    },
+    'doctor_appointments': lambda row: {
+        'id': row[0], 'user_id': row[1], 'user_name': row[2], 'user_gender': row[3],
+        'appointment_date': row[4].strftime("%Y-%m-%d"), 'appointment_period': row[5]
+    },
+}
+SERIALIZERS = {
+    'users': USER_FIELDS,
+    'doctors': DOCTOR_FIELDS,
+    'appointments': APPOINTMENT_FIELDS,
+    'doctor_appointments': DOCTOR_APPOINTMENT_FIELDS,
+}
+STREAMED = {'users', 'doctors', 'appointments'}  # 其余为分页接口，整体 jsonify
+SPARSE = {'users': ['idNumber', 'name'], 'doctors': ['employeeId', 'name'],
+          'appointments': ['appointment_id', 'appointment_time'], 'doctor_appointments': ['id', 'appointment_date']}
+
+
+def legacy_stream(rows, to_dict):
+    """原来 stream_json_array 的编码方式"""
+    chunk = []
+    for i, row in enumerate(rows):
+        item = json.dumps(to_dict(row), ensure_ascii=False)
+        chunk.append(item if i == 0 else ',' + item)
+    return ('[' + ''.join(chunk) + ']').encode()
+
+
+def compiled(rows, to_dict, dumps, context):
+    """新的编码方式：编译好的转换函数，整批编码"""
+    parts = [b'[']
+    for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+        batch = [to_dict(row, **context) for row in rows[start:start + STREAM_CHUNK_ROWS]]
+        parts.append((b',' if start else b'') + dumps(batch)[1:-1])
+    parts.append(b']')
+    return b''.join(parts)
+
+
+def stdlib_dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def availability_payload(doctors, days):
+    """构造和 get_doctors_availability 相同结构的数据"""
+    today = date.today()
+    return [{
+        'id': i, 'name': f'医生{i}', 'gender': '男', 'title': '主治医师', 'department': f'科室{i % 10}',
+        'office': str(100 + i), 'phone': str(13000000000 + i),
+        'available_times': [{
+            'date': (today + timedelta(days=d)).strftime('%m月%d日'),
+            'slots': [{'period': period, 'booked': 3, 'limit': 10, 'available': True, 'user_booked': False}
+                      for period in ('上午', '下午')]
+        } for d in range(days)]
+    } for i in range(doctors)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    encoders = {'compiled+json': stdlib_dumps}
+    if serializers.orjson is not None:
+        encoders['compiled+orjson'] = serializers.orjson.dumps
+    data = make_rows(args.rows)
+    scale = 10000 / args.rows
+    print(f'ms per 10k rows (best of {args.repeat})')
+    print(f'{"endpoint":<22}{"legacy":>10}' + ''.join(f'{name:>18}' for name in encoders) + f'{"fields=2":>12}{"speedup":>10}')
+    with app.test_request_context():
+        for name, rows in data.items():
+            context = {'avatar_prefix': AVATAR_PREFIX} if name == 'doctors' else {}
+            legacy_to_dict = LEGACY[name]
+            if name in STREAMED:
+                legacy = best(lambda: legacy_stream(rows, legacy_to_dict), args.repeat)
+            else:
+                legacy = best(lambda: jsonify([legacy_to_dict(row) for row in rows]).get_data(), args.repeat)
+            # 编译结果应与原来的转换函数完全一致
+            to_dict = SERIALIZERS[name].compile()
+            assert [to_dict(row, **context) for row in rows[:100]] == [legacy_to_dict(row) for row in rows[:100]], name
+            results = [best(lambda: compiled(rows, to_dict, dumps, context), args.repeat) for dumps in encoders.values()]
+            sparse_to_dict = SERIALIZERS[name].compile(SPARSE[name])
+            sparse = best(lambda: compiled(rows, sparse_to_dict, serializers.dumps, context), args.repeat)
+            print(f'{name:<22}{legacy * scale * 1000:>10.1f}' + ''.join(f'{r * scale * 1000:>18.1f}' for r in results)
+                  + f'{sparse * scale * 1000:>12.1f}{legacy / results[-1]:>9.1f}x')
+
+        payload = availability_payload(args.rows // 3, 3)
+        legacy = best(lambda: jsonify(payload).get_data(), args.repeat)
+        results = [best(lambda: dumps(payload), args.repeat) for dumps in encoders.values()]
+        print(f'{"doctors_available":<22}{legacy * scale * 1000:>10.1f}'
+              + ''.join(f'{r * scale * 1000:>18.1f}' for r in results) + f'{"":>12}{legacy / results[-1]:>9.1f}x'
+              + '   (per 10k doctor-days)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""启动耗时基准：导入应用 + 第一个请求的延迟
+
+每次测量都在新的子进程中进行，相当于一个刚启动的 worker：
+  - legacy：模拟原来的 before_first_request，第一个请求里执行 init_db(seed=True)
+  - factory：数据库已由 flask seed 初始化，worker 不做任何初始化
+分别在新库（刚部署）和已有数据的库（worker 重启）上测量。
+每个子进程报告 import backend 并调用 create_app 的耗时、第一个和第二个请求的耗时，以及进程总耗时（含解释器启动）。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_startup --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+USER_ID = '123456789012345678'  # init_tables 写入的用户
+
+
+def measure(mode):
+    """在子进程中执行：导入应用并发出两个请求，返回各阶段耗时"""
+    t0 = time.perf_counter()
+    import backend
+    from flask_jwt_extended import create_access_token
+    app = backend.create_app()
+    import_seconds = time.perf_counter() - t0
+
+    if mode == 'legacy':
+        done = []
+
+        @app.before_request
+        def bootstrap_on_first_request():
+            if not done:
+                done.append(True)
+                backend.init_db(seed=True)
+
+    with app.app_context():
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity={'id': USER_ID, 'role': 'user'})}
+    client = app.test_client()
+    timings = []
+    for _ in range(2):
+        t0 = time.perf_counter()
+        response = client.get('/user/doctors_available', headers=headers)
+        timings.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return {'import': import_seconds, 'first_request': timings[0], 'second_request': timings[1]}
+
+
+def run_child(db_path, mode):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.abspath(db_path))
+    t0 = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_startup', '--child', mode],
+        check=True, capture_output=True, text=True, env=env
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - t0
+    return result
+
+
+def run_seed(db_path):
+    """用 CLI 初始化数据库，返回耗时"""
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.abspath(db_path))
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, '-W', 'ignore', '-m', 'flask', '--app', 'backend', 'seed'],
+                   check=True, capture_output=True, env=env)
+    return time.perf_counter() - t0
+
+
+def report(label, results):
+    best = {key: min(result[key] for result in results) for key in results[0]}
+    print(f'{label:<26} import={best["import"] * 1000:7.1f}ms first_request={best["first_request"] * 1000:8.1f}ms '
+          f'second_request={best["second_request"] * 1000:6.1f}ms process={best["process"] * 1000:8.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    # 子进程不导入 _common，避免提前加载 flask 和 database 影响 import 耗时
+    from benchmarks._common import remove_db, scratch_db_path
+
+    fresh = {'legacy': [], 'factory': []}
+    restart = {'legacy': [], 'factory': []}
+    seed_seconds = []
+    for _ in range(args.repeat):
+        # 刚部署：legacy 的第一个请求负责建表和写入初始数据，factory 先执行一次 flask seed
+        db_path = scratch_db_path()
+        fresh['legacy'].append(run_child(db_path, 'legacy'))
+        restart['legacy'].append(run_child(db_path, 'legacy'))
+        remove_db(db_path)
+
+        db_path = scratch_db_path()
+        seed_seconds.append(run_seed(db_path))
+        fresh['factory'].append(run_child(db_path, 'factory'))
+        restart['factory'].append(run_child(db_path, 'factory'))
+        remove_db(db_path)
+
+    print(f'flask seed (once per deploy): {min(seed_seconds) * 1000:.1f}ms')
+    for mode in ('legacy', 'factory'):
+        report(f'{mode} / fresh database', fresh[mode])
+        report(f'{mode} / worker restart', restart[mode])
+
+
+if __name__ == '__main__':
+    main()
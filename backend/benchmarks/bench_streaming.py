@@ -0,0 +1,96 @@
+"""管理员列表接口流式响应的内存占用
+
+分别在 1 千和 100 万名患者时请求 /admin/users，对比：
+  - stream：当前的分批列查询 + 流式 JSON
+  - legacy：原来的 User.query.all() + 整体 jsonify
+每次测量都在独立子进程中进行，报告请求期间 RSS 峰值的增长和 tracemalloc 峰值。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_streaming --sizes 1000 1000000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from database import db, User
+from benchmarks._common import _PASSWORD_HASH, load_backend, login, remove_db
+
+
+def grow_users(target):
+    """把用户表补足到 target 人"""
+    current = User.query.count()
+    batch = 50000
+    while current < target:
+        n = min(batch, target - current)
+        db.session.execute(db.insert(User), [
+            {'id': f'{i:018d}', 'name': f'用户{i}', 'gender': '女', 'phone_number': str(15000000000 + i),
+             'address': '北京市', 'emergency_contact': '', 'password_hash': _PASSWORD_HASH}
+            for i in range(current + 1, current + n + 1)
+        ])
+        db.session.commit()
+        current += n
+
+
+def measure(db_path, mode):
+    """在子进程中执行一次请求，返回内存和耗时统计"""
+    app, _ = load_backend(db_path)
+    client = app.test_client()
+    headers = login(client, 'admin', 'admin', 'adminpassword')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    size = 0
+    if mode == 'stream':
+        response = client.get('/admin/users', headers=headers, buffered=False)
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+    else:
+        from flask import jsonify
+        with app.app_context():
+            users = User.query.all()
+            body = jsonify([
+                {'idNumber': u.id, 'name': u.name or "", 'gender': u.gender or "", 'address': u.address or "",
+                 'phone': u.phone_number or "", 'emergencyContact': u.emergency_contact or ""}
+                for u in users
+            ]).get_data()
+            size = len(body)
+            del users, body
+    elapsed = time.perf_counter() - t0
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'bytes': size, 'seconds': elapsed, 'traced_peak_kb': traced_peak // 1024, 'rss_growth_kb': rss_after - rss_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 1000000])
+    parser.add_argument('--child', nargs=2, metavar=('DB_PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child)))
+        return
+
+    app, db_path = load_backend()
+    for size in sorted(args.sizes):
+        with app.app_context():
+            grow_users(size)
+        for mode in ('stream', 'legacy'):
+            out = subprocess.run(
+                [sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_streaming', '--child', db_path, mode],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f'users={size:<8} mode={mode:<7} body={result["bytes"] / 1e6:.1f}MB time={result["seconds"]:.2f}s '
+                  f'rss_growth={result["rss_growth_kb"] / 1024:.1f}MB traced_peak={result["traced_peak_kb"] / 1024:.1f}MB')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""按小时段计算可预约情况：占用位图与逐条预约记录的对比
+
+--doctors 名医生、--days 天的排班，每个时间段按 --occupancy 的比例随机占用小时段（同时写入对应的预约记录），
+对整个窗口计算每个医生每天每个时间段的空闲小时段数和第一个空闲小时段：
+  - bitmap：只读排班表（每个医生每天一行），空闲数和第一个空闲小时段都是整数位运算
+  - rows：没有位图时的做法，读出窗口内所有预约记录的小时段，按 (医生, 日期, 时间段) 组成集合后逐个小时段检查
+分别报告查询和计算的耗时、读取的行数，并校验两种方法结果一致；
+最后报告 /user/time_slots 单个医生一天的延迟。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_time_slots --doctors 1000 --days 60
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from database import db, Appointment, Doctor, DoctorSchedule
+from time_slots import PERIOD_MINUTES, PERIOD_STARTS, default_slot_minutes, first_free, free_count, slot_count
+from benchmarks._common import load_backend, login, remove_db, seed
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fill(doctor_ids, days, occupancy, rng):
+    """随机占用小时段，写入位图、计数和对应的预约记录，返回预约记录数"""
+    today = datetime.today().date()
+    count = slot_count(default_slot_minutes())
+    minutes = default_slot_minutes()
+    schedules, appointments = [], []
+    for doctor_id in doctor_ids:
+        for d in range(days):
+            date = today + timedelta(days=d)
+            row = {'doctor_id': doctor_id, 'date': date}
+            for period, prefix in (('上午', 'morning'), ('下午', 'afternoon')):
+                indexes = [i for i in range(count) if rng.random() < occupancy]
+                row[f'{prefix}_booked'] = len(indexes)
+                row[f'{prefix}_slots'] = sum(1 << i for i in indexes)
+                appointments.extend(
+                    {'user_id': f'{len(appointments) + k:018d}', 'doctor_id': doctor_id, 'appointment_date': date,
+                     'appointment_period': period, 'slot_offset': i * minutes}
+                    for k, i in enumerate(indexes))
+            schedules.append(row)
+    db.session.execute(db.text(
+        'UPDATE doctor_schedule SET morning_booked = :morning_booked, morning_slots = :morning_slots, '
+        'afternoon_booked = :afternoon_booked, afternoon_slots = :afternoon_slots WHERE doctor_id = :doctor_id AND date = :date'
+    ), schedules)
+    db.session.execute(db.insert(Appointment), appointments)
+    db.session.commit()
+    return len(appointments)
+
+
+def with_bitmaps(start, end):
+    """从排班表的位图计算，返回 ({(医生, 日期, 时间段): (空闲数, 第一个空闲小时段)}, 查询秒数, 读取行数)"""
+    t0 = time.perf_counter()
+    rows = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.date, DoctorSchedule.slot_minutes,
+        DoctorSchedule.morning_booked, DoctorSchedule.morning_limit, DoctorSchedule.morning_slots,
+        DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit, DoctorSchedule.afternoon_slots
+    ).filter(DoctorSchedule.date.between(start, end)).all()
+    query_seconds = time.perf_counter() - t0
+    result = {}
+    for doctor_id, date, minutes, *periods in rows:
+        count = PERIOD_MINUTES // minutes
+        for period, (booked, limit, mask) in (('上午', periods[0:3]), ('下午', periods[3:6])):
+            if booked < limit:
+                result[(doctor_id, date, period)] = (min(limit - booked, free_count(mask, count)), first_free(mask, count))
+            else:
+                result[(doctor_id, date, period)] = (0, None)
+    return result, query_seconds, len(rows)
+
+
+def with_rows(start, end):
+    """从逐条预约记录计算，返回值同 with_bitmaps"""
+    t0 = time.perf_counter()
+    schedules = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.date, DoctorSchedule.slot_minutes,
+        DoctorSchedule.morning_limit, DoctorSchedule.afternoon_limit
+    ).filter(DoctorSchedule.date.between(start, end)).all()
+    appointments = db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period, Appointment.slot_offset
+    ).filter(Appointment.appointment_date.between(start, end)).all()
+    query_seconds = time.perf_counter() - t0
+    taken = {}
+    for doctor_id, date, period, offset in appointments:
+        taken.setdefault((doctor_id, date, period), []).append(offset)
+    result = {}
+    for doctor_id, date, minutes, morning_limit, afternoon_limit in schedules:
+        count = PERIOD_MINUTES // minutes
+        for period, limit in (('上午', morning_limit), ('下午', afternoon_limit)):
+            offsets = taken.get((doctor_id, date, period), ())
+            occupied = {offset // minutes for offset in offsets}
+            if len(offsets) < limit:
+                first = next((i for i in range(count) if i not in occupied), None)
+                result[(doctor_id, date, period)] = (min(limit - len(offsets), count - len(occupied)), first)
+            else:
+                result[(doctor_id, date, period)] = (0, None)
+    return result, query_seconds, len(schedules) + len(appointments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--occupancy', type=float, default=0.4, help='每个小时段被占用的概率')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=200, help='/user/time_slots 的请求数')
+    args = parser.parse_args()
+
+    app, db_path = load_backend()
+    client = app.test_client()
+    headers = login(client, 'user', '123456789012345678', 'password123')
+    with app.app_context():
+        # 去掉示例数据的排班和预约，只保留生成的数据
+        Appointment.query.delete()
+        DoctorSchedule.query.delete()
+        first = db.session.query(db.func.max(Doctor.id)).scalar() + 1
+        doctor_ids = range(first, first + args.doctors)
+        seed(doctors=args.doctors, users=0, days=args.days, limit=slot_count(default_slot_minutes()), first_doctor_id=first)
+        t0 = time.perf_counter()
+        appointments = fill(doctor_ids, args.days, args.occupancy, random.Random(0))
+        fill_seconds = time.perf_counter() - t0
+
+    today = datetime.today().date()
+    start, end = today, today + timedelta(days=args.days - 1)
+    print(f'doctors={args.doctors} days={args.days} slot_minutes={default_slot_minutes()} '
+          f'slots/period={slot_count(default_slot_minutes())} occupancy={args.occupancy} '
+          f'appointments={appointments} (generated in {fill_seconds:.1f}s)')
+    print(f'{"method":<8}{"rows read":>11}{"query ms":>10}{"compute ms":>12}{"total ms":>10}')
+    results = {}
+    for method, compute in (('bitmap', with_bitmaps), ('rows', with_rows)):
+        best = None
+        for _ in range(args.rounds):
+            with app.app_context():
+                t0 = time.perf_counter()
+                result, query_seconds, rows = compute(start, end)
+                total = time.perf_counter() - t0
+                db.session.commit()
+            if best is None or total < best[0]:
+                best = (total, query_seconds, rows)
+        results[method] = result
+        total, query_seconds, rows = best
+        print(f'{method:<8}{rows:>11}{query_seconds * 1000:>10.1f}{(total - query_seconds) * 1000:>12.1f}{total * 1000:>10.1f}')
+    if results['bitmap'] != results['rows']:
+        raise SystemExit('bitmap 和 rows 的结果不一致')
+
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(args.requests):
+        label = (today + timedelta(days=rng.randrange(args.days))).strftime('%m月%d日')
+        t0 = time.perf_counter()
+        response = client.get(f'/user/time_slots?doctor_id={rng.choice(doctor_ids)}&date={label}', headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    print(f'/user/time_slots p50={percentile(latencies, 0.5) * 1000:.2f}ms p95={percentile(latencies, 0.95) * 1000:.2f}ms '
+          f'({len(PERIOD_STARTS)} periods x {slot_count(default_slot_minutes())} slots)')
+    remove_db(db_path)
+
+
+if __name__ == '__main__':
+    main()
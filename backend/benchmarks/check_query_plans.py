@@ -0,0 +1,107 @@
+"""用 EXPLAIN QUERY PLAN 检查高频查询是否都走了索引
+
+先把 instance/hospital.db 复制一份并执行迁移（同时验证旧库可以原地升级），
+再调用 database.py 中的真实函数，捕获它们发出的 SQL 并逐条 EXPLAIN。
+任何一条对 appointment、doctor_schedule、doctor、waitlist_entry 的全表扫描都会让脚本以非零状态退出。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.check_query_plans
+"""
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+import database
+from database import db, Appointment, Doctor
+from migrations import LATEST_VERSION, get_version, upgrade
+from benchmarks._common import make_app, remove_db, scratch_db_path, seed
+
+LEGACY_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'hospital.db')
+FULL_SCAN = re.compile(r'\bSCAN (appointment|doctor_schedule|doctor|waitlist_entry)\b(?! USING)')
+
+
+def capture(engine, fn):
+    """执行 fn，返回期间发出的 (SQL, 参数) 列表"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def main():
+    db_path = scratch_db_path()
+    if os.path.exists(LEGACY_DB):
+        shutil.copy(LEGACY_DB, db_path)
+    app, db_path = make_app(db_path)
+    today = datetime.today().date()
+    tomorrow = today + timedelta(days=1)
+    with app.app_context():
+        upgrade(db.engine)
+        assert get_version(db.session.connection()) == LATEST_VERSION
+        seed(doctors=50, users=200, days=3, first_doctor_id=1000)
+        # 造一批预约让统计信息接近真实分布
+        db.session.execute(db.insert(Appointment), [
+            {'user_id': f'{u:018d}', 'doctor_id': 1000 + d, 'appointment_date': today + timedelta(days=k), 'appointment_period': p}
+            for u in range(4, 200) for d in range(0, 50, 7) for k in range(3) for p in ('上午', '下午')
+        ])
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+        appointment = database.book_doctor('000000000000000001', 1000, tomorrow, '上午')
+        hot_queries = {
+            'book slot': lambda: database.book_doctor('000000000000000002', 1000, tomorrow, '上午'),
+            'book slot time': lambda: database.book_doctor('000000000000000002', 1000, tomorrow, '下午', 45),
+            'day time slots': lambda: database.get_day_slots(1000, tomorrow),
+            'cancel lookup': lambda: Appointment.query.filter_by(
+                user_id='000000000000000001', doctor_id=1000, appointment_date=tomorrow, appointment_period='上午').first(),
+            'cancel': lambda: database.cancel_appointment(appointment.id),
+            'availability schedules': lambda: database._build_availability_snapshot(today, today + timedelta(days=2)),
+            'availability user bookings': lambda: database.get_doctors_availability('000000000000000003'),
+            'doctor schedule': lambda: database.get_doctor_schedule(1000),
+            'doctor appointments': lambda: database.get_doctor_appointments_page(1000, limit=100, date_from=today),
+            'doctors by department': lambda: Doctor.query.filter_by(department='科室1').all(),
+            'availability by department': lambda: database.search_doctors_availability(
+                '000000000000000003', department='科室1', date=tomorrow, period='上午', only_available=True),
+            'availability by name prefix': lambda: database.search_doctors_availability('000000000000000003', name_prefix='医生10'),
+            'availability with free slots': lambda: database.search_doctors_availability(
+                '000000000000000003', date=tomorrow, only_available=True),
+            'next available in department': lambda: database.get_next_available('000000000000000003', '科室1'),
+            'join waitlist': lambda: database.join_waitlist('000000000000000004', 1000, tomorrow, '上午'),
+            'waitlist position': lambda: database.get_waitlist_position(1),
+            'user waitlist': lambda: database.get_user_waitlist('000000000000000004'),
+        }
+        failures = []
+        for name, fn in hot_queries.items():
+            db.session.expire_all()
+            for statement, parameters in capture(db.engine, fn):
+                # 列出全部医生本身就要读整张医生表，不算在检查范围内
+                if re.search(r'FROM doctor\s*(ORDER BY|$)', statement):
+                    continue
+                with db.engine.connect() as conn:
+                    plan = ' | '.join(row[3] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters))
+                ok = not FULL_SCAN.search(plan)
+                print(f'{"ok  " if ok else "FAIL"} {name:<28} {plan}')
+                if not ok:
+                    failures.append(name)
+        db.session.rollback()
+
+    remove_db(db_path)
+    if failures:
+        print(f'以下查询存在全表扫描：{sorted(set(failures))}')
+        raise SystemExit(1)
+    print('所有高频查询都使用了索引')
+
+
+if __name__ == '__main__':
+    main()
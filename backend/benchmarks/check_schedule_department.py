@@ -0,0 +1,67 @@
+"""检查排班中冗余的科室（DoctorSchedule.department）在修改医生科室后与医生表一致
+
+分别通过医生本人（PUT /doctor/<id>）和管理员（PUT /admin/doctor/<id>）修改科室，每次修改后检查：
+  - 没有排班的科室与医生的科室不一致
+  - /user/next_available 在新科室中能找到这个医生，在原科室中找不到
+任何一项不满足时以非零状态退出。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.check_schedule_department
+"""
+from database import db, Doctor, DoctorSchedule
+from benchmarks._common import load_backend, login, remove_db
+
+DOCTOR_ID = 1  # 示例数据中有权限修改自己信息的医生
+
+
+def mismatched():
+    """科室与医生不一致的排班数"""
+    return db.session.query(DoctorSchedule.id).join(Doctor, Doctor.id == DoctorSchedule.doctor_id).filter(
+        DoctorSchedule.department != Doctor.department).count()
+
+
+def listed(client, headers, department):
+    """DOCTOR_ID 是否出现在科室最早的空闲时间段中"""
+    response = client.get(f'/user/next_available?department={department}&limit=50', headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return any(slot['doctor_id'] == DOCTOR_ID for slot in response.get_json())
+
+
+def main():
+    app, db_path = load_backend()
+    client = app.test_client()
+    user = login(client, 'user', '123456789012345678', 'password123')
+    doctor = login(client, 'doctor', str(DOCTOR_ID), 'password123')
+    admin = login(client, 'admin', 'admin', 'adminpassword')
+    with app.app_context():
+        info = Doctor.query.get(DOCTOR_ID)
+        old = info.department
+        admin_body = {'employeeId': DOCTOR_ID, 'name': info.name, 'gender': info.gender, 'title': info.title,
+                      'office': info.office_number, 'phone': info.phone, 'flag': info.flag}
+
+    edits = [
+        ('doctor', lambda department: client.put(f'/doctor/{DOCTOR_ID}', json={'department': department}, headers=doctor)),
+        ('admin', lambda department: client.put(f'/admin/doctor/{DOCTOR_ID}', json=dict(admin_body, department=department),
+                                                headers=admin)),
+    ]
+    failures = []
+    for route, edit in edits:
+        new = f'{route}科室'
+        response = edit(new)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        with app.app_context():
+            count = mismatched()
+        ok = count == 0 and listed(client, user, new) and not listed(client, user, old)
+        print(f'{"ok  " if ok else "FAIL"} {route:<7} {old} -> {new}: {count} mismatched schedules')
+        if not ok:
+            failures.append(route)
+        old = new
+
+    remove_db(db_path)
+    if failures:
+        raise SystemExit(f'以下修改路径没有同步排班中的科室：{failures}')
+    print('排班中的科室与医生一致')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""合成医院数据生成器
+
+按固定随机种子直接向一个临时 SQLite 文件批量写入：
+  - N 名医生，分布在若干科室，从今天开始 days 天的排班
+  - M 名患者
+  - K 条预约：窗口内的预约不超过名额，依次占用时间段的小时段并同步更新排班计数和位图，其余为过去一年的历史预约
+每个排班按上限选择放得下的小时段粒度（同 _common.seed），上限不会超过小时段数。
+所有账号的密码都是 password123，只计算一次哈希，生成大数据量时不受 KDF 成本影响。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.datagen /tmp/hospital-1k.db --doctors 1000 --patients 100000 --appointments 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from database import db, Admin, Appointment, Doctor, DoctorSchedule, User
+from migrations import upgrade
+from passwords import hash_password
+from benchmarks._common import make_app, slot_minutes_for
+
+DEPARTMENTS = ['全科医学', '内科', '外科', '儿科', '皮肤科', '眼科', '耳鼻喉科', '口腔科', '妇产科', '骨科',
+               '神经内科', '心血管内科', '消化内科', '呼吸内科', '肿瘤科', '康复医学科', '中医科', '精神科']
+TITLES = ['住院医师', '主治医师', '副主任医师', '主任医师']
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+PASSWORD = 'password123'
+BATCH = 50000
+
+
+def patient_id(i):
+    """第 i 名合成患者的身份证号"""
+    return f'9{i:017d}'
+
+
+def _insert(model, rows):
+    """分批插入，避免一次性构造过大的参数列表"""
+    for start in range(0, len(rows), BATCH):
+        db.session.execute(db.insert(model), rows[start:start + BATCH])
+    db.session.commit()
+
+
+def generate(db_path, doctors, patients, appointments, days=7, departments=len(DEPARTMENTS), seed=42, limit_range=(5, 30)):
+    """生成数据并返回各表行数；db_path 必须是新文件"""
+    rng = random.Random(seed)
+    app, db_path = make_app(db_path)
+    today = datetime.today().date()
+    password_hash = hash_password(PASSWORD)
+    department_names = [DEPARTMENTS[i] if i < len(DEPARTMENTS) else f'科室{i + 1}' for i in range(departments)]
+
+    with app.app_context():
+        upgrade(db.engine, log=lambda message: None)
+        db.session.add(Admin(username='admin', password_hash=password_hash))
+        _insert(Doctor, [
+            {'id': i, 'name': rng.choice(SURNAMES) + '医生', 'gender': rng.choice('男女'), 'title': rng.choice(TITLES),
+             'department': department_names[i % departments], 'office_number': str(100 + i), 'phone': str(13000000000 + i),
+             'password_hash': password_hash, 'flag': False}
+            for i in range(1, doctors + 1)
+        ])
+        _insert(User, [
+            {'id': patient_id(i), 'name': rng.choice(SURNAMES) + f'患者{i}', 'gender': rng.choice('男女'),
+             'phone_number': str(15000000000 + i), 'address': '北京市', 'emergency_contact': '', 'password_hash': password_hash}
+            for i in range(1, patients + 1)
+        ])
+
+        # 排班：limits[(医生, 第几天)] = [上午上限, 下午上限]，booked 同步累计
+        limits = {(d, k): [rng.randint(*limit_range), rng.randint(*limit_range)] for d in range(1, doctors + 1) for k in range(days)}
+        minutes = {key: slot_minutes_for(max(limit)) for key, limit in limits.items()}
+        booked = {key: [0, 0] for key in limits}
+        capacity = sum(a + b for a, b in limits.values())
+
+        # 大约一半的名额被窗口内的预约占用，剩下的预约是历史记录
+        future = min(appointments, capacity // 2)
+        rows = []
+        seen = set()
+        slots = list(limits)
+        while len(rows) < future:
+            doctor_id, k = rng.choice(slots)
+            p = rng.randint(0, 1)
+            if booked[(doctor_id, k)][p] >= limits[(doctor_id, k)][p]:
+                continue
+            user = patient_id(rng.randint(1, patients))
+            key = (user, doctor_id, k, p)
+            if key in seen:
+                continue
+            seen.add(key)
+            # 按预约顺序占用第 0、1、2... 个小时段，位图即为低 booked 位
+            rows.append({'user_id': user, 'doctor_id': doctor_id, 'appointment_date': today + timedelta(days=k),
+                         'appointment_period': '上午' if p == 0 else '下午',
+                         'slot_offset': booked[(doctor_id, k)][p] * minutes[(doctor_id, k)]})
+            booked[(doctor_id, k)][p] += 1
+        while len(rows) < appointments:
+            user, doctor_id, k, p = patient_id(rng.randint(1, patients)), rng.randint(1, doctors), rng.randint(1, 365), rng.randint(0, 1)
+            if (user, doctor_id, -k, p) in seen:
+                continue
+            seen.add((user, doctor_id, -k, p))
+            rows.append({'user_id': user, 'doctor_id': doctor_id, 'appointment_date': today - timedelta(days=k),
+                         'appointment_period': '上午' if p == 0 else '下午', 'slot_offset': None})
+        del seen
+        rows.sort(key=lambda row: row['appointment_date'])  # 让预约ID大致按时间递增
+        _insert(Appointment, rows)
+        del rows
+
+        _insert(DoctorSchedule, [
+            {'doctor_id': doctor_id, 'date': today + timedelta(days=k),
+             'morning_booked': booked[(doctor_id, k)][0], 'morning_limit': morning_limit,
+             'morning_slots': (1 << booked[(doctor_id, k)][0]) - 1,
+             'afternoon_booked': booked[(doctor_id, k)][1], 'afternoon_limit': afternoon_limit,
+             'afternoon_slots': (1 << booked[(doctor_id, k)][1]) - 1, 'slot_minutes': minutes[(doctor_id, k)],
+             'department': department_names[doctor_id % departments]}
+            for (doctor_id, k), (morning_limit, afternoon_limit) in limits.items()
+        ])
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        return {
+            'doctors': Doctor.query.count(),
+            'patients': User.query.count(),
+            'appointments': Appointment.query.count(),
+            'schedules': DoctorSchedule.query.count(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path')
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--appointments', type=int, default=200000)
+    parser.add_argument('--departments', type=int, default=len(DEPARTMENTS))
+    parser.add_argument('--days', type=int, default=7, help='从今天开始生成多少天的排班')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    counts = generate(args.db_path, args.doctors, args.patients, args.appointments, args.days, args.departments, args.seed)
+    print(f'{counts} in {time.perf_counter() - t0:.1f}s -> {args.db_path}')
+
+
+if __name__ == '__main__':
+    main()
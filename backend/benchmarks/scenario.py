@@ -0,0 +1,272 @@
+"""端到端负载场景
+
+用真实的 Flask 应用（测试客户端）或本地运行的服务（--url）跑一组接近真实的请求组合：
+患者登录、查询可预约医生、预约、取消，医生修改排班，管理员查看列表。
+按接口统计吞吐量、p50/p95/p99 延迟和每个请求执行的 SQL 语句数（仅测试客户端模式），
+结果以 JSON 写入 --output，便于不同版本之间对比。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.datagen /tmp/hospital.db --doctors 500 --patients 20000 --appointments 100000
+    python -m benchmarks.scenario /tmp/hospital.db --clients 8 --seconds 30 --output results.json
+    python -m benchmarks.scenario --url http://127.0.0.1:5000 --clients 8 --seconds 30
+"""
+import argparse
+import json
+import platform
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from time_slots import slot_count
+from benchmarks.datagen import PASSWORD, patient_id
+
+# 每种操作的权重，合计 100
+MIX = {
+    'login': 5,
+    'doctors_available': 50,
+    'book': 15,
+    'cancel': 10,
+    'doctor_schedule': 8,
+    'admin_appointments': 7,
+    'admin_doctors': 5,
+}
+
+
+class TestClientTransport:
+    """通过 Flask 测试客户端发请求，并统计每个请求执行的 SQL 语句数"""
+
+    def __init__(self, db_path):
+        from sqlalchemy import event
+        from benchmarks._common import load_backend
+        from database import db
+
+        self.app, _ = load_backend(db_path)
+        self._local = threading.local()
+        with self.app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+    def client(self):
+        return self.app.test_client()
+
+    def request(self, client, method, path, headers=None, json_body=None):
+        self._local.statements = 0
+        response = client.open(path, method=method, headers=headers, json=json_body)
+        body = response.get_data()
+        return response.status_code, body, dict(response.headers), self._local.statements
+
+
+class HttpTransport:
+    """向本地运行的服务发 HTTP 请求（无法统计 SQL 语句数）"""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self._requests = requests
+
+    def client(self):
+        return self._requests.Session()
+
+    def request(self, client, method, path, headers=None, json_body=None):
+        response = client.request(method, self.url + path, headers=headers, json=json_body)
+        return response.status_code, response.content, dict(response.headers), None
+
+
+class VirtualUser:
+    """一个客户端线程：以随机患者身份循环执行 MIX 中的操作"""
+
+    def __init__(self, transport, rng, args, record):
+        self.transport = transport
+        self.client = transport.client()
+        self.rng = rng
+        self.args = args
+        self.record = record
+        self.headers = None
+        self.doctor_headers = None
+        self.admin_headers = None
+        self.booked = []
+        self.available = []
+
+    def call(self, name, method, path, headers=None, json_body=None):
+        t0 = time.perf_counter()
+        status, body, response_headers, statements = self.transport.request(self.client, method, path, headers, json_body)
+        self.record(name, time.perf_counter() - t0, status, statements)
+        return status, body
+
+    def login(self, role='user', username=None):
+        status, body = self.call('login', 'POST', f'/login/{role}', json_body={'username': username, 'password': PASSWORD})
+        if status != 200:
+            return None
+        return {'Authorization': 'Bearer ' + json.loads(body)['access_token']}
+
+    def ensure_patient(self):
+        if self.headers is None:
+            self.headers = self.login('user', patient_id(self.rng.randint(1, self.args.patients)))
+            self.booked = []
+
+    def op_login(self):
+        self.headers = None
+        self.ensure_patient()
+
+    def op_doctors_available(self):
+        self.ensure_patient()
+        status, body = self.call('doctors_available', 'GET', '/user/doctors_available', self.headers)
+        if status == 200:
+            # 记下一些仍有名额的时间段，供预约使用
+            doctors = json.loads(body)
+            self.available = [
+                (doctor['id'], day['date'], slot['period'])
+                for doctor in self.rng.sample(doctors, min(20, len(doctors)))
+                for day in doctor['available_times'] for slot in day['slots']
+                if slot['available'] and not slot['user_booked']
+            ]
+
+    def op_book(self):
+        self.ensure_patient()
+        if not self.available:
+            return self.op_doctors_available()
+        doctor_id, date, period = self.available.pop(self.rng.randrange(len(self.available)))
+        status, body = self.call('book', 'POST', '/user/book', self.headers,
+                                 {'doctor_id': doctor_id, 'appointment_date': date, 'appointment_period': period})
+        if status == 201:
+            self.booked.append((doctor_id, date, period))
+
+    def op_cancel(self):
+        self.ensure_patient()
+        if not self.booked:
+            return self.op_book()
+        doctor_id, date, period = self.booked.pop(self.rng.randrange(len(self.booked)))
+        self.call('cancel', 'POST', '/user/cancel', self.headers,
+                  {'doctor_id': doctor_id, 'appointment_date': date, 'appointment_period': period})
+
+    def op_doctor_schedule(self):
+        if self.doctor_headers is None:
+            self.doctor_headers = self.login('doctor', self.rng.randint(1, self.args.doctors))
+        status, body = self.call('doctor_schedule_get', 'GET', '/doctor/schedule', self.doctor_headers)
+        if status != 200 or not json.loads(body):
+            return
+        day = self.rng.choice(json.loads(body))
+        # 上限在 [已预约人数, 小时段数] 之间随机加减 1
+        count = slot_count(day['slot_minutes'])
+        self.call('doctor_schedule_set', 'POST', '/doctor/schedule', self.doctor_headers, {'schedules': [{
+            'date': day['date'],
+            'morning_limit': max(day['morning_booked'], min(count, day['morning_limit'] + self.rng.choice((-1, 1)))),
+            'afternoon_limit': max(day['afternoon_booked'], min(count, day['afternoon_limit'] + self.rng.choice((-1, 1)))),
+        }]})
+
+    def ensure_admin(self):
+        if self.admin_headers is None:
+            self.admin_headers = self.login('admin', 'admin')
+
+    def op_admin_appointments(self):
+        self.ensure_admin()
+        today = datetime.today().date()
+        self.call('admin_appointments', 'GET', f'/admin/appointments?limit=100&from={today}&to={today + timedelta(days=7)}',
+                  self.admin_headers)
+
+    def op_admin_doctors(self):
+        self.ensure_admin()
+        self.call('admin_doctors', 'GET', '/admin/doctors', self.admin_headers)
+
+    def run(self, stop):
+        operations = [getattr(self, 'op_' + name) for name in MIX]
+        weights = list(MIX.values())
+        while time.perf_counter() < stop:
+            self.rng.choices(operations, weights)[0]()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def summarize(samples, elapsed):
+    """把每个接口的原始样本汇总成统计结果"""
+    summary = {}
+    for name, items in sorted(samples.items()):
+        latencies = [latency for latency, _, _ in items]
+        statements = [n for _, _, n in items if n is not None]
+        statuses = defaultdict(int)
+        for _, status, _ in items:
+            statuses[str(status)] += 1
+        summary[name] = {
+            'requests': len(items),
+            'throughput': len(items) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'sql_per_request': sum(statements) / len(statements) if statements else None,
+            'statuses': dict(statuses),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', help='datagen 生成的数据库（测试客户端模式）')
+    parser.add_argument('--url', help='改为压测本地运行的服务，例如 http://127.0.0.1:5000')
+    parser.add_argument('--doctors', type=int, help='数据中的医生数，默认从数据库读取')
+    parser.add_argument('--patients', type=int, help='数据中的患者数，默认从数据库读取')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 文件')
+    args = parser.parse_args()
+
+    if args.url:
+        transport = HttpTransport(args.url)
+    elif args.db_path:
+        transport = TestClientTransport(args.db_path)
+        from database import db, Doctor, User
+        with transport.app.app_context():
+            args.doctors = args.doctors or db.session.query(db.func.max(Doctor.id)).scalar()
+            args.patients = args.patients or User.query.count()
+    else:
+        parser.error('需要指定数据库文件或 --url')
+    if not args.doctors or not args.patients:
+        parser.error('--url 模式需要指定 --doctors 和 --patients')
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def record(name, latency, status, statements):
+        with lock:
+            samples[name].append((latency, status, statements))
+
+    users = [VirtualUser(transport, random.Random(args.seed * 1000 + n), args, record) for n in range(args.clients)]
+    stop = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=user.run, args=(stop,)) for user in users]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    summary = summarize(samples, elapsed)
+    print(f'{"endpoint":<22}{"req":>7}{"req/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"sql/req":>9}  statuses')
+    for name, s in summary.items():
+        sql = f'{s["sql_per_request"]:.1f}' if s['sql_per_request'] is not None else '-'
+        print(f'{name:<22}{s["requests"]:>7}{s["throughput"]:>9.1f}{s["p50_ms"]:>8.1f}ms{s["p95_ms"]:>7.1f}ms{s["p99_ms"]:>7.1f}ms'
+              f'{sql:>9}  {s["statuses"]}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'target': args.url or 'test-client',
+                'clients': args.clients,
+                'seconds': elapsed,
+                'mix': MIX,
+                'python': platform.python_version(),
+                'endpoints': summary,
+            }, f, ensure_ascii=False, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
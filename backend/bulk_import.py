@@ -0,0 +1,177 @@
+"""批量导入医生、患者和排班
+
+逐行流式读取 CSV（带表头）或 JSONL 文件，每 batch_size 行：
+  1. 在密码进程池上并行计算这一批的密码哈希
+  2. 用一条 executemany 语句批量写入
+  3. 在同一个事务里更新 ImportCheckpoint 中的已导入行数并提交
+中途失败后重新执行同一条命令，会从最后一次提交的位置继续。
+写入使用 INSERT OR IGNORE / UPSERT，即使重复导入同一批数据也不会产生重复记录。
+
+各类文件的字段：
+    doctors:   doctor_id, name, gender, title, department, office_number, phone, password, flag
+    users:     id_card, name, gender, phone_number, address, emergency_contact, password
+    schedules: doctor_id, date (YYYY-MM-DD), morning_limit, afternoon_limit（不超过默认粒度的小时段个数）
+
+命令行用法（在 backend 目录下）：
+    flask --app backend import-data --doctors doctors.csv --users users.jsonl --schedules schedules.csv
+"""
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db, Doctor, DoctorSchedule, ImportCheckpoint, User, availability_cache
+from passwords import hash_passwords
+from time_slots import PERIOD_MINUTES, check_limit, default_slot_minutes
+
+
+def read_rows(path):
+    """按文件扩展名逐行读取 CSV 或 JSONL，产出 dict"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _flag(value):
+    """把 CSV 中的 true/1/是 等值转换为布尔值"""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', '是')
+
+
+def _doctor_rows(batch):
+    hashes = hash_passwords([str(row['password']) for row in batch])
+    return [{
+        'id': int(row['doctor_id']),
+        'name': row['name'],
+        'gender': row['gender'],
+        'title': row['title'],
+        'department': row['department'],
+        'office_number': str(row['office_number']),
+        'phone': str(row['phone']),
+        'password_hash': password_hash,
+        'flag': _flag(row.get('flag', False)),
+    } for row, password_hash in zip(batch, hashes)]
+
+
+def _user_rows(batch):
+    hashes = hash_passwords([str(row['password']) for row in batch])
+    return [{
+        'id': str(row['id_card']),
+        'name': row['name'],
+        'gender': row['gender'],
+        'phone_number': str(row['phone_number']),
+        'address': row.get('address') or '',
+        'emergency_contact': str(row.get('emergency_contact') or ''),
+        'password_hash': password_hash,
+    } for row, password_hash in zip(batch, hashes)]
+
+
+def _schedule_rows(batch):
+    # 排班中冗余医生的科室；医生不存在时为空字符串，按科室查找时不会找到
+    departments = dict(db.session.query(Doctor.id, Doctor.department).filter(
+        Doctor.id.in_({int(row['doctor_id']) for row in batch})))
+    # 新排班按默认粒度划分小时段，上限和 /doctor/schedule 一样不能超过小时段个数
+    minutes = default_slot_minutes()
+    return [{
+        'doctor_id': int(row['doctor_id']),
+        'department': departments.get(int(row['doctor_id']), ''),
+        'date': datetime.strptime(row['date'], "%Y-%m-%d").date(),
+        'morning_booked': 0,
+        'morning_limit': check_limit(int(row['morning_limit']), minutes, f'morning_limit for {row["date"]}'),
+        'afternoon_booked': 0,
+        'afternoon_limit': check_limit(int(row['afternoon_limit']), minutes, f'afternoon_limit for {row["date"]}'),
+        'slot_minutes': minutes,
+    } for row in batch]
+
+
+def _execute(statement, rows):
+    """在当前会话的事务中以 executemany 执行，返回受影响的行数"""
+    return db.session.connection().execute(statement, rows).rowcount
+
+
+def _insert_doctors(rows):
+    # 排班在全部医生导入后由 materialize_schedules 一次性生成
+    return _execute(sqlite_insert(Doctor.__table__).on_conflict_do_nothing(), rows)
+
+
+def _insert_users(rows):
+    return _execute(sqlite_insert(User.__table__).on_conflict_do_nothing(), rows)
+
+
+def _upsert_schedules(rows):
+    # 已有排班只更新上限，上限不超过这一天的小时段个数（粒度可能与默认不同），也不低于已预约人数
+    statement = sqlite_insert(DoctorSchedule.__table__)
+    slots = PERIOD_MINUTES // DoctorSchedule.slot_minutes
+    return _execute(statement.on_conflict_do_update(
+        index_elements=['doctor_id', 'date'],
+        set_={
+            'morning_limit': db.func.max(db.func.min(statement.excluded.morning_limit, slots), DoctorSchedule.morning_booked),
+            'afternoon_limit': db.func.max(db.func.min(statement.excluded.afternoon_limit, slots), DoctorSchedule.afternoon_booked),
+        }
+    ), rows)
+
+
+# 导入类型 -> (把一批原始行转换为表行的函数, 写入函数（返回写入的行数）)
+IMPORTERS = {
+    'doctors': (_doctor_rows, _insert_doctors),
+    'users': (_user_rows, _insert_users),
+    'schedules': (_schedule_rows, _upsert_schedules),
+}
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}:{int(stat.st_mtime)}'
+
+
+def import_file(kind, path, batch_size=5000, log=print):
+    """
+    导入一个文件，返回 (本次读取行数, 实际写入行数, 耗时秒数)；需在应用上下文中调用
+    主键或唯一字段（如手机号）与已有记录冲突的行会被跳过，读取行数与写入行数之差即跳过的行数
+    """
+    convert, write = IMPORTERS[kind]
+    source = os.path.abspath(path)
+    fingerprint = _fingerprint(path)
+    checkpoint = ImportCheckpoint.query.get(source)
+    if checkpoint is None or checkpoint.kind != kind or checkpoint.fingerprint != fingerprint:
+        checkpoint = db.session.merge(ImportCheckpoint(source=source, kind=kind, fingerprint=fingerprint, rows_done=0,
+                                                       updated_at=datetime.utcnow()))
+        db.session.commit()
+    skip = checkpoint.rows_done
+    if skip:
+        log(f'{kind}: resuming {path} after {skip} rows')
+
+    rows = islice(read_rows(path), skip, None)
+    done = skip
+    imported = 0
+    written = 0
+    t0 = time.perf_counter()
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        try:
+            batch_written = write(convert(batch))
+            done += len(batch)
+            checkpoint.rows_done = done
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            log(f'{kind}: failed in rows {done + 1}-{done + len(batch)} of {path}; rerun to resume from row {done + 1}')
+            raise
+        imported += len(batch)
+        written += batch_written
+        elapsed = time.perf_counter() - t0
+        log(f'{kind}: {done} rows committed, {len(batch) - batch_written} skipped in this batch ({imported / elapsed:.0f} rows/sec)')
+    availability_cache.invalidate()
+    return imported, written, time.perf_counter() - t0
@@ -1,19 +1,45 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
+from passwords import hash_password, verify_password, needs_rehash
+import io
 import json
+import hashlib
 from datetime import datetime, timedelta
+from admission import booking_admission
+from availability_cache import AvailabilityCache
+from events import EventBroker
+from group_commit import group_writer
+from schedule_horizon import horizon_days, retention_days, default_limit
+from time_slots import PERIOD_MINUTES, PERIOD_STARTS, check_limit, default_slot_minutes, first_free, free_count, is_free, slot_count, slot_time
 
 # 初始化 SQLAlchemy 对象
 db = SQLAlchemy()
 
+# 医生可预约情况的共享快照缓存
+availability_cache = AvailabilityCache()
+
+# 名额变化和新预约的事件中转（/events/availability 和 /events/doctor/appointments）
+event_broker = EventBroker()
+AVAILABILITY_CHANNEL = 'availability'
+
+def doctor_channel(doctor_id):
+    """医生本人预约事件的频道名"""
+    return f'doctor:{doctor_id}'
+
+# 还有名额的排班，部分索引 ix_doctor_schedule_department_open 的条件；查询中必须使用相同的条件才会用到这个索引
+OPEN_SCHEDULE_SQL = 'morning_booked < morning_limit OR afternoon_booked < afternoon_limit'
+
 # 定义医生信息表的模型类
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)  # 医生工号，主键
-    avatar = db.Column(db.LargeBinary, nullable=True)  # 医生头像，二进制数据，可以为空
-    name = db.Column(db.String(50), nullable=False)  # 医生姓名，不允许为空
+    avatar = db.deferred(db.Column(db.LargeBinary, nullable=True))  # 医生头像缩略图，二进制数据，可以为空，只在访问时加载
+    avatar_hash = db.Column(db.String(64), nullable=True)  # 头像内容的 SHA-256，用作 ETag
+    avatar_mimetype = db.Column(db.String(32), nullable=True)  # 头像的 MIME 类型
+    avatar_updated_at = db.Column(db.DateTime, nullable=True)  # 头像更新时间，用作 Last-Modified
+    name = db.Column(db.String(50), nullable=False, index=True)  # 医生姓名，不允许为空，按姓名前缀搜索时走索引
     gender = db.Column(db.String(10), nullable=False)  # 医生性别，不允许为空
-    title = db.Column(db.String(50), nullable=False)  # 医生职称，不允许为空
-    department = db.Column(db.String(50), nullable=False)  # 医生科室，不允许为空
+    title = db.Column(db.String(50), nullable=False, index=True)  # 医生职称，不允许为空，按职称筛选时走索引
+    department = db.Column(db.String(50), nullable=False, index=True)  # 医生科室，不允许为空，按科室筛选时走索引
     office_number = db.Column(db.String(20), nullable=False)  # 办公室门牌号，不允许为空
     phone = db.Column(db.String(15), nullable=False)  # 工作电话，不允许为空
     password_hash = db.Column(db.String(128), nullable=False)  # 医生密码的哈希值，不允许为空
@@ -28,6 +54,38 @@ class DoctorSchedule(db.Model):
     morning_limit = db.Column(db.Integer, nullable=False)  # 上午预约人数上限，不允许为空
     afternoon_booked = db.Column(db.Integer, nullable=False, default=0)  # 下午已预约人数，不允许为空
     afternoon_limit = db.Column(db.Integer, nullable=False)  # 下午预约人数上限，不允许为空
+    slot_minutes = db.Column(db.Integer, nullable=False, default=default_slot_minutes)  # 小时段长度（分钟），见 time_slots.py
+    morning_slots = db.Column(db.Integer, nullable=False, default=0)  # 上午各小时段的占用位图，第 i 位为 1 表示第 i 个小时段已被预约
+    afternoon_slots = db.Column(db.Integer, nullable=False, default=0)  # 下午各小时段的占用位图
+    department = db.Column(db.String(50), nullable=False)  # 医生科室，与 Doctor.department 相同，按科室查找最早的空闲时间段时使用
+
+    __table_args__ = (
+        db.Index('uq_doctor_schedule_doctor_date', 'doctor_id', 'date', unique=True),  # 每个医生每天只有一条排班
+        # 按日期窗口查询所有医生的排班；包含名额列，筛选有余号的排班时只读索引
+        db.Index('ix_doctor_schedule_date_capacity', 'date', 'doctor_id',
+                 'morning_booked', 'morning_limit', 'afternoon_booked', 'afternoon_limit'),
+        # 只包含还有名额的排班（部分索引），按科室、日期排序：查找科室最早的空闲时间段时按索引顺序读取，
+        # 预约占满、取消空出名额和修改上限时由 SQLite 随这一行的 UPDATE 一起维护
+        db.Index('ix_doctor_schedule_department_open', 'department', 'date', sqlite_where=db.text(OPEN_SCHEDULE_SQL)),
+    )
+
+# 定义医生每周排班模板的模型类，每个医生每个星期几一行
+class DoctorScheduleTemplate(db.Model):
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)  # 医生工号，外键
+    weekday = db.Column(db.Integer, primary_key=True)  # 星期几，0 表示星期一
+    morning_limit = db.Column(db.Integer, nullable=False)  # 上午预约人数上限，0 表示不出诊
+    afternoon_limit = db.Column(db.Integer, nullable=False)  # 下午预约人数上限，0 表示不出诊
+
+# 定义过期排班归档表的模型类
+class DoctorScheduleArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # ID，主键
+    doctor_id = db.Column(db.Integer, nullable=False)  # 医生工号
+    date = db.Column(db.Date, nullable=False, index=True)  # 排班日期
+    morning_booked = db.Column(db.Integer, nullable=False)  # 上午已预约人数
+    morning_limit = db.Column(db.Integer, nullable=False)  # 上午预约人数上限
+    afternoon_booked = db.Column(db.Integer, nullable=False)  # 下午已预约人数
+    afternoon_limit = db.Column(db.Integer, nullable=False)  # 下午预约人数上限
+    archived_at = db.Column(db.DateTime, nullable=False)  # 归档时间
 
 # 定义用户信息表的模型类
 class User(db.Model):
@@ -46,6 +104,42 @@ class Appointment(db.Model):
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)  # 医生工号，外键
     appointment_date = db.Column(db.Date, nullable=False)  # 预约日期，不允许为空
     appointment_period = db.Column(db.String(10), nullable=False)  # 预约时间段（上午/下午），不允许为空
+    slot_offset = db.Column(db.Integer, nullable=True)  # 小时段开始时间距时间段开始的分钟数，迁移前超出小时段个数的旧预约为空
+
+    __table_args__ = (
+        db.Index('uq_appointment_user_slot', 'user_id', 'doctor_id', 'appointment_date', 'appointment_period', unique=True),  # 同一用户不能重复预约同一时间段
+        db.Index('ix_appointment_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_period'),  # 按医生和时间段查询预约
+        db.Index('ix_appointment_date_slot', 'appointment_date', 'doctor_id', 'appointment_period'),  # 按日期范围统计各时间段的预约数
+        db.Index('uq_appointment_slot_time', 'doctor_id', 'appointment_date', 'appointment_period', 'slot_offset', unique=True),  # 每个小时段只有一个预约
+    )
+
+# 定义候补队列的模型类：时间段约满后用户可以排队，有人取消预约时队首自动转为预约
+class WaitlistEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 自增序号，同一时间段内按它排队，删除后也不会复用
+    user_id = db.Column(db.String(18), db.ForeignKey('user.id'), nullable=False)  # 用户身份证号，外键
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)  # 医生工号，外键
+    appointment_date = db.Column(db.Date, nullable=False)  # 候补的日期
+    appointment_period = db.Column(db.String(10), nullable=False)  # 候补的时间段（上午/下午）
+    created_at = db.Column(db.DateTime, nullable=False)  # 加入队列的时间
+
+    __table_args__ = (
+        db.Index('uq_waitlist_user_slot', 'user_id', 'doctor_id', 'appointment_date', 'appointment_period', unique=True),  # 同一用户在一个时间段只排一次
+        db.Index('ix_waitlist_slot_order', 'doctor_id', 'appointment_date', 'appointment_period', 'id'),  # 取队首、统计排在前面的人数
+        {'sqlite_autoincrement': True},
+    )
+
+# 定义预约变更日志的模型类，由迁移创建的触发器在预约增删改时写入，计数校对据此只检查有变化的日期
+class AppointmentChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 自增序号，校对的高水位，清理后也不会复用
+    appointment_date = db.Column(db.Date, nullable=False)  # 有预约变化的日期
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# 定义后台任务进度的模型类
+class ReconcileState(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # 任务名
+    high_water = db.Column(db.Integer, nullable=False, default=0)  # 已处理到的 AppointmentChange.id
+    updated_at = db.Column(db.DateTime, nullable=False)  # 最后一次运行的时间
 
 # 定义管理员表的模型类
 class Admin(db.Model):
@@ -60,13 +154,35 @@ class Notification(db.Model):
     message = db.Column(db.String(255), nullable=False)
     is_read = db.Column(db.Boolean, default=False, nullable=False)
 
+# 定义批量导入进度表的模型类
+class ImportCheckpoint(db.Model):
+    source = db.Column(db.String(255), primary_key=True)  # 导入文件的绝对路径
+    kind = db.Column(db.String(20), nullable=False)  # 导入类型（doctors/users/schedules）
+    fingerprint = db.Column(db.String(64), nullable=False)  # 文件大小和修改时间，文件变化后从头导入
+    rows_done = db.Column(db.Integer, nullable=False, default=0)  # 已提交的行数
+    updated_at = db.Column(db.DateTime, nullable=False)  # 最后一次提交的时间
+
 
 # 数据库辅助函数
 
+def parse_date_label(label):
+    """把 "MM月DD日" 转换为日期，年份取离今天最近的一年，预约窗口跨年时也能得到正确的日期"""
+    today = datetime.today().date()
+    candidates = []
+    for year in (today.year - 1, today.year, today.year + 1):
+        try:
+            candidates.append(datetime.strptime(f'{year}年{label}', "%Y年%m月%d日").date())
+        except ValueError:
+            pass
+    if not candidates:
+        raise ValueError(f'Invalid date {label!r}')
+    return min(candidates, key=lambda date: abs(date - today))
+
 def get_doctor_schedule(doctor_id):
-    """获取未来三天医生的预约情况"""
+    """获取医生在预约窗口内的预约情况"""
     today = datetime.today().date()
-    schedules = DoctorSchedule.query.filter_by(doctor_id=doctor_id).filter(DoctorSchedule.date >= today).filter(DoctorSchedule.date <= today + timedelta(days=2)).all()
+    schedules = DoctorSchedule.query.filter_by(doctor_id=doctor_id).filter(DoctorSchedule.date >= today).filter(
+        DoctorSchedule.date < today + timedelta(days=horizon_days())).order_by(DoctorSchedule.date).all()
     result = []
     for schedule in schedules:
         result.append({
@@ -74,67 +190,857 @@ def get_doctor_schedule(doctor_id):
             'morning_booked': schedule.morning_booked,
             'morning_limit': schedule.morning_limit,
             'afternoon_booked': schedule.afternoon_booked,
-            'afternoon_limit': schedule.afternoon_limit
+            'afternoon_limit': schedule.afternoon_limit,
+            'slot_minutes': schedule.slot_minutes
         })
     return result
 
+def get_day_slots(doctor_id, date):
+    """医生某一天各小时段的占用情况（一条主键查询，其余都是位运算），没有排班时返回 None"""
+    row = db.session.query(
+        DoctorSchedule.slot_minutes,
+        DoctorSchedule.morning_booked, DoctorSchedule.morning_limit, DoctorSchedule.morning_slots,
+        DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit, DoctorSchedule.afternoon_slots
+    ).filter(DoctorSchedule.doctor_id == doctor_id, DoctorSchedule.date == date).first()
+    if row is None:
+        return None
+    minutes = row[0]
+    count = slot_count(minutes)
+    periods = []
+    for period, booked, limit, mask in (('上午', *row[1:4]), ('下午', *row[4:7])):
+        # 名额已满时空闲的小时段也不能预约
+        bookable = booked < limit
+        first = first_free(mask, count) if bookable else None
+        periods.append({
+            'period': period,
+            'booked': booked,
+            'limit': limit,
+            'free': min(limit - booked, free_count(mask, count)) if bookable else 0,
+            'first_free': slot_time(period, first * minutes) if first is not None else None,
+            'slots': [{'time': slot_time(period, i * minutes), 'available': bookable and is_free(mask, i)} for i in range(count)]
+        })
+    return {'date': date.strftime("%m月%d日"), 'slot_minutes': minutes, 'periods': periods}
 
-def book_doctor(user_id, doctor_id, appointment_date, appointment_period):
-    """预约医生"""
-    appointment = Appointment(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date, appointment_period=appointment_period)
-    db.session.add(appointment)
-    db.session.commit()
-    update_doctor_schedule(doctor_id, appointment_date, appointment_period)
-    # create_notification(doctor_id, f'You have a new appointment on {appointment_date.strftime("%m月%d日")} {appointment_period}')
-    return appointment
-
-def update_doctor_schedule(doctor_id, appointment_date, appointment_period):
-    """更新医生预约时间表"""
-    schedule = DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=appointment_date).first()
-    if schedule:
-        if appointment_period == '上午':
-            schedule.morning_booked += 1
-        else:
-            schedule.afternoon_booked += 1
+
+def _build_availability_snapshot(start, end):
+    """从数据库构建所有患者共享的可预约情况快照（两条查询）
+
+    快照结构：
+      doctors: [(医生信息 dict, [排班行, ...]), ...]
+      index:   {(医生工号, 日期): 排班行}
+    排班行是可原地修改的列表 [日期, 日期文本, 上午已预约, 上午上限, 下午已预约, 下午上限]。
+    """
+    doctors = db.session.query(
+        Doctor.id, Doctor.name, Doctor.gender, Doctor.title, Doctor.department, Doctor.office_number, Doctor.phone
+    ).order_by(Doctor.id).all()
+    schedules = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.date,
+        DoctorSchedule.morning_booked, DoctorSchedule.morning_limit,
+        DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit
+    ).filter(DoctorSchedule.date >= start, DoctorSchedule.date <= end).order_by(DoctorSchedule.doctor_id, DoctorSchedule.date).all()
+
+    # 每个日期只格式化一次
+    date_labels = {}
+    index = {}
+    rows_by_doctor = {}
+    for doctor_id, date, morning_booked, morning_limit, afternoon_booked, afternoon_limit in schedules:
+        label = date_labels.get(date)
+        if label is None:
+            label = date_labels[date] = date.strftime("%m月%d日")
+        row = [date, label, morning_booked, morning_limit, afternoon_booked, afternoon_limit]
+        index[(doctor_id, date)] = row
+        rows_by_doctor.setdefault(doctor_id, []).append(row)
+
+    return {
+        'doctors': [
+            ({
+                'id': doctor_id,
+                'name': name,
+                'gender': gender,
+                'title': title,
+                'department': department,
+                'office': office_number,
+                'phone': phone
+            }, rows_by_doctor.get(doctor_id, []))
+            for doctor_id, name, gender, title, department, office_number, phone in doctors
+        ],
+        'index': index
+    }
+
+
+def get_doctors_availability(user_id, days=3):
+    """获取所有医生未来几天的可预约情况，并标记该用户已预约的时间段
+
+    医生和名额部分来自共享快照，每次请求只查询该用户窗口内的预约（一条查询）。
+    """
+    today = datetime.today().date()
+    end = today + timedelta(days=days - 1)
+    snapshot = availability_cache.get(today, end, _build_availability_snapshot)
+    user_booked = set(db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period
+    ).filter(Appointment.user_id == user_id, Appointment.appointment_date >= today, Appointment.appointment_date <= end).all())
+
+    result = []
+    for info, rows in snapshot['doctors']:
+        doctor = dict(info)
+        doctor['available_times'] = [_availability_day(info['id'], row, user_booked) for row in rows]
+        result.append(doctor)
+    return result
+
+
+def _availability_day(doctor_id, row, user_booked, periods=('上午', '下午'), only_available=False):
+    """把一条排班行 [日期, 日期文本, 上午已预约, 上午上限, 下午已预约, 下午上限] 转换成返回给患者的格式"""
+    date, label = row[0], row[1]
+    slots = []
+    for period in periods:
+        booked, limit = (row[2], row[3]) if period == '上午' else (row[4], row[5])
+        if only_available and booked >= limit:
+            continue
+        slots.append({
+            'period': period,
+            'booked': booked,
+            'limit': limit,
+            'available': limit - booked > 0,
+            'user_booked': (doctor_id, date, period) in user_booked
+        })
+    return {'date': label, 'slots': slots}
+
+
+def search_doctors_availability(user_id, days=3, department=None, title=None, name_prefix=None,
+                                date=None, period=None, only_available=False):
+    """按条件查询可预约情况，条件都下推到 SQL 中（一条连接查询 + 一条用户预约查询）
+
+    department / title 为精确匹配，name_prefix 为姓名前缀，date 只查这一天，
+    period 只返回这个时间段（这个时间段上限为 0、即不出诊的排班不返回），only_available 只返回还有名额的时间段。
+    没有符合条件的排班的医生不返回。
+    """
+    today = datetime.today().date()
+    start, end = today, today + timedelta(days=days - 1)
+    if date is not None:
+        if not start <= date <= today + timedelta(days=horizon_days() - 1):
+            return []
+        start = end = date
+
+    query = db.session.query(
+        Doctor.id, Doctor.name, Doctor.gender, Doctor.title, Doctor.department, Doctor.office_number, Doctor.phone,
+        DoctorSchedule.date, DoctorSchedule.morning_booked, DoctorSchedule.morning_limit,
+        DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit
+    ).join(DoctorSchedule, DoctorSchedule.doctor_id == Doctor.id).filter(
+        DoctorSchedule.date == start if start == end else DoctorSchedule.date.between(start, end)
+    )
+    if department is not None:
+        query = query.filter(Doctor.department == department)
+    if title is not None:
+        query = query.filter(Doctor.title == title)
+    if name_prefix:
+        # 用范围条件代替 LIKE，可以使用姓名上的普通索引
+        query = query.filter(Doctor.name >= name_prefix, Doctor.name < name_prefix + '\U0010ffff')
+    periods = (period,) if period else ('上午', '下午')
+    if only_available:
+        conditions = [DoctorSchedule.morning_booked < DoctorSchedule.morning_limit if p == '上午'
+                      else DoctorSchedule.afternoon_booked < DoctorSchedule.afternoon_limit for p in periods]
+        query = query.filter(db.or_(*conditions))
+    elif period == '上午':
+        query = query.filter(DoctorSchedule.morning_limit > 0)
+    elif period == '下午':
+        query = query.filter(DoctorSchedule.afternoon_limit > 0)
+    # 有医生条件时从医生表的索引出发；只按日期和名额筛选时按排班表的 doctor_id 排序，
+    # 可以直接按覆盖索引的顺序读取，不需要扫描医生表再排序（没有 ANALYZE 统计时查询规划器依赖这个提示）
+    order_column = Doctor.id if department is not None or title is not None or name_prefix else DoctorSchedule.doctor_id
+    rows = query.order_by(order_column, DoctorSchedule.date).all()
+    if not rows:
+        return []
+
+    user_booked = set(db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period
+    ).filter(Appointment.user_id == user_id, Appointment.appointment_date >= start, Appointment.appointment_date <= end).all())
+
+    result = []
+    date_labels = {}
+    doctor = None
+    for doctor_id, name, gender, title, department, office_number, phone, date, *counts in rows:
+        if doctor is None or doctor['id'] != doctor_id:
+            doctor = {'id': doctor_id, 'name': name, 'gender': gender, 'title': title, 'department': department,
+                      'office': office_number, 'phone': phone, 'available_times': []}
+            result.append(doctor)
+        label = date_labels.get(date)
+        if label is None:
+            label = date_labels[date] = date.strftime("%m月%d日")
+        doctor['available_times'].append(
+            _availability_day(doctor_id, [date, label, *counts], user_booked, periods, only_available))
+    return result
+
+
+NEXT_AVAILABLE_FETCH_ROWS = 64  # 按科室查找最早的空闲时间段时每次从游标读取的行数
+
+def get_next_available(user_id, department, after=None, limit=10):
+    """
+    科室所有医生中最早的 limit 个空闲时间段，按 (日期, 第一个空闲小时段的开始时间, 医生工号) 排序
+
+    after 为 (日期, 距零点的分钟数)，只返回不早于这个时间的小时段，默认从今天开始，不超出预约窗口。
+    按日期顺序读取部分索引 ix_doctor_schedule_department_open（只包含还有名额的排班），
+    凑够 limit 个之后读完当天就停止：约满的排班不在索引中，读取的行数只是结果所在几天中科室还有名额的排班数。
+    用户已经预约的时间段跳过。
+    """
+    today = datetime.today().date()
+    start, start_minute = after if after is not None and after[0] >= today else (today, 0)
+    end = today + timedelta(days=horizon_days() - 1)
+    if start > end:
+        return []
+    user_booked = set(db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period
+    ).filter(Appointment.user_id == user_id, Appointment.appointment_date.between(start, end)).all())
+
+    result = db.session.execute(
+        db.select(
+            DoctorSchedule.doctor_id, DoctorSchedule.date, DoctorSchedule.slot_minutes,
+            DoctorSchedule.morning_booked, DoctorSchedule.morning_limit, DoctorSchedule.morning_slots,
+            DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit, DoctorSchedule.afternoon_slots
+        ).where(
+            DoctorSchedule.department == department, DoctorSchedule.date.between(start, end),
+            db.or_(DoctorSchedule.morning_booked < DoctorSchedule.morning_limit,
+                   DoctorSchedule.afternoon_booked < DoctorSchedule.afternoon_limit)
+        ).order_by(DoctorSchedule.date)
+        # ORM 查询默认一次读出全部结果，分批读取才能在凑够之后提前停止
+        .execution_options(yield_per=NEXT_AVAILABLE_FETCH_ROWS)
+    )
+    found = []  # (日期, 开始时间距零点的分钟数, 医生工号, 时间段, 小时段, 还可以预约的人数)
+    try:
+        for doctor_id, date, minutes, *periods in result:
+            # 已经凑够且之前的日期都读完了，后面的日期不会更早
+            if len(found) >= limit and date > found[-1][0]:
+                break
+            count = slot_count(minutes)
+            for period, (booked, period_limit, mask) in (('上午', periods[0:3]), ('下午', periods[3:6])):
+                if booked >= period_limit or (doctor_id, date, period) in user_booked:
+                    continue
+                # after 当天只看不早于 start_minute 的小时段：把之前的小时段当作已占用
+                skip = max(0, -(-(start_minute - PERIOD_STARTS[period]) // minutes)) if date == start else 0
+                index = first_free(mask | ((1 << skip) - 1), count)
+                if index is not None:
+                    found.append((date, PERIOD_STARTS[period] + index * minutes, doctor_id, period, index * minutes,
+                                  min(period_limit - booked, free_count(mask, count))))
+    finally:
+        result.close()
+    found.sort()
+    found = found[:limit]
+    if not found:
+        return []
+
+    doctors = {row.id: row for row in db.session.query(Doctor.id, Doctor.name, Doctor.title, Doctor.office_number)
+               .filter(Doctor.id.in_({item[2] for item in found}))}
+    return [{
+        'doctor_id': doctor_id,
+        'doctor_name': doctors[doctor_id].name,
+        'title': doctors[doctor_id].title,
+        'office': doctors[doctor_id].office_number,
+        'date': date.strftime("%m月%d日"),
+        'period': period,
+        'time': slot_time(period, offset),
+        'free': free
+    } for date, _, doctor_id, period, offset, free in found]
+
+
+def _period_columns(appointment_period):
+    """根据时间段返回对应的(已预约人数, 预约上限)列，时间段非法时返回 None"""
+    if appointment_period == '上午':
+        return DoctorSchedule.morning_booked, DoctorSchedule.morning_limit
+    if appointment_period == '下午':
+        return DoctorSchedule.afternoon_booked, DoctorSchedule.afternoon_limit
+    return None
+
+def _occupancy_column(appointment_period):
+    """根据时间段返回对应的小时段占用位图列"""
+    return DoctorSchedule.morning_slots if appointment_period == '上午' else DoctorSchedule.afternoon_slots
+
+def _slot_bit(offset):
+    """offset 所在小时段在位图中的位（SQL 表达式，按排班自己的粒度计算）"""
+    return db.literal(1).bitwise_lshift(offset // DoctorSchedule.slot_minutes)
+
+
+def _publish_slot(doctor_id, date, period, booked, limit):
+    """发布一个时间段名额变化的事件，同时告诉准入控制最新的剩余名额"""
+    booking_admission.observe(doctor_id, date, period, booked, limit)
+    event_broker.publish(AVAILABILITY_CHANNEL, 'slot', {
+        'doctor_id': doctor_id,
+        'date': date.strftime("%m月%d日"),
+        'period': period,
+        'booked': booked,
+        'limit': limit,
+        'available': limit - booked > 0
+    })
+
+def _publish_doctor_appointment(event, appointment_id, user_id, doctor_id, appointment_date, appointment_period, user=None):
+    """
+    向医生本人的频道发布新预约或取消预约的事件，没有订阅者时不查询用户信息
+    user 为 (姓名, 性别)，用户已被删除时由调用方在删除前传入
+    """
+    channel = doctor_channel(doctor_id)
+    if not event_broker.has_subscribers(channel):
+        return
+    if user is None:
+        user = db.session.query(User.name, User.gender).filter(User.id == user_id).first() or (None, None)
+    user_name, user_gender = user
+    event_broker.publish(channel, event, {
+        'id': appointment_id,
+        'user_id': user_id,
+        'user_name': user_name,
+        'user_gender': user_gender,
+        'appointment_date': appointment_date.strftime("%Y-%m-%d"),
+        'appointment_period': appointment_period
+    })
+
+def _run_write(write, *args):
+    """执行一个写操作：开启组提交时交给写线程与其他请求的操作一起提交，否则在当前请求中直接提交
+
+    write 在会话中写入但不提交，返回 (结果, 提交后执行的函数或 None)，见 group_commit.py。
+    """
+    if group_writer.enabled:
+        return group_writer.submit(write, *args)
+    try:
+        result, after_commit = write(*args)
         db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if after_commit is not None:
+        after_commit()
+    return result
+
+def book_doctor(user_id, doctor_id, appointment_date, appointment_period, slot_offset=None):
+    """预约医生
+
+    名额检查、计数加一、占用小时段和插入预约记录在同一个事务中完成，只提交一次。
+    slot_offset 为指定的小时段（距时间段开始的分钟数），不指定时分配第一个空闲的小时段。
+    名额已满、指定的小时段已被占用、排班不存在或时间段非法时返回 None。
+    """
+    return _run_write(_book_doctor_write, user_id, doctor_id, appointment_date, appointment_period, slot_offset)
+
+def _book_doctor_write(user_id, doctor_id, appointment_date, appointment_period, slot_offset=None):
+    slot = update_doctor_schedule(doctor_id, appointment_date, appointment_period, slot_offset)
+    if not slot:
+        return None, None
+    booked, limit, slot_offset = slot
+    appointment = Appointment(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date,
+                              appointment_period=appointment_period, slot_offset=slot_offset)
+    db.session.add(appointment)
+    # 候补期间自己约上了（例如医生增加了名额），同时移出候补队列
+    _remove_from_waitlist(user_id, [(doctor_id, appointment_date, appointment_period)])
+    # 重复预约在这里触发唯一约束，组提交时只回滚这个操作的保存点
+    db.session.flush()
+
+    def after_commit():
+        availability_cache.patch_slot(doctor_id, appointment_date, appointment_period, 1)
+        _publish_slot(doctor_id, appointment_date, appointment_period, booked, limit)
+        _publish_doctor_appointment('appointment', appointment.id, user_id, doctor_id, appointment_date, appointment_period)
+        # create_notification(doctor_id, f'You have a new appointment on {appointment_date.strftime("%m月%d日")} {appointment_period}')
+    return appointment, after_commit
+
+def update_doctor_schedule(doctor_id, appointment_date, appointment_period, slot_offset=None):
+    """更新医生预约时间表（占用一个名额和一个小时段，不提交）
+
+    用一条带条件的 UPDATE 同时完成名额检查和计数加一：
+    UPDATE ... SET booked = booked + 1 WHERE ... AND booked < limit RETURNING booked, limit
+    指定 slot_offset 时同一条 UPDATE 还检查这个小时段空闲并置位；不指定时条件中检查位图的最低 0 位
+    （~slots & (slots + 1)）还在小时段个数以内，再按返回的位图置位第一个空闲的小时段，
+    此时这一行已被本事务写过、持有写锁，位图不会被并发请求修改。
+    返回占用后的 (已预约人数, 上限, 小时段)，名额已满、小时段已被占用、排班不存在或时间段非法时返回 None。
+    """
+    columns = _period_columns(appointment_period)
+    if columns is None:
+        return None
+    booked, limit = columns
+    slots = _occupancy_column(appointment_period)
+    conditions = [DoctorSchedule.doctor_id == doctor_id, DoctorSchedule.date == appointment_date, booked < limit]
+    values = {booked: booked + 1}
+    if slot_offset is not None:
+        bit = _slot_bit(slot_offset)
+        conditions += [slot_offset % DoctorSchedule.slot_minutes == 0, slot_offset < PERIOD_MINUTES, slots.bitwise_and(bit) == 0]
+        values[slots] = slots.bitwise_or(bit)
+    else:
+        conditions.append(slots.bitwise_not().bitwise_and(slots + 1) < _slot_bit(PERIOD_MINUTES))
+    row = db.session.execute(
+        db.update(DoctorSchedule)
+        .where(*conditions)
+        .values(values)
+        .returning(booked, limit, slots, DoctorSchedule.slot_minutes)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    booked_after, limit_after, mask, minutes = row
+    if slot_offset is None:
+        index = first_free(mask, slot_count(minutes))
+        slot_offset = index * minutes
+        db.session.execute(
+            db.update(DoctorSchedule)
+            .where(DoctorSchedule.doctor_id == doctor_id, DoctorSchedule.date == appointment_date)
+            .values({slots: slots.bitwise_or(1 << index)})
+            .execution_options(synchronize_session=False)
+        )
+    return booked_after, limit_after, slot_offset
 
 def cancel_appointment(appointment_id):
-    """取消预约"""
+    """取消预约
+
+    删除预约记录和释放名额在同一个事务中完成，只提交一次。
+    """
+    return _run_write(_cancel_appointment_write, appointment_id)
+
+def _cancel_appointment_write(appointment_id):
     appointment = Appointment.query.get(appointment_id)
-    if appointment:
-        db.session.delete(appointment)
+    if not appointment:
+        return False, None
+    user_id, doctor_id, appointment_date, appointment_period = appointment.user_id, appointment.doctor_id, appointment.appointment_date, appointment.appointment_period
+    slot_offset = appointment.slot_offset
+    # 用 DELETE 的影响行数判断是否被并发请求抢先取消，避免重复释放名额
+    result = db.session.execute(
+        db.delete(Appointment).where(Appointment.id == appointment_id).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False, None
+    db.session.expunge(appointment)
+    # 有人候补时名额和小时段直接转给队首，已预约人数不变；否则释放名额
+    promoted = _promote_waitlist(doctor_id, appointment_date, appointment_period, slot_offset)
+    slot = None if promoted else update_doctor_schedule_on_cancel(doctor_id, appointment_date, appointment_period, slot_offset)
+
+    def after_commit():
+        # 只有确实释放了名额才修正缓存；排班不存在或已预约人数已为 0 时计数没有变化
+        if slot:
+            availability_cache.patch_slot(doctor_id, appointment_date, appointment_period, -1)
+            _publish_slot(doctor_id, appointment_date, appointment_period, *slot)
+        _publish_doctor_appointment('cancel', appointment_id, user_id, doctor_id, appointment_date, appointment_period)
+        for promoted_id, promoted_user_id in promoted:
+            _publish_doctor_appointment('appointment', promoted_id, promoted_user_id, doctor_id, appointment_date, appointment_period)
+    return True, after_commit
+
+def update_doctor_schedule_on_cancel(doctor_id, appointment_date, appointment_period, slot_offset=None):
+    """
+    更新医生预约时间表（释放一个名额和 slot_offset 所在的小时段，不提交），
+    返回释放后的 (已预约人数, 上限)，没有可释放的名额时返回 None
+    """
+    columns = _period_columns(appointment_period)
+    if columns is None:
+        return None
+    booked, limit = columns
+    values = {booked: booked - 1}
+    if slot_offset is not None:
+        slots = _occupancy_column(appointment_period)
+        values[slots] = slots.bitwise_and(_slot_bit(slot_offset).bitwise_not())
+    return db.session.execute(
+        db.update(DoctorSchedule)
+        .where(DoctorSchedule.doctor_id == doctor_id, DoctorSchedule.date == appointment_date, booked > 0)
+        .values(values)
+        .returning(booked, limit)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+# 加入候补队列：只有时间段已约满、用户没有预约这个时间段时才写入，检查和写入在同一条语句中完成
+_JOIN_WAITLIST_SQL = """
+INSERT INTO waitlist_entry (user_id, doctor_id, appointment_date, appointment_period, created_at)
+SELECT :user_id, :doctor_id, :date, :period, :now
+FROM doctor_schedule
+WHERE doctor_id = :doctor_id AND date = :date AND {booked} >= {limit}
+  AND NOT EXISTS (SELECT 1 FROM appointment WHERE user_id = :user_id AND doctor_id = :doctor_id
+                  AND appointment_date = :date AND appointment_period = :period)
+ON CONFLICT DO NOTHING
+RETURNING id
+"""
+
+def join_waitlist(user_id, doctor_id, appointment_date, appointment_period):
+    """加入时间段的候补队列，返回候补记录ID；时间段还有名额、已经预约或已在队列中时不写入，返回 None"""
+    columns = _period_columns(appointment_period)
+    if columns is None:
+        return None
+    booked, limit = columns
+    try:
+        entry_id = db.session.execute(db.text(_JOIN_WAITLIST_SQL.format(booked=booked.name, limit=limit.name)), {
+            'user_id': user_id, 'doctor_id': doctor_id, 'date': appointment_date.isoformat(),
+            'period': appointment_period, 'now': datetime.now(),
+        }).scalar()
         db.session.commit()
-        update_doctor_schedule_on_cancel(appointment.doctor_id, appointment.appointment_date, appointment.appointment_period)
-        return True
-    return False
+    except Exception:
+        db.session.rollback()
+        raise
+    return entry_id
+
+def leave_waitlist(user_id, entry_id):
+    """退出候补队列"""
+    deleted = db.session.execute(
+        db.delete(WaitlistEntry).where(WaitlistEntry.id == entry_id, WaitlistEntry.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return deleted == 1
+
+def _waitlist_position(entry):
+    """
+    候补记录在队列中的位置（从 1 开始）的 SQL 表达式
+    只在 (医生, 日期, 时间段, 序号) 索引上统计排在它前面的记录，不读表，也不扫描排在后面的部分
+    """
+    ahead = db.aliased(WaitlistEntry)
+    return db.select(db.func.count()).where(
+        ahead.doctor_id == entry.doctor_id, ahead.appointment_date == entry.appointment_date,
+        ahead.appointment_period == entry.appointment_period, ahead.id < entry.id,
+    ).scalar_subquery() + 1
+
+def get_waitlist_position(entry_id):
+    """返回候补记录在队列中的位置，记录不存在（已转为预约或已退出）时返回 None"""
+    return db.session.execute(
+        db.select(_waitlist_position(WaitlistEntry)).where(WaitlistEntry.id == entry_id)
+    ).scalar()
+
+def get_user_waitlist(user_id):
+    """用户的所有候补记录，每行为 (候补记录ID, 医生工号, 医生姓名, 日期, 时间段, 加入时间, 队列位置)"""
+    return db.session.execute(
+        db.select(WaitlistEntry.id, WaitlistEntry.doctor_id, Doctor.name, WaitlistEntry.appointment_date,
+                  WaitlistEntry.appointment_period, WaitlistEntry.created_at, _waitlist_position(WaitlistEntry))
+        .join(Doctor, Doctor.id == WaitlistEntry.doctor_id)
+        .where(WaitlistEntry.user_id == user_id)
+        .order_by(WaitlistEntry.appointment_date, WaitlistEntry.appointment_period, WaitlistEntry.id)
+    ).all()
+
+def _remove_from_waitlist(user_id, slots):
+    """把用户从这些时间段的候补队列中移除（不提交），slots 为 [(医生工号, 日期, 时间段)]"""
+    if len(slots) == 1:
+        # 单个预约走唯一索引的等值查找，语句可以缓存编译结果
+        (doctor_id, appointment_date, appointment_period), = slots
+        condition = db.and_(WaitlistEntry.doctor_id == doctor_id, WaitlistEntry.appointment_date == appointment_date,
+                            WaitlistEntry.appointment_period == appointment_period)
+    else:
+        condition = db.tuple_(WaitlistEntry.doctor_id, WaitlistEntry.appointment_date,
+                              WaitlistEntry.appointment_period).in_(slots)
+    db.session.execute(
+        db.delete(WaitlistEntry).where(WaitlistEntry.user_id == user_id, condition)
+        .execution_options(synchronize_session=False)
+    )
+
+def _promote_waitlist(doctor_id, appointment_date, appointment_period, slot_offset=None):
+    """
+    把时间段候补队列的队首转为预约（不提交），返回新预约的 [(预约ID, 用户身份证号)]，没有人候补时为空列表
+    名额由调用方负责：取消预约时名额和小时段 slot_offset 直接转给队首，已预约人数和占用位图不变。
+    队首已经有这个时间段的预约时（例如候补期间通过批量操作约上了）跳过它。
+    """
+    head = (
+        db.select(WaitlistEntry.id)
+        .where(WaitlistEntry.doctor_id == doctor_id, WaitlistEntry.appointment_date == appointment_date,
+               WaitlistEntry.appointment_period == appointment_period)
+        .order_by(WaitlistEntry.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    promoted = []
+    while not promoted:
+        # 取出并删除队首在同一条语句中完成，并发的两次取消不会把同一个人转正两次
+        user_id = db.session.execute(
+            db.delete(WaitlistEntry).where(WaitlistEntry.id == head).returning(WaitlistEntry.user_id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if user_id is None:
+            break
+        appointment_id = db.session.execute(
+            db.insert(Appointment).prefix_with('OR IGNORE')
+            .values(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date,
+                    appointment_period=appointment_period, slot_offset=slot_offset)
+            .returning(Appointment.id)
+        ).scalar()
+        if appointment_id is not None:
+            promoted.append((appointment_id, user_id))
+    return promoted
+
+class BatchConflict(Exception):
+    """批量操作写入时发现名额或预约已被并发请求修改"""
 
-def update_doctor_schedule_on_cancel(doctor_id, appointment_date, appointment_period):
-    """更新医生预约时间表（取消预约）"""
-    schedule = DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=appointment_date).first()
-    if schedule:
-        if appointment_period == '上午':
-            schedule.morning_booked -= 1
+    def __init__(self, slot, message):
+        super().__init__(message)
+        self.slot = slot
+        self.message = message
+
+
+def _apply_batch_writes(user_id, deletes, inserts, deltas):
+    """
+    在当前事务中写入批量操作的结果（不提交），返回 (新预约列表, {时间段: (已预约人数, 上限)}, {时间段: 候补转正的预约})
+    取消释放的名额和小时段先转给候补队列，deltas 中的净变化相应改为实际写入的值
+    同一用户在一个时间段最多有一个预约，所以每个时间段的净变化只有 -1、0、1
+    """
+    freed = {}  # 时间段 -> 取消的预约占用的小时段
+    if deletes:
+        rows = db.session.execute(
+            db.delete(Appointment).where(Appointment.id.in_([appointment_id for _, appointment_id in deletes]))
+            .returning(Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period, Appointment.slot_offset)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(rows) != len(deletes):
+            raise BatchConflict(None, 'Appointment not found')
+        freed = {(doctor_id, appointment_date, appointment_period): slot_offset
+                 for doctor_id, appointment_date, appointment_period, slot_offset in rows}
+    slots = {}
+    promoted = {}
+    offsets = {}  # 时间段 -> 本批次新预约分到的小时段
+    for slot, delta in deltas.items():
+        doctor_id, appointment_date, appointment_period = slot
+        # 和单个预约一样用带条件的 UPDATE，防止并发请求在读取之后占满名额
+        if delta < 0:
+            promoted[slot] = _promote_waitlist(*slot, freed.get(slot))
+            if promoted[slot]:
+                deltas[slot] = 0
+                continue
+            row = update_doctor_schedule_on_cancel(*slot, freed.get(slot))
+        elif delta > 0:
+            row = update_doctor_schedule(*slot)
+            if row is not None:
+                booked, limit, offsets[slot] = row
+                row = booked, limit
+        else:
+            # 同一时间段先取消再预约：新预约沿用取消的那个小时段
+            offsets[slot] = freed.get(slot)
+            continue
+        if row is None:
+            raise BatchConflict(slot, f'No available slots in the {"morning" if appointment_period == "上午" else "afternoon"}')
+        slots[slot] = tuple(row)
+    appointments = [Appointment(user_id=user_id, doctor_id=doctor_id, appointment_date=appointment_date,
+                                appointment_period=appointment_period, slot_offset=offsets.get((doctor_id, appointment_date, appointment_period)))
+                    for doctor_id, appointment_date, appointment_period in inserts]
+    db.session.add_all(appointments)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        raise BatchConflict(None, 'Appointment already exists')
+    if inserts:
+        _remove_from_waitlist(user_id, inserts)
+    return appointments, slots, promoted
+
+def apply_appointment_batch(user_id, operations):
+    """
+    在一个事务中按顺序执行一组预约/取消操作，全部成功才提交，只提交一次
+    operations 为 [(操作, 医生工号, 日期, 时间段)]，操作为 'book' 或 'cancel'
+    排班和该用户已有的预约各用一条查询读出，先在内存中按顺序校验名额，全部通过后再写入。
+    返回 (是否已提交, 每个操作的结果)，结果的 status 为 applied / failed / skipped（本身可以执行，但因其他操作失败未执行）
+    """
+    keys = {(doctor_id, appointment_date) for _, doctor_id, appointment_date, _ in operations}
+    schedules = {
+        (schedule.doctor_id, schedule.date): schedule
+        for schedule in DoctorSchedule.query.filter(db.tuple_(DoctorSchedule.doctor_id, DoctorSchedule.date).in_(keys))
+    }
+    # 时间段 -> 预约ID，本批次新预约的时间段记为 None
+    held = {
+        (doctor_id, appointment_date, appointment_period): appointment_id
+        for appointment_id, doctor_id, appointment_date, appointment_period in db.session.query(
+            Appointment.id, Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_period
+        ).filter(Appointment.user_id == user_id, db.tuple_(Appointment.doctor_id, Appointment.appointment_date).in_(keys))
+    }
+
+    counts = {}  # 时间段 -> 模拟执行后的已预约人数
+    deltas = {}  # 时间段 -> 已预约人数的净变化
+    deletes = []  # (操作序号, 预约ID)
+    inserts = []  # 时间段
+    insert_index = []  # 与 inserts 对应的操作序号
+    results = []
+    for index, (action, doctor_id, appointment_date, appointment_period) in enumerate(operations):
+        slot = (doctor_id, appointment_date, appointment_period)
+        schedule = schedules.get((doctor_id, appointment_date))
+        result = {'index': index, 'action': action, 'status': 'failed'}
+        results.append(result)
+        if schedule is not None and slot not in counts:
+            counts[slot] = schedule.morning_booked if appointment_period == '上午' else schedule.afternoon_booked
+        if action == 'cancel':
+            if held.get(slot) is None:
+                result['error'] = 'Appointment not found'
+                continue
+            deletes.append((index, held.pop(slot)))
+            if counts.get(slot, 0) > 0:
+                counts[slot] -= 1
+                deltas[slot] = deltas.get(slot, 0) - 1
         else:
-            schedule.afternoon_booked -= 1
+            if schedule is None:
+                result['error'] = 'Schedule not found for the given date'
+                continue
+            if slot in held:
+                result['error'] = 'Appointment already exists'
+                continue
+            limit = schedule.morning_limit if appointment_period == '上午' else schedule.afternoon_limit
+            if counts[slot] >= limit:
+                result['error'] = f'No available slots in the {"morning" if appointment_period == "上午" else "afternoon"}'
+                continue
+            held[slot] = None
+            counts[slot] += 1
+            deltas[slot] = deltas.get(slot, 0) + 1
+            inserts.append(slot)
+            insert_index.append(index)
+        result['status'] = 'ok'
+
+    if any(result['status'] == 'failed' for result in results):
+        db.session.rollback()
+        for result in results:
+            if result['status'] == 'ok':
+                result['status'] = 'skipped'
+        return False, results
+
+    try:
+        appointments, slots, promoted = _apply_batch_writes(user_id, deletes, inserts, deltas)
+        appointment_ids = [appointment.id for appointment in appointments]
         db.session.commit()
+    except BatchConflict as e:
+        db.session.rollback()
+        for index, (_, doctor_id, appointment_date, appointment_period) in enumerate(operations):
+            conflict = e.slot is None or e.slot == (doctor_id, appointment_date, appointment_period)
+            results[index]['status'] = 'failed' if conflict else 'skipped'
+            if conflict:
+                results[index]['error'] = e.message
+        return False, results
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for index, appointment_id in deletes:
+        results[index]['status'] = 'applied'
+        results[index]['appointment_id'] = appointment_id
+    for index, appointment_id in zip(insert_index, appointment_ids):
+        results[index]['status'] = 'applied'
+        results[index]['appointment_id'] = appointment_id
+    for (doctor_id, appointment_date, appointment_period), (booked, limit) in slots.items():
+        availability_cache.patch_slot(doctor_id, appointment_date, appointment_period, deltas[(doctor_id, appointment_date, appointment_period)])
+        _publish_slot(doctor_id, appointment_date, appointment_period, booked, limit)
+    for index, appointment_id in deletes + list(zip(insert_index, appointment_ids)):
+        _, doctor_id, appointment_date, appointment_period = operations[index]
+        _publish_doctor_appointment('cancel' if operations[index][0] == 'cancel' else 'appointment', appointment_id,
+                                    user_id, doctor_id, appointment_date, appointment_period)
+    for (doctor_id, appointment_date, appointment_period), appointments in promoted.items():
+        for appointment_id, promoted_user_id in appointments:
+            _publish_doctor_appointment('appointment', appointment_id, promoted_user_id, doctor_id, appointment_date, appointment_period)
+    return True, results
 
 def set_doctor_schedule(doctor_id, schedules):
-    """设置医生的空闲时间和每日最大接待病人数量"""
+    """设置医生的空闲时间和每日最大接待病人数量，上限超过小时段个数时抛出 ValueError，不写入任何一天"""
+    _run_write(_set_doctor_schedule_write, doctor_id, schedules)
+
+def _set_doctor_schedule_write(doctor_id, schedules):
+    slots = []  # 提交前记下每个时间段的新名额，提交后发布事件
+    department = None
     for schedule_data in schedules:
-        date = datetime.strptime(schedule_data['date'], "%m月%d日").date().replace(year=datetime.today().year)
+        date = parse_date_label(schedule_data['date'])
         schedule = DoctorSchedule.query.filter_by(doctor_id=doctor_id, date=date).first()
+        minutes = schedule_data.get('slot_minutes') or (schedule.slot_minutes if schedule else default_slot_minutes())
+        for key in ('morning_limit', 'afternoon_limit'):
+            check_limit(schedule_data[key], minutes, f'{key} for {schedule_data["date"]}')
         if not schedule:
+            if department is None:
+                department = db.session.query(Doctor.department).filter(Doctor.id == doctor_id).scalar()
             schedule = DoctorSchedule(
                 doctor_id=doctor_id,
                 date=date,
+                morning_booked=0,
                 morning_limit=schedule_data['morning_limit'],
-                afternoon_limit=schedule_data['afternoon_limit']
+                afternoon_booked=0,
+                afternoon_limit=schedule_data['afternoon_limit'],
+                slot_minutes=minutes,
+                department=department
             )
             db.session.add(schedule)
         else:
             schedule.morning_limit = schedule_data['morning_limit']
             schedule.afternoon_limit = schedule_data['afternoon_limit']
+            # 修改粒度前由调用方确认这一天没有分到小时段的预约
+            if schedule_data.get('slot_minutes'):
+                schedule.slot_minutes = schedule_data['slot_minutes']
+        slots.append((date, '上午', schedule.morning_booked, schedule.morning_limit))
+        slots.append((date, '下午', schedule.afternoon_booked, schedule.afternoon_limit))
+
+    def after_commit():
+        availability_cache.invalidate()
+        for date, period, booked, limit in slots:
+            _publish_slot(doctor_id, date, period, booked, limit)
+    return None, after_commit
+
+# 为预约窗口内的每一天、每个医生生成一行排班，上限取医生的每周模板，没有模板时取默认上限，
+# 小时段按默认粒度划分，上限不超过小时段个数
+# WITH 写在 INSERT 之后，sqlite3 驱动才能返回 rowcount
+_SCHEDULE_ROWS_SQL = """
+INSERT INTO doctor_schedule (doctor_id, date, morning_booked, morning_limit, afternoon_booked, afternoon_limit,
+                             slot_minutes, morning_slots, afternoon_slots, department)
+WITH RECURSIVE days(n, date) AS (
+    SELECT 0, date(:start)
+    UNION ALL
+    SELECT n + 1, date(:start, '+' || (n + 1) || ' days') FROM days WHERE n + 1 < :days
+)
+SELECT doctor.id, days.date, 0, min(COALESCE(template.morning_limit, :default_limit), :slot_count),
+       0, min(COALESCE(template.afternoon_limit, :default_limit), :slot_count), :slot_minutes, 0, 0, doctor.department
+FROM doctor
+CROSS JOIN days
+LEFT JOIN doctor_schedule_template AS template
+       ON template.doctor_id = doctor.id
+      AND template.weekday = (CAST(strftime('%w', days.date) AS INTEGER) + 6) % 7
+WHERE :doctor_id IS NULL OR doctor.id = :doctor_id
+"""
+
+# 补齐缺少的排班，已有的排班（包括医生单独修改过的）保持不变
+_MATERIALIZE_SQL = _SCHEDULE_ROWS_SQL + "ON CONFLICT (doctor_id, date) DO NOTHING"
+
+# 按新模板覆盖已有排班的上限，上限不超过这一天的小时段个数，也不低于已预约人数
+_APPLY_TEMPLATE_SQL = _SCHEDULE_ROWS_SQL + f"""ON CONFLICT (doctor_id, date) DO UPDATE SET
+    morning_limit = max(min(excluded.morning_limit, {PERIOD_MINUTES} / slot_minutes), morning_booked),
+    afternoon_limit = max(min(excluded.afternoon_limit, {PERIOD_MINUTES} / slot_minutes), afternoon_booked)"""
+
+_ARCHIVE_SQL = """
+INSERT INTO doctor_schedule_archive (doctor_id, date, morning_booked, morning_limit, afternoon_booked, afternoon_limit, archived_at)
+SELECT doctor_id, date, morning_booked, morning_limit, afternoon_booked, afternoon_limit, :now
+FROM doctor_schedule WHERE date < :cutoff
+"""
+
+def _schedule_rows_params(today, doctor_id=None):
+    minutes = default_slot_minutes()
+    return {'start': today.isoformat(), 'days': horizon_days(), 'default_limit': default_limit(), 'doctor_id': doctor_id,
+            'slot_minutes': minutes, 'slot_count': slot_count(minutes)}
+
+def materialize_schedules(today=None, doctor_id=None, archive=True):
+    """
+    按每周模板补齐预约窗口内所有医生（或指定医生）缺少的排班，
+    archive 为 True 时把保留期之前的排班移到归档表；在一个事务中完成，返回写入和归档的行数
+    """
+    today = today or datetime.today().date()
+    inserted = db.session.execute(db.text(_MATERIALIZE_SQL), _schedule_rows_params(today, doctor_id)).rowcount
+    archived = 0
+    if archive:
+        cutoff = today - timedelta(days=retention_days())
+        archived = db.session.execute(db.text(_ARCHIVE_SQL), {'cutoff': cutoff.isoformat(), 'now': datetime.now()}).rowcount
+        DoctorSchedule.query.filter(DoctorSchedule.date < cutoff).delete(synchronize_session=False)
+        # 已经过去的日期不会再有人取消，清理候补队列
+        WaitlistEntry.query.filter(WaitlistEntry.appointment_date < today).delete(synchronize_session=False)
     db.session.commit()
+    if inserted or archived:
+        availability_cache.invalidate()
+        event_broker.publish(AVAILABILITY_CHANNEL, 'refresh', {'doctor_id': doctor_id})
+    if doctor_id is None:
+        refresh_planner_stats()
+    return {'inserted': inserted, 'archived': archived}
+
+def refresh_planner_stats():
+    """更新查询规划器的统计信息（抽样 ANALYZE），让按科室、姓名筛选时选对索引"""
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('PRAGMA analysis_limit = 1000')
+            conn.exec_driver_sql('ANALYZE')
+
+def get_schedule_template(doctor_id):
+    """获取医生的每周排班模板，未设置时为默认上限"""
+    templates = {template.weekday: template for template in DoctorScheduleTemplate.query.filter_by(doctor_id=doctor_id)}
+    limit = default_limit()
+    return [{
+        'weekday': weekday,
+        'morning_limit': templates[weekday].morning_limit if weekday in templates else limit,
+        'afternoon_limit': templates[weekday].afternoon_limit if weekday in templates else limit
+    } for weekday in range(7)]
+
+def set_schedule_template(doctor_id, template):
+    """保存医生的每周排班模板，并按新模板更新预约窗口内的排班（上限不低于已预约人数）"""
+    for item in template:
+        db.session.merge(DoctorScheduleTemplate(doctor_id=doctor_id, weekday=item['weekday'],
+                                                morning_limit=item['morning_limit'], afternoon_limit=item['afternoon_limit']))
+    db.session.flush()
+    db.session.execute(db.text(_APPLY_TEMPLATE_SQL), _schedule_rows_params(datetime.today().date(), doctor_id))
+    db.session.commit()
+    availability_cache.invalidate()
+    event_broker.publish(AVAILABILITY_CHANNEL, 'refresh', {'doctor_id': doctor_id})
 
 def get_doctor_appointments(doctor_id, date):
     """获取医生在指定日期的预约情况"""
@@ -145,7 +1051,7 @@ def get_doctor_appointments(doctor_id, date):
 
 def create_user(name, gender, id_card, phone_number, address, emergency_contact, password):
     """创建用户"""
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
     user = User(name=name, gender=gender, id=id_card, phone_number=phone_number, address=address, emergency_contact=emergency_contact, password_hash=password_hash)
     db.session.add(user)
     db.session.commit()
@@ -153,26 +1059,29 @@ def create_user(name, gender, id_card, phone_number, address, emergency_contact,
 
 def create_doctor(doctor_id, name, gender, title, department, office_number, phone, password, flag):
     """创建医生"""
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
     doctor = Doctor(id=doctor_id, name=name, gender=gender, title=title, department=department, office_number=office_number, phone=phone, password_hash=password_hash, flag=flag)
     db.session.add(doctor)
     db.session.commit()
-    today = datetime.today().date()
-    schedule = [{'date': (today + timedelta(days=i)).strftime("%m月%d日"), 'morning_limit': 10, 'afternoon_limit': 10} for i in range(3)]
-    set_doctor_schedule(doctor_id, schedule)
+    # 按默认上限生成预约窗口内的排班
+    materialize_schedules(doctor_id=doctor_id, archive=False)
     return doctor
 
 def delete_doctor(doctor_id):
     """删除医生"""
     doctor = Doctor.query.get(doctor_id)
     if doctor:
-        # 删除医生的预约管理时间表
+        # 删除医生的预约管理时间表和每周模板
         DoctorSchedule.query.filter_by(doctor_id=doctor_id).delete()
+        DoctorScheduleTemplate.query.filter_by(doctor_id=doctor_id).delete()
+        WaitlistEntry.query.filter_by(doctor_id=doctor_id).delete()
         
         # 删除这个医生的预约记录
         Appointment.query.filter_by(doctor_id=doctor_id).delete()
         db.session.delete(doctor)
         db.session.commit()
+        availability_cache.invalidate()
+        event_broker.publish(AVAILABILITY_CHANNEL, 'refresh', {'doctor_id': doctor_id})
         return True
     return False
 
@@ -181,26 +1090,44 @@ def delete_user(user_id):
     """删除用户"""
     user = User.query.get(user_id)
     if user:
-        # 删除用户的预约记录
+        # 删除用户的候补记录和预约记录，并在同一个事务中释放对应的名额；有人候补的时间段直接转给队首
+        WaitlistEntry.query.filter_by(user_id=user_id).delete()
+        deleted = db.session.query(Appointment.id, Appointment.doctor_id, Appointment.appointment_date,
+                                   Appointment.appointment_period, Appointment.slot_offset).filter(Appointment.user_id == user_id).all()
         Appointment.query.filter_by(user_id=user_id).delete()
+        promoted = []
+        released = {}  # 时间段 -> 释放后的 (已预约人数, 上限)
+        for _, *slot, slot_offset in deleted:
+            appointments = _promote_waitlist(*slot, slot_offset)
+            if appointments:
+                promoted.extend((appointment_id, promoted_user_id, *slot) for appointment_id, promoted_user_id in appointments)
+            else:
+                row = update_doctor_schedule_on_cancel(*slot, slot_offset)
+                if row is not None:
+                    released[tuple(slot)] = tuple(row)
+        name, gender = user.name, user.gender
         db.session.delete(user)
         db.session.commit()
+        # 和取消预约一样通知可预约情况的订阅者、准入控制和医生
+        if deleted:
+            availability_cache.invalidate()
+        for slot, (booked, limit) in released.items():
+            _publish_slot(*slot, booked, limit)
+        for appointment_id, *slot, _ in deleted:
+            _publish_doctor_appointment('cancel', appointment_id, user_id, *slot, user=(name, gender))
+        for appointment in promoted:
+            _publish_doctor_appointment('appointment', *appointment)
         return True
     return False
 
 # 删除预约
 def delete_appointment(appointment_id):
-    """删除预约"""
-    appointment = Appointment.query.get(appointment_id)
-    if appointment:
-        db.session.delete(appointment)
-        db.session.commit()
-        return True
-    return False
+    """删除预约，和用户取消预约一样释放名额"""
+    return cancel_appointment(appointment_id)
 
 def create_admin(username, password):
     """创建管理员"""
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
     admin = Admin(username=username, password_hash=password_hash)
     db.session.add(admin)
     db.session.commit()
@@ -218,6 +1145,90 @@ def get_all_appointments():
     """获取所有预约信息"""
     return Appointment.query.all()
 
+def get_users_page(after_id=None, limit=None):
+    """按身份证号顺序分页获取用户信息，只查询需要的列
+
+    返回 (身份证号, 姓名, 性别, 住址, 电话号码, 紧急联系人) 元组列表。
+    """
+    query = db.session.query(User.id, User.name, User.gender, User.address, User.phone_number, User.emergency_contact)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    query = query.order_by(User.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def get_doctors_page(after_id=None, limit=None):
+    """按工号顺序分页获取医生信息，只查询需要的列
+
+    返回 (工号, 姓名, 性别, 职称, 科室, 办公室, 电话, 头像哈希, 权限) 元组列表，不读取头像数据。
+    """
+    query = db.session.query(
+        Doctor.id, Doctor.name, Doctor.gender, Doctor.title, Doctor.department, Doctor.office_number, Doctor.phone, Doctor.avatar_hash, Doctor.flag
+    )
+    if after_id is not None:
+        query = query.filter(Doctor.id > after_id)
+    query = query.order_by(Doctor.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def iter_in_batches(fetch_page, batch_size=1000):
+    """按键集分页逐批读取，逐行产出
+
+    fetch_page(after_id, limit) 返回按第一列排序的一页元组，内存中最多只有一批数据。
+    """
+    after_id = None
+    while True:
+        rows = fetch_page(after_id, batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+def _paginate_appointments(query, after_id=None, limit=None, date_from=None, date_to=None):
+    """给预约查询加上日期范围过滤和按预约ID的键集分页"""
+    if date_from is not None:
+        query = query.filter(Appointment.appointment_date >= date_from)
+    if date_to is not None:
+        query = query.filter(Appointment.appointment_date <= date_to)
+    if after_id is not None:
+        query = query.filter(Appointment.id > after_id)
+    query = query.order_by(Appointment.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def get_appointments_page(after_id=None, limit=None, date_from=None, date_to=None):
+    """联表获取预约信息及用户、医生姓名（一条查询）
+
+    返回 (预约ID, 用户姓名, 医生姓名, 预约日期, 预约时间段) 元组列表。
+    """
+    query = db.session.query(
+        Appointment.id, User.name, Doctor.name, Appointment.appointment_date, Appointment.appointment_period
+    ).outerjoin(User, User.id == Appointment.user_id).outerjoin(Doctor, Doctor.id == Appointment.doctor_id)
+    return _paginate_appointments(query, after_id, limit, date_from, date_to)
+
+def get_doctor_appointments_page(doctor_id, after_id=None, limit=None, date_from=None, date_to=None):
+    """联表获取医生的预约信息及用户姓名、性别（一条查询）
+
+    返回 (预约ID, 用户身份证号, 用户姓名, 用户性别, 预约日期, 预约时间段, 小时段) 元组列表。
+    """
+    query = db.session.query(
+        Appointment.id, Appointment.user_id, User.name, User.gender, Appointment.appointment_date, Appointment.appointment_period,
+        Appointment.slot_offset
+    ).outerjoin(User, User.id == Appointment.user_id).filter(Appointment.doctor_id == doctor_id)
+    return _paginate_appointments(query, after_id, limit, date_from, date_to)
+
+def check_account_password(account, password):
+    """校验用户、医生或管理员的密码，成功且哈希成本已过时时顺便升级哈希"""
+    if not verify_password(account.password_hash, password):
+        return False
+    if needs_rehash(account.password_hash):
+        account.password_hash = hash_password(password)
+        db.session.commit()
+    return True
+
 def get_user_by_identity(identity):
     """根据身份证号或电话号码获取用户"""
     return User.query.filter((User.id == identity) | (User.phone_number == identity)).first()
@@ -237,6 +1248,66 @@ def create_notification(doctor_id, message):
     db.session.commit()
     return notification
 
+# 头像缩略图的最大边长（像素）和未安装 Pillow 时允许直接保存的最大字节数
+AVATAR_SIZE = 256
+AVATAR_MAX_BYTES = 512 * 1024
+
+def make_avatar_thumbnail(data):
+    """把上传的图片缩小为缩略图，返回 (图片数据, MIME 类型)
+
+    安装了 Pillow 时统一缩放并转成 PNG（CMYK 等 PNG 不支持的模式先转成 RGB/RGBA）；
+    未安装时原样保存，超过 AVATAR_MAX_BYTES 则抛出 ValueError。
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        if len(data) > AVATAR_MAX_BYTES:
+            raise ValueError(f'avatar must be smaller than {AVATAR_MAX_BYTES} bytes')
+        if data.startswith(b'\x89PNG'):
+            return data, 'image/png'
+        if data.startswith(b'\xff\xd8'):
+            return data, 'image/jpeg'
+        if data.startswith((b'GIF87a', b'GIF89a')):
+            return data, 'image/gif'
+        raise ValueError('avatar must be a PNG, JPEG or GIF image')
+    try:
+        image = Image.open(io.BytesIO(data))
+        transparent = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+        image.thumbnail((AVATAR_SIZE, AVATAR_SIZE))
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+    except Exception:
+        raise ValueError('avatar is not a valid image')
+    return output.getvalue(), 'image/png'
+
+def set_doctor_avatar(doctor_id, data):
+    """保存医生头像缩略图及其哈希，医生不存在时返回 None"""
+    doctor = Doctor.query.get(doctor_id)
+    if not doctor:
+        return None
+    thumbnail, mimetype = make_avatar_thumbnail(data)
+    doctor.avatar = thumbnail
+    doctor.avatar_mimetype = mimetype
+    doctor.avatar_hash = hashlib.sha256(thumbnail).hexdigest()
+    doctor.avatar_updated_at = datetime.utcnow().replace(microsecond=0)
+    db.session.commit()
+    return doctor
+
+def get_doctor_avatar_meta(doctor_id):
+    """获取头像的 (哈希, MIME 类型, 更新时间)，不读取头像数据；医生不存在时返回 None"""
+    return db.session.query(Doctor.avatar_hash, Doctor.avatar_mimetype, Doctor.avatar_updated_at).filter(Doctor.id == doctor_id).first()
+
+def get_doctor_avatar_data(doctor_id):
+    """读取头像数据"""
+    return db.session.query(Doctor.avatar).filter(Doctor.id == doctor_id).scalar()
+
+def set_doctor_department(doctor, department):
+    """修改医生的科室，排班中冗余的科室（ix_doctor_schedule_department_open 的索引列）在同一个事务中一起修改，不提交"""
+    if doctor.department != department:
+        DoctorSchedule.query.filter_by(doctor_id=doctor.id).update({'department': department}, synchronize_session=False)
+        doctor.department = department
+
 def update_doctor_info_by_admin(doctor_id, name, gender, title, department, office_number, phone, flag,password=None):
     """管理员修改医生信息"""
     doctor = Doctor.query.get(doctor_id)
@@ -244,13 +1315,14 @@ def update_doctor_info_by_admin(doctor_id, name, gender, title, department, offi
         doctor.name = name
         doctor.gender = gender
         doctor.title = title
-        doctor.department = department
+        set_doctor_department(doctor, department)
         doctor.office_number = office_number
         doctor.phone = phone
         doctor.flag = flag
         if password:
-            doctor.password_hash = generate_password_hash(password)
+            doctor.password_hash = hash_password(password)
         db.session.commit()
+        availability_cache.invalidate()
         return doctor
     return None
 
@@ -443,7 +1515,7 @@ def init_tables():
     ]
     if not Appointment.query.first():
         for appointment in initial_appointments:
-            appointment_date = datetime.strptime(appointment['appointment_date'], "%m月%d日").date().replace(year=datetime.today().year)
+            appointment_date = parse_date_label(appointment['appointment_date'])
             book_doctor(
                 user_id=appointment['user_id'],
                 doctor_id=appointment['doctor_id'],
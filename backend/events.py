@@ -0,0 +1,100 @@
+"""进程内事件中转（Server-Sent Events）
+
+写入方调用 publish(channel, event, data)，事件只序列化一次，追加到该频道的环形缓冲区，
+然后唤醒等待中的订阅者。每个 SSE 连接用 stream() 读取自己游标之后的事件：
+  - 空闲的订阅者阻塞在条件变量上，不占用 CPU，每 heartbeat 秒发送一次注释行保持连接
+  - 事件 id 是频道内递增的序号，断线重连时浏览器带上 Last-Event-ID 即可补发缓冲区内的事件
+  - 落后太多（事件已被挤出缓冲区）时发送 refresh 事件，前端应重新拉取完整数据
+事件只在本进程内中转，多进程部署时订阅者只能收到同一进程内的写入。
+"""
+import json
+import threading
+from collections import deque
+from itertools import islice
+
+
+class _Channel:
+    """一个频道：环形缓冲区 + 条件变量"""
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)  # (序号, 已格式化的 SSE 文本)
+        self.seq = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+
+class EventBroker:
+    """按频道向所有订阅者广播事件"""
+
+    def __init__(self, buffer_size=1024, heartbeat=15.0):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.published = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, name, create=True):
+        channel = self._channels.get(name)
+        if channel is None and create:
+            with self._lock:
+                channel = self._channels.setdefault(name, _Channel(self.buffer_size))
+        return channel
+
+    def has_subscribers(self, name):
+        """频道当前是否有订阅者，没有时发布方可以跳过准备事件数据"""
+        channel = self._channels.get(name)
+        return channel is not None and channel.subscribers > 0
+
+    def publish(self, name, event, data):
+        """向频道发布一个事件；频道从未被订阅过时直接丢弃"""
+        channel = self._channel(name, create=False)
+        if channel is None:
+            return
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with channel.condition:
+            channel.seq += 1
+            channel.events.append((channel.seq, f'id: {channel.seq}\nevent: {event}\ndata: {payload}\n\n'))
+            channel.condition.notify_all()
+        self.published += 1
+
+    def stream(self, name, last_event_id=None):
+        """
+        生成频道的 SSE 文本；last_event_id 为客户端已收到的最后一个事件 id
+        生成器被关闭（客户端断开）时自动取消订阅
+        """
+        channel = self._channel(name)
+        with channel.condition:
+            channel.subscribers += 1
+            cursor = channel.seq if last_event_id is None or last_event_id > channel.seq else last_event_id
+        try:
+            yield f'retry: 3000\n: subscribed to {name}\n\n'
+            while True:
+                with channel.condition:
+                    if cursor == channel.seq:
+                        channel.condition.wait(self.heartbeat)
+                    missed = channel.seq - cursor
+                    if missed > len(channel.events):
+                        # 需要的事件已被挤出缓冲区
+                        pending = None
+                    else:
+                        pending = [text for _, text in islice(channel.events, len(channel.events) - missed, None)]
+                    cursor = channel.seq
+                if pending is None:
+                    yield f'id: {cursor}\nevent: refresh\ndata: {{}}\n\n'
+                elif pending:
+                    yield ''.join(pending)
+                else:
+                    yield ': ping\n\n'
+        finally:
+            with channel.condition:
+                channel.subscribers -= 1
+
+    def stats(self):
+        """返回每个频道的订阅者数和总发布事件数"""
+        with self._lock:
+            channels = list(self._channels.items())
+        return {
+            'published': self.published,
+            'subscribers': sum(channel.subscribers for _, channel in channels),
+            'channels': {name: channel.subscribers for name, channel in channels if channel.subscribers},
+        }
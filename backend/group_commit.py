@@ -0,0 +1,163 @@
+"""预约写入的组提交
+
+SQLite 每次提交都要写日志（synchronous=FULL 或回滚日志模式下还要 fsync），
+并发预约时每个请求各自提交，吞吐受每秒能完成的提交次数限制，还要互相等写锁。
+开启组提交后，预约、取消和修改排班不再由请求线程各自提交，而是交给一个专门的写线程：
+  - 写线程拿到第一个操作后，再等待最多 GROUP_COMMIT_WINDOW_MS 毫秒收集其他请求的操作（最多 GROUP_COMMIT_MAX_BATCH 个）
+  - 整批在一个事务中执行，每个操作在自己的保存点中执行：名额检查仍是各自带条件的 UPDATE，
+    某个操作失败（如重复预约）只回滚它自己的保存点，不影响同一批的其他操作
+  - 整批只提交一次，提交后按顺序执行各操作的后续动作（更新缓存、发布事件），再把结果交还给各自的请求线程
+写操作函数的约定：在当前会话中写入但不提交，返回 (结果, 提交后执行的函数或 None)。
+未开启时同样的函数在请求线程中执行并立即提交，行为与原来相同。
+
+配置项可以写在 app.config 中，未设置时从同名环境变量读取：
+    GROUP_COMMIT              设为 1 时启用；默认不启用
+    GROUP_COMMIT_WINDOW_MS    收集一批操作的最长等待时间（毫秒），默认 2；为 0 时只合并已经在排队的操作
+    GROUP_COMMIT_MAX_BATCH    每批最多的操作数，默认 64
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy import text
+
+_STOP = object()
+
+logger = logging.getLogger('hospital.group_commit')
+
+
+class GroupCommitWriter:
+    """收集写操作、按批在一个事务中执行的写线程"""
+
+    def __init__(self):
+        self.enabled = False
+        self.window = 0.002
+        self.max_batch = 64
+        self.batches = 0
+        self.operations = 0
+        self.failed_batches = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._app = None
+        self._db = None
+
+    def start(self, app, db):
+        """启动写线程；已经为同一个应用启动时不做任何事，为其他应用启动过时先停止原来的写线程"""
+        if self._thread is not None:
+            if self._app is app and self._db is db:
+                return
+            self.stop()
+        self._app = app
+        self._db = db
+        self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self):
+        """处理完已提交的操作后停止写线程，之后的写操作回到各自提交"""
+        if self._thread is None:
+            return
+        self.enabled = False
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, write, *args):
+        """把写操作交给写线程，等待它所在的批次提交后返回结果（或抛出它的异常）"""
+        future = Future()
+        self._queue.put((write, args, future))
+        return future.result()
+
+    def _collect(self, first):
+        """以 first 开头收集一批操作，返回 (批次, 是否收到停止信号)"""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        with self._app.app_context():
+            session = self._db.session
+            # 提交后对象不过期：结果对象会交给请求线程读取，不能再回到写线程的会话中加载
+            session().expire_on_commit = False
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch, stop = self._collect(item)
+                self._apply(session, batch)
+                if stop:
+                    break
+
+    def _apply(self, session, batch):
+        """在一个事务中执行一批操作并提交，然后完成各操作的 Future"""
+        outcomes = []
+        try:
+            # pysqlite 不会为 SAVEPOINT 自动开启事务，最外层的保存点释放时就会提交；
+            # 先显式开启事务（同时拿到写锁，避免批次执行到一半才等锁），保存点都嵌套在其中
+            session.execute(text('BEGIN IMMEDIATE'))
+            for write, args, future in batch:
+                try:
+                    with session.begin_nested():
+                        outcomes.append((future, write(*args), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            session.close()
+            self.failed_batches += 1
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.operations += len(batch)
+        for future, outcome, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+                continue
+            result, after_commit = outcome
+            if after_commit is not None:
+                try:
+                    after_commit()
+                except Exception:
+                    # 已经提交，后续动作失败不影响操作结果，也不能让写线程退出
+                    logger.exception('after-commit callback failed')
+            future.set_result(result)
+        # 结果对象与会话分离后交给请求线程；提交后的缓存更新、事件发布中的查询也在这里结束
+        session.close()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'batches': self.batches,
+            'operations': self.operations,
+            'failed_batches': self.failed_batches,
+            'average_batch': round(self.operations / self.batches, 2) if self.batches else 0,
+            'queued': self._queue.qsize(),
+        }
+
+
+group_writer = GroupCommitWriter()
+
+
+def init_group_commit(app, db):
+    """按配置启动组提交的写线程，返回是否启用"""
+    setting = app.config.get('GROUP_COMMIT', os.environ.get('GROUP_COMMIT'))
+    if setting not in (True, '1'):
+        return False
+    group_writer.window = float(app.config.get('GROUP_COMMIT_WINDOW_MS', os.environ.get('GROUP_COMMIT_WINDOW_MS', 2))) / 1000
+    group_writer.max_batch = int(app.config.get('GROUP_COMMIT_MAX_BATCH', os.environ.get('GROUP_COMMIT_MAX_BATCH', 64)))
+    group_writer.start(app, db)
+    return True
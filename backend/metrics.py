@@ -0,0 +1,181 @@
+"""按接口统计请求耗时和 SQL 执行情况
+
+启用后，在 Flask 请求钩子和 SQLAlchemy 的 before/after_cursor_execute 事件上记录每个请求的：
+  - 执行的 SQL 语句数和 SQL 总耗时
+  - 处理耗时（before_request 到 after_request，包含 SQL）；流式响应的查询在生成响应体时才执行，
+    统计到响应结束（WSGI close）为止，这时响应头已经发出，不加 Server-Timing 头
+普通响应中加入 Server-Timing 头（浏览器开发者工具的 Timing 面板可以直接显示），
+按接口累计成直方图，由 /admin/metrics 以 Prometheus 文本格式输出。
+超过阈值的语句连同绑定参数写入 slow_query 日志。
+
+配置项可以写在 app.config 中，未设置时从同名环境变量读取：
+    REQUEST_METRICS      设为 1 时启用；默认不启用，不注册任何钩子和事件，没有额外开销
+    SLOW_QUERY_MS        慢查询阈值（毫秒），默认 100
+    SLOW_QUERY_LOG       慢查询日志文件路径，不设置时写到标准错误
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+# 直方图的桶上界（秒 / 条）
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+MAX_LOGGED_PARAMS = 1000  # 慢查询日志中参数的最大字符数，executemany 的参数可能很长
+
+# 本请求的计数器 [开始时间, 语句数, SQL 耗时] 存在 WSGI environ 中而不是 g 中：
+# 流式响应的生成器在 stream_with_context 恢复的请求上下文中执行，request 对象不变，但 g 是新的
+ENVIRON_KEY = 'hospital.request_metrics'
+
+slow_query_logger = logging.getLogger('hospital.slow_query')
+
+
+class Histogram:
+    """一组按标签区分的累积直方图"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # 标签 -> [各桶计数..., 总和, 总数]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-1]}')
+        return lines
+
+
+class RequestMetrics:
+    """按 (接口, 方法) 累计的请求指标"""
+
+    LABELS = ('endpoint', 'method')
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_seconds = 0.1
+        self.slow_queries = 0
+        self.responses = {}  # (接口, 方法, 状态码) -> 次数
+        self.handler_seconds = Histogram(
+            'hospital_request_duration_seconds', 'Request handler time including SQL', DURATION_BUCKETS)
+        self.sql_seconds = Histogram(
+            'hospital_request_sql_duration_seconds', 'Total SQL time per request', DURATION_BUCKETS)
+        self.sql_statements = Histogram(
+            'hospital_request_sql_statements', 'SQL statements executed per request', STATEMENT_BUCKETS)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, handler_seconds, sql_seconds, statements):
+        labels = (endpoint, method)
+        with self._lock:
+            self.handler_seconds.observe(labels, handler_seconds)
+            self.sql_seconds.observe(labels, sql_seconds)
+            self.sql_statements.observe(labels, statements)
+            key = (endpoint, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            lines = ['# HELP hospital_requests_total Responses by endpoint, method and status',
+                     '# TYPE hospital_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append(f'hospital_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for histogram in (self.handler_seconds, self.sql_seconds, self.sql_statements):
+                lines.extend(histogram.render(self.LABELS))
+            lines += ['# HELP hospital_slow_queries_total SQL statements slower than SLOW_QUERY_MS',
+                      '# TYPE hospital_slow_queries_total counter',
+                      f'hospital_slow_queries_total {self.slow_queries}']
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 开始时间记在本条语句的执行上下文上，比 conn.info 上的栈便宜，出错时也不需要清理
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    counters = request.environ.get(ENVIRON_KEY) if has_request_context() else None
+    if counters is not None:
+        counters[1] += 1
+        counters[2] += elapsed
+    if elapsed >= request_metrics.slow_query_seconds:
+        request_metrics.slow_queries += 1
+        slow_query_logger.warning('%.1fms %s params=%.*s', elapsed * 1000, ' '.join(statement.split()),
+                                  MAX_LOGGED_PARAMS, repr(parameters))
+
+
+def _before_request():
+    request.environ[ENVIRON_KEY] = [time.perf_counter(), 0, 0.0]
+
+
+def _finish(counters, endpoint, method, status):
+    """记录一个请求的统计，返回 (处理耗时, SQL 耗时, 语句数)"""
+    started, statements, sql_seconds = counters
+    handler_seconds = time.perf_counter() - started
+    request_metrics.record(endpoint, method, status, handler_seconds, sql_seconds, statements)
+    return handler_seconds, sql_seconds, statements
+
+
+def _after_request(response):
+    counters = request.environ.get(ENVIRON_KEY)
+    if counters is None:
+        return response
+    endpoint, method = request.endpoint or 'unmatched', request.method
+    if response.is_streamed:
+        # 响应体的查询还没有执行，响应结束时再记录；这时可能已经没有请求上下文，直接用 environ
+        environ = request.environ
+        response.call_on_close(lambda: _finish(environ.pop(ENVIRON_KEY, counters), endpoint, method, response.status_code))
+        return response
+    del request.environ[ENVIRON_KEY]
+    handler_seconds, sql_seconds, statements = _finish(counters, endpoint, method, response.status_code)
+    response.headers.add('Server-Timing', f'sql;dur={sql_seconds * 1000:.2f};desc="{statements} statements", '
+                                          f'app;dur={handler_seconds * 1000:.2f}')
+    return response
+
+
+def init_metrics(app, db):
+    """按配置在应用和数据库引擎上注册统计钩子，返回是否启用"""
+    setting = app.config.get('REQUEST_METRICS', os.environ.get('REQUEST_METRICS'))
+    if setting not in (True, '1'):
+        return False
+    request_metrics.enabled = True
+    request_metrics.slow_query_seconds = float(app.config.get('SLOW_QUERY_MS', os.environ.get('SLOW_QUERY_MS', 100))) / 1000
+    log_path = app.config.get('SLOW_QUERY_LOG', os.environ.get('SLOW_QUERY_LOG'))
+    if not slow_query_logger.handlers:
+        handler = logging.FileHandler(log_path, encoding='utf-8') if log_path else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s slow query %(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.propagate = False
+
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    return True
@@ -0,0 +1,265 @@
+"""数据库版本迁移
+
+db.create_all() 只会创建缺失的表，不会修改已有的表，所以已有的 instance/hospital.db
+需要通过这里的迁移原地升级。当前结构版本记录在 SQLite 的 PRAGMA user_version 中，
+upgrade() 按顺序执行所有高于当前版本的迁移，每个迁移在一个事务中完成。
+
+每个迁移都要能在已经是新结构的数据库上重复执行（例如 create_all 刚建好的新库）。
+
+命令行用法（在 backend 目录下）：
+    python migrations.py instance/hospital.db
+"""
+import hashlib
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from time_slots import MAX_SLOTS, PERIOD_MINUTES, default_slot_minutes
+
+
+def _columns(conn, table):
+    """返回表的列名集合"""
+    return {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+
+
+def _add_doctor_flag(conn):
+    """医生表增加 flag 权限列（旧库中没有这一列）"""
+    if 'flag' not in _columns(conn, 'doctor'):
+        conn.execute(text('ALTER TABLE doctor ADD COLUMN flag BOOLEAN NOT NULL DEFAULT 0'))
+
+
+def _add_indexes(conn):
+    """为高频查询建立索引，并加上排班和预约的唯一约束
+
+    建唯一索引前先清理重复数据：重复的排班保留ID最小的一条，
+    重复的预约保留最早的一条。旧版本每次重复预约都会累加已预约人数，
+    所以受影响的排班按剩下的预约重新计算上午、下午的已预约人数。
+    """
+    affected = conn.execute(text(
+        'SELECT doctor_id, date FROM doctor_schedule WHERE id NOT IN '
+        '(SELECT MIN(id) FROM doctor_schedule GROUP BY doctor_id, date) '
+        'UNION SELECT doctor_id, appointment_date FROM appointment WHERE id NOT IN '
+        '(SELECT MIN(id) FROM appointment GROUP BY user_id, doctor_id, appointment_date, appointment_period)'
+    )).fetchall()
+    conn.execute(text(
+        'DELETE FROM doctor_schedule WHERE id NOT IN '
+        '(SELECT MIN(id) FROM doctor_schedule GROUP BY doctor_id, date)'
+    ))
+    conn.execute(text(
+        'DELETE FROM appointment WHERE id NOT IN '
+        '(SELECT MIN(id) FROM appointment GROUP BY user_id, doctor_id, appointment_date, appointment_period)'
+    ))
+    if affected:
+        conn.execute(text(
+            'UPDATE doctor_schedule SET '
+            "morning_booked = (SELECT COUNT(*) FROM appointment a WHERE a.doctor_id = doctor_schedule.doctor_id "
+            "AND a.appointment_date = doctor_schedule.date AND a.appointment_period = '上午'), "
+            "afternoon_booked = (SELECT COUNT(*) FROM appointment a WHERE a.doctor_id = doctor_schedule.doctor_id "
+            "AND a.appointment_date = doctor_schedule.date AND a.appointment_period = '下午') "
+            'WHERE doctor_id = :doctor_id AND date = :date'
+        ), [{'doctor_id': doctor_id, 'date': date} for doctor_id, date in affected])
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_doctor_department ON doctor (department)'))
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_doctor_schedule_doctor_date ON doctor_schedule (doctor_id, date)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_doctor_schedule_date ON doctor_schedule (date)'))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_appointment_user_slot '
+        'ON appointment (user_id, doctor_id, appointment_date, appointment_period)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_appointment_doctor_slot '
+        'ON appointment (doctor_id, appointment_date, appointment_period)'
+    ))
+
+
+def _add_avatar_metadata(conn):
+    """医生表增加头像哈希、类型和更新时间列，并为已有头像补算哈希"""
+    columns = _columns(conn, 'doctor')
+    if 'avatar_hash' not in columns:
+        conn.execute(text('ALTER TABLE doctor ADD COLUMN avatar_hash VARCHAR(64)'))
+    if 'avatar_mimetype' not in columns:
+        conn.execute(text('ALTER TABLE doctor ADD COLUMN avatar_mimetype VARCHAR(32)'))
+    if 'avatar_updated_at' not in columns:
+        conn.execute(text('ALTER TABLE doctor ADD COLUMN avatar_updated_at DATETIME'))
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.000000')  # 与 SQLAlchemy 的 DateTime 存储格式一致
+    rows = conn.execute(text('SELECT id, avatar FROM doctor WHERE avatar IS NOT NULL AND avatar_hash IS NULL')).fetchall()
+    for doctor_id, avatar in rows:
+        conn.execute(
+            text('UPDATE doctor SET avatar_hash = :hash, avatar_mimetype = :mimetype, avatar_updated_at = :now WHERE id = :id'),
+            {'hash': hashlib.sha256(avatar).hexdigest(), 'mimetype': 'image/png' if avatar.startswith(b'\x89PNG') else 'image/jpeg',
+             'now': now, 'id': doctor_id}
+        )
+
+
+def _add_appointment_change_log(conn):
+    """增加预约变更日志表和写入它的触发器，以及按日期统计预约数用的索引（见 reconcile.py）"""
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS appointment_change '
+        '(id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, appointment_date DATE NOT NULL)'
+    ))
+    conn.execute(text(
+        'CREATE TRIGGER IF NOT EXISTS trg_appointment_insert_change AFTER INSERT ON appointment BEGIN '
+        'INSERT INTO appointment_change (appointment_date) VALUES (NEW.appointment_date); END'
+    ))
+    conn.execute(text(
+        'CREATE TRIGGER IF NOT EXISTS trg_appointment_delete_change AFTER DELETE ON appointment BEGIN '
+        'INSERT INTO appointment_change (appointment_date) VALUES (OLD.appointment_date); END'
+    ))
+    conn.execute(text(
+        'CREATE TRIGGER IF NOT EXISTS trg_appointment_update_change '
+        'AFTER UPDATE OF doctor_id, appointment_date, appointment_period ON appointment BEGIN '
+        'INSERT INTO appointment_change (appointment_date) VALUES (OLD.appointment_date); '
+        'INSERT INTO appointment_change (appointment_date) VALUES (NEW.appointment_date); END'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_appointment_date_slot '
+        'ON appointment (appointment_date, doctor_id, appointment_period)'
+    ))
+
+
+def _add_availability_search_indexes(conn):
+    """增加按职称、姓名前缀筛选医生的索引，排班的日期索引换成包含名额列的覆盖索引"""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_doctor_title ON doctor (title)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_doctor_name ON doctor (name)'))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_doctor_schedule_date_capacity ON doctor_schedule '
+        '(date, doctor_id, morning_booked, morning_limit, afternoon_booked, afternoon_limit)'
+    ))
+    # 新索引以 date 开头，原来的日期索引不再需要
+    conn.execute(text('DROP INDEX IF EXISTS ix_doctor_schedule_date'))
+    # 没有统计信息时查询规划器不知道科室、姓名条件的选择性，先抽样统计一次（之后由每天的排班生成任务更新）
+    conn.execute(text('PRAGMA analysis_limit = 1000'))
+    conn.execute(text('ANALYZE'))
+
+
+def _add_waitlist(conn):
+    """增加候补队列表（见 database.join_waitlist）"""
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS waitlist_entry ('
+        'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+        'user_id VARCHAR(18) NOT NULL, '
+        'doctor_id INTEGER NOT NULL, '
+        'appointment_date DATE NOT NULL, '
+        'appointment_period VARCHAR(10) NOT NULL, '
+        'created_at DATETIME NOT NULL, '
+        'FOREIGN KEY(user_id) REFERENCES user (id), '
+        'FOREIGN KEY(doctor_id) REFERENCES doctor (id))'
+    ))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_waitlist_user_slot '
+        'ON waitlist_entry (user_id, doctor_id, appointment_date, appointment_period)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_waitlist_slot_order '
+        'ON waitlist_entry (doctor_id, appointment_date, appointment_period, id)'
+    ))
+
+
+def _add_time_slots(conn):
+    """排班增加小时段粒度和占用位图，预约增加小时段（见 time_slots.py）
+
+    已有排班按默认粒度划分；上限或已预约人数超过小时段个数的排班改用能放下的最粗粒度。
+    已有预约按预约ID的顺序依次分到各自时间段的第 0、1、2…… 个小时段，放不下的（超过 MAX_SLOTS）保持为空，
+    再按分到的小时段重建位图。
+    """
+    minutes = default_slot_minutes()
+    columns = _columns(conn, 'doctor_schedule')
+    if 'slot_minutes' not in columns:
+        conn.execute(text(f'ALTER TABLE doctor_schedule ADD COLUMN slot_minutes INTEGER NOT NULL DEFAULT {int(minutes)}'))
+    for column in ('morning_slots', 'afternoon_slots'):
+        if column not in columns:
+            conn.execute(text(f'ALTER TABLE doctor_schedule ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'))
+    if 'slot_offset' not in _columns(conn, 'appointment'):
+        conn.execute(text('ALTER TABLE appointment ADD COLUMN slot_offset INTEGER'))
+
+    # 从粗到细，每个放不下的排班改用第一个放得下的粒度
+    finer = [m for m in range(minutes - 1, 0, -1) if PERIOD_MINUTES % m == 0 and PERIOD_MINUTES // m <= MAX_SLOTS]
+    for m in finer:
+        conn.execute(text(
+            'UPDATE doctor_schedule SET slot_minutes = :m '
+            'WHERE max(morning_limit, afternoon_limit, morning_booked, afternoon_booked) > :total / slot_minutes '
+            'AND max(morning_limit, afternoon_limit, morning_booked, afternoon_booked) <= :total / :m'
+        ), {'m': m, 'total': PERIOD_MINUTES})
+
+    conn.execute(text(
+        'UPDATE appointment SET slot_offset = ranked.n * s.slot_minutes '
+        'FROM (SELECT id, doctor_id, appointment_date, appointment_period, '
+        '      ROW_NUMBER() OVER (PARTITION BY doctor_id, appointment_date, appointment_period ORDER BY id) - 1 AS n '
+        '      FROM appointment WHERE slot_offset IS NULL) AS ranked '
+        'JOIN doctor_schedule AS s ON s.doctor_id = ranked.doctor_id AND s.date = ranked.appointment_date '
+        'WHERE appointment.id = ranked.id AND ranked.n < :total / s.slot_minutes '
+        # 只在新加的列上第一次分配，重复执行时不会和已有的小时段冲突
+        'AND NOT EXISTS (SELECT 1 FROM appointment AS a WHERE a.doctor_id = ranked.doctor_id '
+        '                AND a.appointment_date = ranked.appointment_date AND a.appointment_period = ranked.appointment_period '
+        '                AND a.slot_offset IS NOT NULL)'
+    ), {'total': PERIOD_MINUTES})
+    # 每个小时段只有一个预约，按位求和等于按位或
+    for column, period in (('morning_slots', '上午'), ('afternoon_slots', '下午')):
+        conn.execute(text(
+            f'UPDATE doctor_schedule SET {column} = COALESCE((SELECT SUM(1 << (a.slot_offset / doctor_schedule.slot_minutes)) '
+            'FROM appointment AS a WHERE a.doctor_id = doctor_schedule.doctor_id AND a.appointment_date = doctor_schedule.date '
+            'AND a.appointment_period = :period AND a.slot_offset IS NOT NULL), 0)'
+        ), {'period': period})
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_appointment_slot_time '
+        'ON appointment (doctor_id, appointment_date, appointment_period, slot_offset)'
+    ))
+
+
+def _add_schedule_department(conn):
+    """排班增加医生科室的冗余列，以及只包含还有名额的排班、按科室和日期排序的部分索引（按科室查找最早的空闲时间段）"""
+    if 'department' not in _columns(conn, 'doctor_schedule'):
+        conn.execute(text("ALTER TABLE doctor_schedule ADD COLUMN department VARCHAR(50) NOT NULL DEFAULT ''"))
+    conn.execute(text(
+        "UPDATE doctor_schedule SET department = COALESCE("
+        "(SELECT department FROM doctor WHERE doctor.id = doctor_schedule.doctor_id), '')"
+    ))
+    # 条件与 database.OPEN_SCHEDULE_SQL 相同
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_doctor_schedule_department_open ON doctor_schedule (department, date) '
+        'WHERE morning_booked < morning_limit OR afternoon_booked < afternoon_limit'
+    ))
+
+
+# (版本号, 说明, 迁移函数)，版本号必须递增
+MIGRATIONS = [
+    (1, 'add doctor.flag', _add_doctor_flag),
+    (2, 'add indexes and unique constraints', _add_indexes),
+    (3, 'add doctor avatar metadata', _add_avatar_metadata),
+    (4, 'add appointment change log for counter reconciliation', _add_appointment_change_log),
+    (5, 'add availability search indexes', _add_availability_search_indexes),
+    (6, 'add appointment waitlist', _add_waitlist),
+    (7, 'add time slots and occupancy bitmaps', _add_time_slots),
+    (8, 'add schedule department and open-schedule index', _add_schedule_department),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """返回数据库当前的结构版本"""
+    return conn.execute(text('PRAGMA user_version')).scalar()
+
+
+def upgrade(engine, log=print):
+    """把数据库升级到最新版本，返回执行过的迁移版本号列表"""
+    applied = []
+    with engine.connect() as conn:
+        current = get_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            # PRAGMA 不支持绑定参数，版本号是代码中的整数常量
+            conn.execute(text(f'PRAGMA user_version = {int(version)}'))
+        log(f'Migrated database to version {version}: {description}')
+        applied.append(version)
+    return applied
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    upgrade(create_engine(f'sqlite:///{sys.argv[1]}'))
@@ -0,0 +1,124 @@
+"""密码哈希与校验
+
+密码哈希是故意设计得很慢的 KDF 计算，放在请求线程里会在登录高峰时占满 worker。
+这里把哈希和校验交给一个有界的进程池执行，请求线程只等待结果，同进程的其他请求可以继续处理。
+
+子进程用 spawn 启动，会重新导入主模块和这个模块：这个模块在导入时不能有副作用（不创建应用、不启动线程），
+启动服务的脚本也要把创建应用等代码放在 if __name__ == '__main__' 中。
+进程池损坏（子进程异常退出）时丢弃并重建一次，仍然失败则改为在请求线程内计算，直到下次 configure。
+
+配置（环境变量）：
+    PASSWORD_HASH_METHOD   哈希算法和成本，werkzeug 格式，默认 pbkdf2:sha256:260000
+    PASSWORD_HASH_WORKERS  进程池大小，默认 min(CPU 核数, MAX_DEFAULT_WORKERS)；0 表示在请求线程内直接计算
+
+成本配置变化后，旧哈希会在用户下次登录成功时自动升级（见 needs_rehash）。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+_method = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+MAX_DEFAULT_WORKERS = 2  # 每个服务进程默认的哈希进程数，多 worker 部署时总数是它的倍数
+
+_workers = int(os.environ.get('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)))
+_executor = None
+_slots = None  # 限制同时排队的任务数，超出时请求线程等待
+_inline = False  # 进程池重建后仍然损坏时改为在请求线程内计算
+_lock = threading.Lock()
+
+logger = logging.getLogger('hospital.passwords')
+
+
+def configure(method=None, workers=None):
+    """修改哈希算法或进程池大小，已有的进程池会被关闭后按需重建"""
+    global _method, _workers, _executor, _inline
+    with _lock:
+        if method is not None:
+            _method = method
+        if workers is not None:
+            _workers = workers
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        _inline = False
+
+
+def _get_executor():
+    """返回 (进程池, 排队信号量)，首次调用时创建"""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            # 用 spawn 启动子进程，避免在多线程的服务进程中 fork
+            _executor = ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(_workers * 4)
+        return _executor, _slots
+
+
+def _discard(executor):
+    """丢弃已损坏的进程池，下次使用时重建"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(run, inline):
+    """run(进程池, 排队信号量) 在进程池中执行；进程池损坏时重建后重试一次，仍然失败则调用 inline() 在本线程计算"""
+    global _inline
+    if _workers <= 0 or _inline:
+        return inline()
+    for attempt in range(2):
+        executor, slots = _get_executor()
+        try:
+            return run(executor, slots)
+        except BrokenProcessPool:
+            logger.warning('password hash pool is broken, recreating it (attempt %d)', attempt + 1)
+            _discard(executor)
+    logger.error('password hash pool keeps breaking, hashing in request threads until reconfigured')
+    _inline = True
+    return inline()
+
+
+def _submit(fn, *args):
+    """在进程池中执行 fn(*args) 并等待结果；未启用进程池时直接执行"""
+    def run(executor, slots):
+        with slots:
+            return executor.submit(fn, *args).result()
+    return _run_in_pool(run, lambda: fn(*args))
+
+
+@lru_cache(maxsize=8)
+def _method_prefix(method):
+    """返回 method 生成的哈希中 '$' 之前的部分，例如 pbkdf2:sha256:260000（每种配置只计算一次）"""
+    return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+
+
+def hash_password(password):
+    """按当前配置的成本生成密码哈希"""
+    return _submit(generate_password_hash, password, _method)
+
+
+def hash_passwords(passwords):
+    """批量生成密码哈希，在进程池的所有进程上并行计算，按输入顺序返回"""
+    method = _method
+    chunksize = max(1, len(passwords) // (max(_workers, 1) * 4))
+    return _run_in_pool(
+        lambda executor, _: list(executor.map(generate_password_hash, passwords, [method] * len(passwords), chunksize=chunksize)),
+        lambda: [generate_password_hash(password, method) for password in passwords])
+
+
+def verify_password(password_hash, password):
+    """校验密码是否与哈希匹配"""
+    return _submit(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """哈希的算法或成本与当前配置不同时返回 True"""
+    return password_hash.split('$', 1)[0] != _method_prefix(_method)
@@ -0,0 +1,235 @@
+"""按需对部分请求做性能剖析，输出可直接生成火焰图的 collapsed-stack 文件
+
+管理员通过 POST /admin/profiler 开启：按比例抽取请求，或只剖析某一个接口，到期后自动关闭。
+被选中的请求在结束后写入一个文件，每行是 "根;...;叶 数值"，可以直接交给
+flamegraph.pl 或 speedscope 生成火焰图。两种方式：
+  - sample（默认）：后台线程每隔 PROFILE_SAMPLE_INTERVAL_MS 毫秒读取一次请求线程的调用栈，
+    数值为采样次数；开销小，但比采样间隔短的请求只有很少的样本
+  - trace：用 sys.setprofile 记录请求内的每次函数调用（包括 sqlite3 的 execute 等 C 函数），
+    数值为自身耗时（微秒）；结果精确，但被剖析的请求会慢好几倍
+开关状态保存在进程内，多进程部署时每个 worker 需要分别开启。
+
+配置项可以写在 app.config 中，未设置时从同名环境变量读取：
+    PROFILE_DIR                  剖析文件目录，默认 instance/profiles
+    PROFILE_MAX_CAPTURES         目录中最多保留的文件数，超出后删除最旧的，默认 100
+    PROFILE_SAMPLE_INTERVAL_MS   采样间隔（毫秒），默认 1
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+MODES = ('sample', 'trace')
+MAX_PROFILE_SECONDS = 3600  # 开启一次最多持续的时间
+
+_CAPTURE_NAME = re.compile(r'^[\w.-]+\.folded$')
+
+
+def _label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)})'
+
+
+def _collapse(frame):
+    """把调用栈转换成 collapsed-stack 格式的一行（根在前）"""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class _Sampler(threading.Thread):
+    """后台采样线程：有请求在被剖析时按间隔读取它们的调用栈，否则阻塞等待"""
+
+    def __init__(self, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.interval = interval
+        self.targets = {}  # 线程 id -> Counter
+        self._switch_interval = sys.getswitchinterval()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, thread_id):
+        counter = Counter()
+        with self._lock:
+            if not self.targets:
+                # 默认每 5ms 才切换一次 GIL，采样线程拿不到 GIL 就无法按间隔采样，剖析期间临时调小
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self.interval, self._switch_interval))
+            self.targets[thread_id] = counter
+        self._wake.set()
+        return counter
+
+    def remove(self, thread_id):
+        with self._lock:
+            if self.targets.pop(thread_id, None) is not None and not self.targets:
+                sys.setswitchinterval(self._switch_interval)
+
+    def run(self):
+        while True:
+            if not self.targets:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, counter in self.targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counter[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class _Tracer:
+    """sys.setprofile 回调：维护当前调用栈，函数返回时把自身耗时（微秒）累加到所在的栈上"""
+
+    def __init__(self):
+        self.stack = []  # [栈路径, 开始时间, 子调用耗时]
+        self.counts = Counter()
+
+    def __call__(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            label = _label(frame.f_code) if event == 'call' else f'{getattr(arg, "__qualname__", arg)} (builtin)'
+            path = self.stack[-1][0] + ';' + label if self.stack else label
+            self.stack.append([path, now, 0.0])
+        elif self.stack and (event == 'return' or event == 'c_return' or event == 'c_exception'):
+            # 开始剖析之前已在栈上的函数返回时栈为空，直接忽略
+            path, start, children = self.stack.pop()
+            elapsed = now - start
+            self.counts[path] += int((elapsed - children) * 1e6)
+            if self.stack:
+                self.stack[-1][2] += elapsed
+
+
+class RequestProfiler:
+    """保存开关状态、选择要剖析的请求并写出剖析文件"""
+
+    def __init__(self):
+        self.directory = 'profiles'
+        self.max_captures = 100
+        self.interval = 0.001
+        self.rate = 0.0
+        self.endpoint = None
+        self.mode = 'sample'
+        self.until = 0.0
+        self.captured = 0
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.rate > 0 and time.time() < self.until
+
+    def configure(self, rate, endpoint=None, mode='sample', seconds=600):
+        """开启剖析（rate 为 0 时关闭），返回当前设置
+
+        请求线程不加锁读取这些属性：先启动采样线程，再发布设置，最后发布 rate，
+        保证请求看到开启时采样线程已经存在。
+        """
+        with self._lock:
+            if rate > 0 and mode == 'sample' and self._sampler is None:
+                self._sampler = _Sampler(self.interval)
+                self._sampler.start()
+            self.rate = 0.0
+            self.endpoint = endpoint
+            self.mode = mode
+            self.until = time.time() + seconds
+            self.rate = rate
+        return self.settings()
+
+    def settings(self):
+        return {
+            'active': self.active,
+            'rate': self.rate,
+            'endpoint': self.endpoint,
+            'mode': self.mode,
+            'until': datetime.fromtimestamp(self.until).isoformat(timespec='seconds') if self.active else None,
+            'captured': self.captured,
+        }
+
+    def start(self):
+        """before_request：选中时开始剖析当前请求"""
+        if not self.active or (self.endpoint and request.endpoint != self.endpoint):
+            return
+        if self.rate < 1 and random.random() >= self.rate:
+            return
+        if self.mode == 'trace':
+            tracer = _Tracer()
+            g.profile = ('trace', tracer.counts, time.perf_counter())
+            sys.setprofile(tracer)
+        else:
+            g.profile = ('sample', self._sampler.add(threading.get_ident()), time.perf_counter())
+
+    def stop(self, exc=None):
+        """teardown_request：停止剖析并写出文件"""
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        mode, counts, started = profile
+        if mode == 'trace':
+            sys.setprofile(None)
+        else:
+            self._sampler.remove(threading.get_ident())
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if counts:
+            self._write(mode, request.endpoint or 'unmatched', elapsed_ms, counts)
+
+    def _write(self, mode, endpoint, elapsed_ms, counts):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f'{datetime.now():%Y%m%d-%H%M%S-%f}-{endpoint.replace(".", "_")}-{mode}-{elapsed_ms:.0f}ms.folded'
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in counts.items() if count > 0)
+        self.captured += 1
+        # 轮转：只保留最新的 max_captures 个文件
+        captures = self.list_captures()
+        for capture in captures[self.max_captures:]:
+            try:
+                os.remove(os.path.join(self.directory, capture['name']))
+            except FileNotFoundError:
+                pass
+
+    def list_captures(self):
+        """列出剖析文件，最新的在前"""
+        if not os.path.isdir(self.directory):
+            return []
+        captures = []
+        for name in os.listdir(self.directory):
+            if _CAPTURE_NAME.match(name):
+                stat = os.stat(os.path.join(self.directory, name))
+                captures.append({'name': name, 'size': stat.st_size,
+                                 'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')})
+        captures.sort(key=lambda capture: capture['name'], reverse=True)
+        return captures
+
+    def capture_path(self, name):
+        """返回剖析文件的路径，文件名非法或不存在时返回 None"""
+        if not _CAPTURE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+request_profiler = RequestProfiler()
+
+
+def init_profiler(app):
+    """读取配置并注册请求钩子；未开启剖析时每个请求只多一次属性检查，同一个应用只注册一次"""
+    request_profiler.directory = app.config.get(
+        'PROFILE_DIR', os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles')))
+    request_profiler.max_captures = int(app.config.get('PROFILE_MAX_CAPTURES', os.environ.get('PROFILE_MAX_CAPTURES', 100)))
+    request_profiler.interval = float(app.config.get(
+        'PROFILE_SAMPLE_INTERVAL_MS', os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 1))) / 1000
+    if 'request_profiler' in app.extensions:
+        return
+    app.extensions['request_profiler'] = request_profiler
+    app.before_request(request_profiler.start)
+    app.teardown_request(request_profiler.stop)
@@ -0,0 +1,181 @@
+"""排班已预约人数（DoctorSchedule.*_booked）和小时段占用位图（*_slots）与预约记录的增量校对
+
+预约和取消时计数器在同一个事务中增减，正常情况下不会偏离；但直接改库、旧版本的删除接口
+或异常中断都可能留下偏差，偏差会导致号被超卖或永远约不满。校对流程：
+  1. 迁移 v4 创建的触发器在预约增删改时把日期写入 appointment_change
+  2. 每次校对只检查上次高水位之后有变化的日期（首次运行或 full=True 时检查整个预约窗口）
+  3. 用一条 GROUP BY doctor_id, appointment_date, appointment_period 统计真实人数和预约占用的小时段，
+     和排班表连接后只取出人数或位图不一致的行
+  4. 逐行用带旧值条件的 UPDATE 同时修正人数和位图，期间被并发预约改过的行跳过，留给下一次校对
+  5. 清理已处理的变更记录，保存新的高水位，只提交一次
+统计结果见 reconcile_stats()，管理员接口为 /admin/reconcile。
+
+命令行用法（在 backend 目录下），建议由 cron 每隔几分钟执行一次：
+    flask --app backend reconcile-counters [--full]
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from database import (db, AppointmentChange, DoctorSchedule, ReconcileState, availability_cache,
+                      _publish_slot)
+from schedule_horizon import horizon_days
+
+STATE_NAME = 'booked_counters'
+
+_MISMATCH_SQL = """
+WITH counts AS (
+    -- 每个小时段最多一个预约（唯一索引 uq_appointment_slot_time），按位求和等于按位或；没有小时段的旧预约不占位
+    SELECT a.doctor_id, a.appointment_date, a.appointment_period, COUNT(*) AS n,
+           COALESCE(SUM(1 << (a.slot_offset / s.slot_minutes)), 0) AS mask
+    FROM appointment AS a
+    JOIN doctor_schedule AS s ON s.doctor_id = a.doctor_id AND s.date = a.appointment_date
+    WHERE a.appointment_date IN :dates
+    GROUP BY a.doctor_id, a.appointment_date, a.appointment_period
+)
+SELECT s.id, s.doctor_id, s.date, s.morning_booked, s.afternoon_booked, s.morning_limit, s.afternoon_limit,
+       s.morning_slots, s.afternoon_slots,
+       COALESCE(m.n, 0) AS morning_actual, COALESCE(a.n, 0) AS afternoon_actual,
+       COALESCE(m.mask, 0) AS morning_mask, COALESCE(a.mask, 0) AS afternoon_mask
+FROM doctor_schedule AS s
+LEFT JOIN counts AS m ON m.doctor_id = s.doctor_id AND m.appointment_date = s.date AND m.appointment_period = '上午'
+LEFT JOIN counts AS a ON a.doctor_id = s.doctor_id AND a.appointment_date = s.date AND a.appointment_period = '下午'
+WHERE s.date IN :dates
+  AND (s.morning_booked != COALESCE(m.n, 0) OR s.afternoon_booked != COALESCE(a.n, 0)
+       OR s.morning_slots != COALESCE(m.mask, 0) OR s.afternoon_slots != COALESCE(a.mask, 0))
+"""
+_mismatch_query = text(_MISMATCH_SQL).bindparams(bindparam('dates', expanding=True))
+_count_query = text('SELECT COUNT(*) FROM doctor_schedule WHERE date IN :dates').bindparams(
+    bindparam('dates', expanding=True))
+
+
+class ReconcileStats:
+    """最近一次和累计的校对结果"""
+
+    def __init__(self):
+        self.runs = 0
+        self.rows_repaired = 0
+        self.total_drift = 0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.runs += 1
+            self.rows_repaired += result['rows_repaired']
+            self.total_drift += result['total_drift']
+            self.last = result
+
+    def snapshot(self):
+        with self._lock:
+            return {'runs': self.runs, 'rows_repaired': self.rows_repaired,
+                    'total_drift': self.total_drift, 'last': self.last}
+
+
+stats = ReconcileStats()
+
+
+def reconcile_stats():
+    """返回校对统计"""
+    return stats.snapshot()
+
+
+def _dirty_dates(start, end, high_water):
+    """高水位之后有预约变化、且在预约窗口内的日期"""
+    rows = db.session.query(AppointmentChange.appointment_date).filter(
+        AppointmentChange.id > high_water,
+        AppointmentChange.appointment_date.between(start, end)
+    ).distinct().all()
+    return [row[0] for row in rows]
+
+
+def reconcile_booked_counters(full=False, today=None):
+    """
+    校对预约窗口内排班的已预约人数和小时段占用位图，修正与预约记录不一致的行
+    返回本次的统计：检查的日期数和排班行数、不一致行数、修正行数（其中修正了位图的行数）、人数偏差总和与最大值、
+    修正后仍超出上限的时间段数、耗时和新的高水位
+    """
+    t0 = time.perf_counter()
+    today = today or datetime.today().date()
+    start, end = today, today + timedelta(days=horizon_days() - 1)
+
+    state = db.session.get(ReconcileState, STATE_NAME)
+    # 先取高水位再统计：之后提交的预约变更序号一定更大，会在下一次校对中检查
+    # 已处理的变更记录会被清理，日志为空时沿用原来的高水位
+    high_water = db.session.query(db.func.max(AppointmentChange.id)).scalar() or (state.high_water if state else 0)
+    full = full or state is None
+    if full:
+        dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    else:
+        dates = _dirty_dates(start, end, state.high_water)
+
+    rows_checked = mismatched = repaired = bitmaps_repaired = total_drift = max_drift = over_limit = 0
+    slots = []
+    if dates:
+        params = {'dates': [date.isoformat() for date in dates]}
+        rows_checked = db.session.execute(_count_query, params).scalar()
+        rows = db.session.execute(_mismatch_query, params).all()
+        mismatched = len(rows)
+        for row in rows:
+            result = db.session.execute(
+                db.update(DoctorSchedule)
+                .where(DoctorSchedule.id == row.id,
+                       DoctorSchedule.morning_booked == row.morning_booked,
+                       DoctorSchedule.afternoon_booked == row.afternoon_booked,
+                       DoctorSchedule.morning_slots == row.morning_slots,
+                       DoctorSchedule.afternoon_slots == row.afternoon_slots)
+                .values(morning_booked=row.morning_actual, afternoon_booked=row.afternoon_actual,
+                        morning_slots=row.morning_mask, afternoon_slots=row.afternoon_mask)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                # 被并发预约改过，它产生的变更记录会让下一次校对重新检查这一天
+                continue
+            repaired += 1
+            bitmaps_repaired += row.morning_slots != row.morning_mask or row.afternoon_slots != row.afternoon_mask
+            drift = abs(row.morning_actual - row.morning_booked) + abs(row.afternoon_actual - row.afternoon_booked)
+            total_drift += drift
+            max_drift = max(max_drift, drift)
+            over_limit += (row.morning_actual > row.morning_limit) + (row.afternoon_actual > row.afternoon_limit)
+            date = datetime.strptime(row.date, '%Y-%m-%d').date()
+            if row.morning_actual != row.morning_booked:
+                slots.append((row.doctor_id, date, '上午', row.morning_actual, row.morning_limit))
+            if row.afternoon_actual != row.afternoon_booked:
+                slots.append((row.doctor_id, date, '下午', row.afternoon_actual, row.afternoon_limit))
+
+    # 窗口之外（已过期）的变更不再需要校对，和已处理的一起清理
+    db.session.query(AppointmentChange).filter(AppointmentChange.id <= high_water).delete(synchronize_session=False)
+    if state is None:
+        state = ReconcileState(name=STATE_NAME)
+        db.session.add(state)
+    state.high_water = high_water
+    state.updated_at = finished_at = datetime.now()
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if slots:
+        availability_cache.invalidate()
+        for slot in slots:
+            _publish_slot(*slot)
+
+    result = {
+        'full': full,
+        'dates_checked': len(dates),
+        'rows_checked': rows_checked,
+        'rows_mismatched': mismatched,
+        'rows_repaired': repaired,
+        'bitmaps_repaired': bitmaps_repaired,
+        'total_drift': total_drift,
+        'max_drift': max_drift,
+        'over_limit': over_limit,
+        'high_water': high_water,
+        'seconds': round(time.perf_counter() - t0, 4),
+        'finished_at': finished_at.isoformat(timespec='seconds'),
+    }
+    stats.record(result)
+    return result
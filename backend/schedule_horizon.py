@@ -0,0 +1,95 @@
+"""排班预约窗口配置与后台排班生成线程
+
+患者可以预约从今天起 horizon 天内的号。每天需要为所有医生补齐窗口内缺少的排班
+（按医生的每周模板生成），并把过期的排班移到归档表，见 database.materialize_schedules。
+
+配置（环境变量）：
+    SCHEDULE_HORIZON_DAYS      预约窗口天数，默认 14，最大 180
+    SCHEDULE_RETENTION_DAYS    过期排班在排班表中保留的天数，之后移到归档表，默认 7
+    SCHEDULE_DEFAULT_LIMIT     没有设置每周模板的医生每个时间段的默认上限，默认 10
+    SCHEDULE_MATERIALIZER      设为 1 时 create_app 启动后台线程，每天自动生成一次；
+                               默认不启动，推荐用 cron 每天执行 flask --app backend materialize-schedules
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+MAX_HORIZON_DAYS = 180  # 日期标签不含年份，窗口不能超过半年
+
+_horizon_days = int(os.environ.get('SCHEDULE_HORIZON_DAYS', 14))
+_retention_days = int(os.environ.get('SCHEDULE_RETENTION_DAYS', 7))
+_default_limit = int(os.environ.get('SCHEDULE_DEFAULT_LIMIT', 10))
+
+
+def configure(horizon_days=None, retention_days=None, default_limit=None):
+    """修改预约窗口、保留天数或默认上限"""
+    global _horizon_days, _retention_days, _default_limit
+    if horizon_days is not None:
+        _horizon_days = horizon_days
+    if retention_days is not None:
+        _retention_days = retention_days
+    if default_limit is not None:
+        _default_limit = default_limit
+
+
+def horizon_days():
+    """预约窗口天数（包含今天）"""
+    return max(1, min(_horizon_days, MAX_HORIZON_DAYS))
+
+
+def retention_days():
+    """过期排班在排班表中保留的天数"""
+    return max(0, _retention_days)
+
+
+def default_limit():
+    """没有每周模板时每个时间段的默认上限"""
+    return _default_limit
+
+
+class Materializer(threading.Thread):
+    """后台线程：日期变化后在应用上下文中执行一次 job，之后每 interval 秒检查一次日期"""
+
+    def __init__(self, app, job, interval=60):
+        super().__init__(name='schedule-materializer', daemon=True)
+        self.app = app
+        self.job = job
+        self.interval = interval
+        self.last_run = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            today = datetime.today().date()
+            if today != self.last_run:
+                t0 = time.perf_counter()
+                try:
+                    with self.app.app_context():
+                        result = self.job()
+                    self.last_run = today
+                    print(f'Schedules materialized for {today}: {result} in {time.perf_counter() - t0:.2f}s')
+                except Exception as e:
+                    # 失败后下一轮重试，不让线程退出
+                    print(f'Schedule materializer failed: {e!r}')
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_materializer = None
+_lock = threading.Lock()
+
+
+def start_materializer(app, job, interval=60):
+    """启动后台排班生成线程并返回；每个进程只保留一个线程，同一个应用重复调用时返回已有的线程"""
+    global _materializer
+    with _lock:
+        if _materializer is not None and _materializer.is_alive():
+            if _materializer.app is app:
+                return _materializer
+            _materializer.stop()
+        _materializer = Materializer(app, job, interval)
+        _materializer.start()
+        return _materializer
@@ -0,0 +1,162 @@
+"""列表接口的序列化
+
+查询返回的行（元组）按每个接口预先定义的字段表转换成 dict，再编码成 JSON：
+  - 字段表中每个字段是一个以 row 为变量的表达式，整张表编译成一个函数，
+    转换一行只执行一次字典字面量，没有逐字段的函数调用和分支
+  - 客户端可以用 ?fields=a,b 只取需要的字段，每种字段组合编译一次后缓存
+  - 安装了 orjson 时用它编码，否则退回标准库 json
+"""
+import json
+
+from flask import Response, request, stream_with_context
+
+from time_slots import slot_time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 是可选依赖
+    orjson = None
+
+if orjson is not None:
+    def dumps(data):
+        """编码成 UTF-8 JSON 字节串"""
+        return orjson.dumps(data)
+else:
+    def dumps(data):
+        """编码成 UTF-8 JSON 字节串"""
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    """代替 jsonify，返回 JSON 响应"""
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+class InvalidFields(ValueError):
+    """?fields= 中包含未知字段"""
+
+
+class RowSerializer:
+    """
+    把查询结果行转换成 dict
+    fields 为 (输出字段名, 表达式) 的序列，表达式中 row 是一行查询结果，
+    其他变量（如地址前缀）在调用时通过关键字参数传入
+    """
+
+    def __init__(self, fields, *context):
+        self.fields = dict(fields)
+        self.context = context
+        self._compiled = {}
+
+    def compile(self, names=None):
+        """返回只包含 names 中字段（按定义顺序）的转换函数"""
+        key = None if names is None else frozenset(names)
+        to_dict = self._compiled.get(key)
+        if to_dict is None:
+            items = ', '.join(f'{name!r}: {expression}' for name, expression in self.fields.items()
+                              if key is None or name in key)
+            args = ', '.join(('row',) + self.context)
+            to_dict = self._compiled[key] = eval(f'lambda {args}: {{{items}}}')
+        return to_dict
+
+    def for_request(self):
+        """按请求的 ?fields= 返回转换函数，包含未知字段时抛出 InvalidFields"""
+        names = requested_fields(self.fields)
+        return self.compile(names)
+
+
+def requested_fields(available):
+    """解析 ?fields=a,b，未传时返回 None（全部字段）"""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise InvalidFields(f'Unknown fields: {", ".join(unknown)}; available: {", ".join(available)}')
+    return names
+
+
+def select_fields(items, names):
+    """从已经构建好的 dict 列表中只保留 names 中的字段"""
+    if names is None:
+        return items
+    return [{name: item[name] for name in names} for item in items]
+
+
+# 流式响应每次写出的行数
+STREAM_CHUNK_ROWS = 1000
+
+
+def stream_json_array(rows, to_dict, **context):
+    """把逐行产出的数据编码成 JSON 数组流式返回，每攒够一批整体编码一次"""
+    def generate():
+        yield b'['
+        chunk = []
+        first = True
+        for row in rows:
+            chunk.append(to_dict(row, **context))
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                # 整批编码成数组后去掉首尾的方括号，比逐行编码快
+                yield (b'' if first else b',') + dumps(chunk)[1:-1]
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else b',') + dumps(chunk)[1:-1]
+        yield b']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+# 各列表接口的字段表，行的列顺序见 database 中对应的查询
+
+USER_FIELDS = RowSerializer([  # get_users_page
+    ('idNumber', 'row[0]'),
+    ('name', 'row[1] or ""'),
+    ('gender', 'row[2] or ""'),
+    ('address', 'row[3] or ""'),
+    ('phone', 'row[4] or ""'),
+    ('emergencyContact', 'row[5] or ""'),
+])
+
+DOCTOR_FIELDS = RowSerializer([  # get_doctors_page
+    ('employeeId', 'row[0]'),
+    ('name', 'row[1] or ""'),
+    ('gender', 'row[2] or ""'),
+    ('title', 'row[3] or ""'),
+    ('department', 'row[4] or ""'),
+    ('office', 'row[5] or ""'),
+    ('phone', 'row[6] or ""'),
+    ('avatar', 'f"{avatar_prefix}/{row[0]}/avatar?v={row[7][:16]}" if row[7] else ""'),
+    ('avatar_hash', 'row[7] or ""'),
+    ('flag', 'row[8]'),
+], 'avatar_prefix')
+
+APPOINTMENT_FIELDS = RowSerializer([  # get_appointments_page
+    ('appointment_id', 'row[0]'),
+    ('user_name', 'row[1] or ""'),
+    ('doctor_name', 'row[2] or ""'),
+    ('appointment_time', 'row[3].isoformat() + " " + row[4]'),
+])
+
+DOCTOR_APPOINTMENT_FIELDS = RowSerializer([  # get_doctor_appointments_page
+    ('id', 'row[0]'),
+    ('user_id', 'row[1]'),
+    ('user_name', 'row[2]'),
+    ('user_gender', 'row[3]'),
+    ('appointment_date', 'row[4].isoformat()'),
+    ('appointment_period', 'row[5]'),
+    ('appointment_time', 'slot_time(row[5], row[6])'),
+])
+
+WAITLIST_FIELDS = RowSerializer([  # get_user_waitlist
+    ('id', 'row[0]'),
+    ('doctor_id', 'row[1]'),
+    ('doctor_name', 'row[2]'),
+    ('appointment_date', 'row[3].isoformat()'),
+    ('appointment_period', 'row[4]'),
+    ('created_at', 'row[5].isoformat(timespec="seconds")'),
+    ('position', 'row[6]'),
+])
+
+# get_doctors_availability 返回的医生字段
+AVAILABILITY_FIELDS = ('id', 'name', 'gender', 'title', 'department', 'office', 'phone', 'available_times')
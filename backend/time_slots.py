@@ -0,0 +1,100 @@
+"""号源的细分时段与占用位图
+
+每个医生每天的上午、下午各分成若干个等长的小时段（如 15 分钟一个），
+粒度记在排班的 slot_minutes 列中，可以按医生、按天设置。每个时间段的占用情况是一个整数位图
+（DoctorSchedule.morning_slots / afternoon_slots）：第 i 位为 1 表示从时间段开始后第 i 个小时段已被预约。
+  - 某个小时段是否空闲、第一个空闲的小时段、空闲数都只是几次整数位运算，
+    预约和取消在数据库中用同一条带条件的 UPDATE 置位或清位
+  - 预约记录的 slot_offset 为小时段开始时间距时间段开始的分钟数，修改粒度前必须没有分到小时段的预约
+  - 原来的 上午/下午 计数和上限不变，现有接口看到的仍是按半天汇总的名额
+
+配置（环境变量）：
+    SLOT_MINUTES    新生成的排班的小时段长度（分钟），默认 15，必须能整除半天的时长，且每个时间段不超过 MAX_SLOTS 个
+"""
+import os
+
+# 时间段 -> 开始时间（距零点的分钟数）；两个时间段等长
+PERIOD_STARTS = {'上午': 8 * 60, '下午': 14 * 60}
+PERIOD_MINUTES = 4 * 60
+MAX_SLOTS = 48  # 位图存在 SQLite 的 64 位整数中，留出余量
+
+
+def validate_slot_minutes(minutes):
+    """检查小时段长度是否合法，非法时抛出 ValueError"""
+    if not isinstance(minutes, int) or minutes <= 0 or PERIOD_MINUTES % minutes or PERIOD_MINUTES // minutes > MAX_SLOTS:
+        raise ValueError(f'slot_minutes must divide {PERIOD_MINUTES} into at most {MAX_SLOTS} slots')
+    return minutes
+
+
+_slot_minutes = validate_slot_minutes(int(os.environ.get('SLOT_MINUTES', 15)))
+
+
+def configure(slot_minutes=None):
+    """修改新生成的排班的小时段长度"""
+    global _slot_minutes
+    if slot_minutes is not None:
+        _slot_minutes = validate_slot_minutes(slot_minutes)
+
+
+def default_slot_minutes():
+    """新生成的排班的小时段长度（分钟）"""
+    return _slot_minutes
+
+
+def slot_count(minutes):
+    """每个时间段的小时段个数"""
+    return PERIOD_MINUTES // minutes
+
+
+def check_limit(limit, minutes, name):
+    """检查名额上限不超过小时段个数，超过时抛出 ValueError；超出的名额既约不上也不能候补"""
+    if limit > slot_count(minutes):
+        raise ValueError(f'{name} cannot exceed {slot_count(minutes)} slots')
+    return limit
+
+
+def is_free(mask, index):
+    """第 index 个小时段是否空闲"""
+    return not mask >> index & 1
+
+
+def first_free(mask, count):
+    """第一个空闲小时段的序号，没有时返回 None；~mask & (mask + 1) 只保留最低的 0 位"""
+    index = (~mask & (mask + 1)).bit_length() - 1
+    return index if index < count else None
+
+
+def free_count(mask, count):
+    """空闲的小时段个数"""
+    return count - (mask & ((1 << count) - 1)).bit_count()
+
+
+def free_indexes(mask, count):
+    """所有空闲小时段的序号"""
+    free = ~mask & ((1 << count) - 1)
+    indexes = []
+    while free:
+        low = free & -free
+        indexes.append(low.bit_length() - 1)
+        free ^= low
+    return indexes
+
+
+def slot_time(period, offset):
+    """小时段的开始时间 "HH:MM"，offset 为 None（没有分到小时段的旧预约）时返回 None"""
+    if offset is None:
+        return None
+    minutes = PERIOD_STARTS[period] + offset
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def parse_slot_time(period, value):
+    """把 "HH:MM" 转换成距时间段开始的分钟数，不在这个时间段内或格式非法时抛出 ValueError"""
+    try:
+        hours, minutes = value.split(':')
+        offset = int(hours) * 60 + int(minutes) - PERIOD_STARTS[period]
+    except (AttributeError, KeyError, ValueError):
+        raise ValueError(f'Invalid appointment_time {value!r}, expected HH:MM')
+    if not 0 <= offset < PERIOD_MINUTES:
+        raise ValueError(f'appointment_time {value} is outside the {period} period')
+    return offset